@@ -0,0 +1,96 @@
+'''
+Latency of analytic questions (counts, group-bys, top-N over the interaction tables) on SQLite and on
+the columnar engine (DuckDB over the Parquet export), and of point lookups, with the engine the
+router picks for each
+
+usage (from the llmao/ directory, needs duckdb)
+    python -m benchmarks.bench_backends                         # synthetic database
+    python -m benchmarks.bench_backends --db ./aopdb_08-25-2020.db --rounds 5
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import make_aop_db, percentile
+from utils.backends import ColumnarBackend, ColumnarError, RoutingBackend
+from utils.catalog import SchemaCatalog
+from utils.columnar import export_parquet, parquet_path
+from utils.connection import ConnectionPool
+from utils.execution import QueryExecutor, table_aliases
+
+# the interaction tables the analytic questions scan
+EXPORTED = ['chemical_gene', 'gene_pathway', 'disease_gene']
+
+# (name, query) pairs, aggregates first, then lookups SQLite answers from an index
+QUERIES = [
+    ('chemicals with most genes',
+     'SELECT ChemicalID, COUNT(DISTINCT GeneID) AS genes FROM chemical_gene GROUP BY ChemicalID '
+     'ORDER BY genes DESC, ChemicalID LIMIT 10;'),
+    ('interactions per action', 'SELECT InteractionActions, COUNT(*) FROM chemical_gene GROUP BY InteractionActions ORDER BY 1;'),
+    ('distinct pathways', 'SELECT COUNT(DISTINCT PathwayID) FROM gene_pathway;'),
+    ('genes in most diseases',
+     'SELECT GeneID, COUNT(DISTINCT DiseaseID) AS diseases FROM disease_gene GROUP BY GeneID ORDER BY diseases DESC, GeneID LIMIT 10;'),
+    ('chemicals per gene',
+     'SELECT cg.GeneID, COUNT(DISTINCT cg.ChemicalID) AS chemicals, COUNT(DISTINCT gp.PathwayID) AS pathways '
+     'FROM chemical_gene cg JOIN gene_pathway gp ON gp.GeneID = cg.GeneID GROUP BY cg.GeneID ORDER BY chemicals DESC, 1 LIMIT 10;'),
+    ('chemical by id', "SELECT ChemicalName FROM chemical_info WHERE ChemicalID = 'MESH:C000001';"),
+    ('gene by id', 'SELECT GeneSymbol, GeneName FROM gene_info WHERE GeneID = 42;'),
+]
+
+
+def timed(backend, query, rounds):
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = backend.run(query, use_cache=False)
+        latencies.append(time.perf_counter() - start)
+    return latencies, result.rows
+
+
+def run(db_name, rounds, out_dir):
+    catalog = SchemaCatalog(db_name, sidecar=os.path.join(tempfile.gettempdir(), 'bench_backends_catalog.json'))
+    if not os.path.exists(out_dir):
+        start = time.perf_counter()
+        manifest = export_parquet(db_name, out_dir, [table for table in EXPORTED if table in catalog.tables], catalog)
+        print('exported %d tables (%d rows) in %.2f s' % (len(manifest), sum(entry['rows'] for entry in manifest.values()),
+                                                          time.perf_counter() - start))
+    pool = ConnectionPool(db_name)
+    # guardrails off, so both engines run every query in full
+    sqlite = QueryExecutor(pool, catalog, time_budget=None, large_table_rows=sys.maxsize, use_cache=False)
+    columnar = ColumnarBackend(out_dir, catalog=catalog, time_budget=None, use_cache=False)
+    router = RoutingBackend(sqlite, columnar, pool, catalog)
+
+    print('%-28s %12s %12s %8s %7s %6s' % ('query', 'sqlite p50 ms', 'duckdb p50 ms', 'speedup', 'routed', 'same'))
+    for name, query in QUERIES:
+        row, row_rows = timed(sqlite, query, rounds)
+        engine = router.choose(query)
+        column = None
+        # lookups in tables that were not exported only run on SQLite
+        if set(table_aliases(query).values()) <= set(columnar.tables):
+            try:
+                column, column_rows = timed(columnar, query, rounds)
+            except ColumnarError as error:
+                print('%s: %s' % (name, error))
+        if column is None:
+            print('%-28s %12.3f %12s %8s %7s %6s' % (name, 1000 * percentile(row, 50), '-', '-', engine, '-'))
+            continue
+        same = sorted(map(tuple, column_rows)) == sorted(map(tuple, row_rows))
+        print('%-28s %12.3f %12.3f %7.1fx %7s %6s' % (name, 1000 * percentile(row, 50), 1000 * percentile(column, 50),
+                                                      percentile(row, 50) / percentile(column, 50), engine, same))
+    pool.close_all()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='path to the AOP database, a synthetic one is built if omitted')
+    parser.add_argument('--scale', type=int, default=50000, help='size of the synthetic database')
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.db:
+        run(args.db, args.rounds, parquet_path(args.db))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_name = make_aop_db(os.path.join(tmp_dir, 'aop.db'), scale=args.scale)
+            run(db_name, args.rounds, parquet_path(db_name))
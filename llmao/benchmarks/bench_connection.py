@@ -0,0 +1,68 @@
+'''
+Per-question SQLite latency: connect-per-call (the old AOP_query_chain behavior) vs the pooled read-only connection
+
+usage (from the llmao/ directory)
+    python -m benchmarks.bench_connection                      # synthetic database
+    python -m benchmarks.bench_connection --db ./aopdb_08-25-2020.db --rounds 50
+'''
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from benchmarks.synthetic import QUESTIONS, make_aop_db, percentile
+from utils.connection import ConnectionPool
+
+
+def connect_per_call(db_name, query):
+    sqliteConnection = sqlite3.connect(db_name)
+    cursor = sqliteConnection.cursor()
+    cursor.execute(query)
+    result = cursor.fetchall()
+    cursor.close()
+    sqliteConnection.close()
+    return result
+
+
+def pooled(pool, query):
+    with pool.cursor() as cursor:
+        cursor.execute(query)
+        return cursor.fetchall()
+
+
+def run(db_name, rounds):
+    pool = ConnectionPool(db_name)
+    queries = list(QUESTIONS.values())
+    timings = {'connect-per-call': [], 'pooled': []}
+    for _ in range(rounds):
+        for query in queries:
+            start = time.perf_counter()
+            connect_per_call(db_name, query)
+            timings['connect-per-call'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            pooled(pool, query)
+            timings['pooled'].append(time.perf_counter() - start)
+    pool.close_all()
+
+    print('%-18s %10s %10s %10s' % ('mode', 'mean ms', 'p50 ms', 'p95 ms'))
+    for mode, values in timings.items():
+        print('%-18s %10.3f %10.3f %10.3f' % (mode, 1000 * sum(values) / len(values),
+                                                1000 * percentile(values, 50), 1000 * percentile(values, 95)))
+    speedup = sum(timings['connect-per-call']) / sum(timings['pooled'])
+    print('pooled speedup: %.1fx over %d questions' % (speedup, len(timings['pooled'])))
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='path to the AOP database, a synthetic one is built if omitted')
+    parser.add_argument('--scale', type=int, default=5000, help='size of the synthetic database')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.db:
+        run(args.db, args.rounds)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run(make_aop_db(os.path.join(tmp_dir, 'aop.db'), scale=args.scale), args.rounds)
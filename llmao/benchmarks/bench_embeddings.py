@@ -0,0 +1,49 @@
+'''
+Offline semantic similarity throughput with the local hashing embedding provider
+
+Scores every (question, AI response) pair of data/data.csv the way answer_relevancy and
+correctness do, without any network access.
+
+usage (from the llmao/ directory)
+    python -m benchmarks.bench_embeddings --repeat 20
+'''
+import argparse
+import time
+import pandas as pd
+from eval.embeddings import HashingEmbeddingProvider, EmbeddingCache, cosine
+
+
+def run(data_path, repeat, fit):
+    sample_df = pd.read_csv(data_path)
+    pairs = list(zip(sample_df['Question'].astype(str), sample_df['AI_Response'].astype(str))) * repeat
+
+    provider = HashingEmbeddingProvider()
+    if fit:
+        provider = provider.fit([text for pair in pairs for text in pair])
+
+    # cold: every text is vectorized, no cache
+    start = time.perf_counter()
+    vectors = provider.embed_documents([text for pair in pairs for text in pair])
+    scores = [cosine(vectors[2 * i], vectors[2 * i + 1]) for i in range(len(pairs))]
+    cold = time.perf_counter() - start
+
+    # warm: through the in-memory cache, as repeated evaluation runs over the same dataset would be
+    cache = EmbeddingCache(provider.model_id, embedder=provider.embed_documents, path=None)
+    cache.embed([text for pair in pairs for text in pair])
+    start = time.perf_counter()
+    for question, response in pairs:
+        cosine(*cache.embed([question, response]))
+    warm = time.perf_counter() - start
+
+    print('%d pairs, mean similarity %.3f' % (len(pairs), sum(scores) / len(scores)))
+    print('cold (vectorize + score): %10.0f pairs/s' % (len(pairs) / cold))
+    print('warm (cached vectors):    %10.0f pairs/s' % (len(pairs) / warm))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default='./data/data.csv')
+    parser.add_argument('--repeat', type=int, default=10, help='times to repeat the dataset')
+    parser.add_argument('--fit', action='store_true', help='learn idf weights on the dataset first')
+    args = parser.parse_args()
+    run(args.data, args.repeat, args.fit)
@@ -0,0 +1,79 @@
+'''
+Latency of text lookups written as LIKE '%...%' scans (before) and as FTS5 MATCH lookups joined
+back to the base table on rowid (after)
+
+usage (from the llmao/ directory)
+    python -m benchmarks.bench_fulltext                        # synthetic database
+    python -m benchmarks.bench_fulltext --db ./aopdb_08-25-2020.db --rounds 5
+'''
+import argparse
+import os
+import tempfile
+import time
+from benchmarks.synthetic import make_aop_db, percentile
+from utils.catalog import SchemaCatalog
+from utils.connection import ConnectionPool
+from utils.fulltext import SCHEMA, build_fulltext_index, fulltext_path
+
+# (name, LIKE query, MATCH query) pairs returning the same rows
+LOOKUPS = [
+    ('chemical by name',
+     "SELECT ChemicalID, ChemicalName FROM chemical_info WHERE ChemicalName LIKE '%chlorobenzene%';",
+     "SELECT c.ChemicalID, c.ChemicalName FROM fts_chemical_info JOIN chemical_info c ON c.rowid = fts_chemical_info.rowid "
+     "WHERE fts_chemical_info MATCH 'ChemicalName : chlorobenzene';"),
+    ('events by title word',
+     "SELECT event_id, event_title FROM event_info WHERE event_title LIKE '%thyroid%' LIMIT 20;",
+     "SELECT e.event_id, e.event_title FROM fts_event_info JOIN event_info e ON e.rowid = fts_event_info.rowid "
+     "WHERE fts_event_info MATCH 'thyroid' LIMIT 20;"),
+    ('genes by name word',
+     "SELECT GeneID, GeneName FROM gene_info WHERE GeneName LIKE '%estrogen%' LIMIT 20;",
+     "SELECT g.GeneID, g.GeneName FROM fts_gene_info JOIN gene_info g ON g.rowid = fts_gene_info.rowid "
+     "WHERE fts_gene_info MATCH 'estrogen' LIMIT 20;"),
+    ('diseases by two words',
+     "SELECT GeneID, DiseaseName FROM disease_gene WHERE DiseaseName LIKE '%liver%' AND DiseaseName LIKE '%carcinoma%';",
+     "SELECT d.GeneID, d.DiseaseName FROM fts_disease_gene JOIN disease_gene d ON d.rowid = fts_disease_gene.rowid "
+     "WHERE fts_disease_gene MATCH 'liver AND carcinoma';"),
+]
+
+
+def timed(pool, query, rounds):
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        with pool.cursor() as cursor:
+            cursor.execute(query)
+            rows = cursor.fetchall()
+        latencies.append(time.perf_counter() - start)
+    return latencies, len(rows)
+
+
+def run(db_name, rounds, fts_name):
+    catalog = SchemaCatalog(db_name, sidecar=os.path.join(tempfile.gettempdir(), 'bench_fulltext_catalog.json'))
+    if not os.path.exists(fts_name):
+        start = time.perf_counter()
+        manifest = build_fulltext_index(db_name, fts_name, catalog=catalog)
+        print('built %d fts tables in %.2f s' % (len(manifest), time.perf_counter() - start))
+    pool = ConnectionPool(db_name, attach={SCHEMA: fts_name})
+
+    print('%-24s %12s %12s %8s %6s' % ('lookup', 'LIKE p50 ms', 'MATCH p50 ms', 'speedup', 'rows'))
+    for name, like_query, match_query in LOOKUPS:
+        like, like_rows = timed(pool, like_query, rounds)
+        match, match_rows = timed(pool, match_query, rounds)
+        print('%-24s %12.3f %12.3f %7.1fx %3d/%d' % (name, 1000 * percentile(like, 50), 1000 * percentile(match, 50),
+                                                     percentile(like, 50) / percentile(match, 50), match_rows, like_rows))
+    pool.close_all()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='path to the AOP database, a synthetic one is built if omitted')
+    parser.add_argument('--scale', type=int, default=50000, help='size of the synthetic database')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.db:
+        run(args.db, args.rounds, fulltext_path(args.db))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_name = make_aop_db(os.path.join(tmp_dir, 'aop.db'), scale=args.scale)
+            run(db_name, args.rounds, fulltext_path(db_name))
@@ -0,0 +1,54 @@
+'''
+Per-call chat model setup: a new BedrockChat per call (the old behavior of every call site) vs the
+shared ModelRegistry. Construction alone is measured offline (boto3 session, client and connection
+pool, no request is sent); --invoke also sends a one-token request per call, so the TLS handshake
+a fresh client pays on its first request is included.
+
+usage (from the llmao/ directory, needs boto3 and an AWS profile)
+    python -m benchmarks.bench_models
+    python -m benchmarks.bench_models --rounds 50 --invoke
+'''
+import argparse
+import time
+from benchmarks.synthetic import percentile
+from utils.models import AWS_PROFILE, CHAT_MODEL, EVAL_MODEL, TABLE_MODEL, ModelRegistry
+
+# the chat models a database question touches: table selection, SQL + answer, evaluation
+PIPELINE_MODELS = [TABLE_MODEL, CHAT_MODEL, CHAT_MODEL, EVAL_MODEL]
+
+
+def per_call(model_id):
+    from langchain_community.chat_models import BedrockChat
+    return BedrockChat(credentials_profile_name=AWS_PROFILE, model_id=model_id, verbose=True)
+
+
+def run(rounds, invoke):
+    registry = ModelRegistry()
+    timings = {'per-call': [], 'registry': []}
+    for _ in range(rounds):
+        for model_id in PIPELINE_MODELS:
+            for mode, build in (('per-call', per_call), ('registry', registry.get)):
+                start = time.perf_counter()
+                llm = build(model_id)
+                if invoke:
+                    llm.invoke('Reply with OK.')
+                timings[mode].append(time.perf_counter() - start)
+
+    print('%-10s %10s %10s %10s' % ('mode', 'mean ms', 'p50 ms', 'p95 ms'))
+    for mode, values in timings.items():
+        print('%-10s %10.3f %10.3f %10.3f' % (mode, 1000 * sum(values) / len(values),
+                                              1000 * percentile(values, 50), 1000 * percentile(values, 95)))
+    saved = (sum(timings['per-call']) - sum(timings['registry'])) / len(timings['registry'])
+    print('saved per call: %.2f ms, per question (%d model calls): %.2f ms'
+          % (1000 * saved, len(PIPELINE_MODELS), 1000 * saved * len(PIPELINE_MODELS)))
+    print('registry: %s' % registry.stats())
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--invoke', action='store_true', help='also send a short request with each model')
+    args = parser.parse_args()
+
+    run(args.rounds, args.invoke)
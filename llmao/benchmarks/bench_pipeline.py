@@ -0,0 +1,212 @@
+'''
+End-to-end pipeline benchmark: route -> AOP_route -> SQL generation -> execution -> SQL_context_parser
+-> answer -> Evaluator, with per-stage and end-to-end latency percentiles
+
+record runs the questions against live Bedrock and the real AOP-DB and saves every chat model call
+(stage, prompt, output, latency) to a fixture file. replay drives AOP_query_chain with a stub chat
+model answering from that fixture, so performance changes can be measured offline; the recorded
+latency (scaled) or a fixed one can be injected to approximate the live model.
+
+usage (from the llmao/ directory)
+    python -m benchmarks.bench_pipeline record --limit 20                     # needs Bedrock + AOP-DB
+    python -m benchmarks.bench_pipeline replay                               # no model latency
+    python -m benchmarks.bench_pipeline replay --latency-scale 1.0 --token-latency 0.01
+    python -m benchmarks.bench_pipeline replay --db ./synthetic.db --rounds 5
+    python -m benchmarks.bench_pipeline replay --concurrency 64 --latency-scale 1.0   # async pipeline
+    python -m benchmarks.bench_pipeline record --candidates 3                 # then replay --candidates 3
+'''
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import pandas as pd
+from benchmarks.replay import FIXTURE_PATH, LLMRecorder, ReplayBackend, load_fixture, save_fixture
+from benchmarks.synthetic import QUESTIONS, percentile
+from utils.models import ModelRegistry, set_model_registry
+from utils.timing import collect, stage
+
+# stages in pipeline order, stages that did not run for a question are left out of its timings
+STAGES = ['schema_load', 'route', 'question_cache', 'table_selection', 'sql_generation', 'sql_validation',
+          'sql_execution', 'sql_candidates', 'sql_repair', 'context_parsing', 'answer_first_token', 'answer', 'evaluation',
+          'end_to_end']
+
+
+def _isolate_caches():
+    '''
+    keep answers from earlier runs out of the measurement: a scratch question cache, an empty
+    result cache and no background evaluation (the harness evaluates synchronously)
+    '''
+    from eval.background import get_evaluation_queue
+    from utils.question_cache import QuestionCache, set_question_cache
+    from utils.result_cache import get_result_cache
+    set_question_cache(QuestionCache(path=os.path.join(tempfile.mkdtemp(), 'question_cache.db')))
+    get_result_cache().clear()
+    get_evaluation_queue().set_sampling_rate('aop_db', 0.0)
+
+
+def run_question(question: str, chat_history, classifier, metrics) -> tuple:
+    '''
+    run one question through the pipeline the way pages/app.py does (routing and table selection
+    concurrently), timing every stage
+    returns
+        ({stage: [seconds, ...]}, route label)
+    '''
+    from eval.evaluator import Evaluator
+    from utils.AOP_db_query import AOP_query_chain
+    from utils.pipeline import answer_question
+
+    with collect() as timings:
+        with stage('end_to_end'):
+            AOP_query_chain.context = None
+            label, chunks = answer_question(question, chat_history, classifier=classifier)
+            # the stream records answer_first_token and answer itself
+            answer = ''.join(chunks)
+            if label == 'database' and answer and AOP_query_chain.context is not None:
+                with stage('evaluation'):
+                    Evaluator(metrics=metrics, data=[[question, answer, AOP_query_chain.context]]).get_scores()
+    return timings, label
+
+
+def record_fixture(questions: list, path: str, metrics: list):
+    from utils.router import RouteClassifier
+
+    recorder = LLMRecorder()
+    set_model_registry(ModelRegistry(callbacks=[recorder]))
+    _isolate_caches()
+    classifier = RouteClassifier(log_path=None)
+
+    records = []
+    for question in questions:
+        timings, label = run_question(question, '', classifier, metrics)
+        calls = recorder.take()
+        records.append({'question': question, 'chat_history': '', 'route': label, 'timings': timings, 'calls': calls,
+                        'sql': [call['output'] for call in calls if call['stage'] in ('sql_generation', 'sql_repair')]})
+        print('%-70s %-8s %6.2f s, %d model calls' % (question[:70], label, timings['end_to_end'][0], len(calls)))
+    save_fixture(records, path)
+    print('recorded %d questions to %s' % (len(records), path))
+
+
+def replay_fixture(path: str, rounds: int, metrics: list, latency: float, latency_scale: float, token_latency: float) -> dict:
+    from eval.embeddings import set_provider
+    from utils.router import RouteClassifier
+
+    # embeddings (question cache, answer relevancy) come from the local backend, nothing calls AWS
+    set_provider(os.environ.get('LLMAO_EMBEDDINGS', 'local'))
+    backend = ReplayBackend(latency=latency, latency_scale=latency_scale, token_latency=token_latency)
+    # every call site takes its chat model from the registry, which now builds replay models
+    set_model_registry(backend.chat_model)
+    classifier = RouteClassifier(log_path=None)
+
+    records = load_fixture(path)
+    timings = {}
+    for _ in range(rounds):
+        _isolate_caches()
+        for fixture in records:
+            backend.load(fixture['calls'])
+            question_timings, _ = run_question(fixture['question'], fixture['chat_history'], classifier, metrics)
+            for name, values in question_timings.items():
+                # a stage running several times for one question (e.g. execution after a repair) counts once
+                timings.setdefault(name, []).append(sum(values))
+    if backend.misses:
+        print('%d model calls were replayed out of order, the pipeline prompts changed since recording' % backend.misses)
+    return timings
+
+
+async def _replay_concurrently(records: list, concurrency: int, classifier) -> list:
+    from utils.pipeline import AsyncPipeline, answer_question_async
+
+    pipeline = AsyncPipeline(max_in_flight=concurrency,
+                             answer=lambda question, chat_history: answer_question_async(question, chat_history, classifier))
+
+    async def run(fixture):
+        with collect() as timings:
+            with stage('end_to_end'):
+                await pipeline.answer(fixture['question'], fixture['chat_history'])
+        return timings
+
+    results = await asyncio.gather(*(run(fixture) for fixture in records))
+    print('peak questions in flight: %d' % pipeline.peak)
+    return results
+
+
+def replay_fixture_async(path: str, rounds: int, concurrency: int, latency: float, latency_scale: float,
+                         token_latency: float) -> dict:
+    '''
+    replay every question of the fixture at once through the async pipeline, at most concurrency in flight
+    '''
+    from eval.embeddings import set_provider
+    from utils.router import RouteClassifier
+
+    set_provider(os.environ.get('LLMAO_EMBEDDINGS', 'local'))
+    backend = ReplayBackend(latency=latency, latency_scale=latency_scale, token_latency=token_latency)
+    set_model_registry(backend.chat_model)
+    classifier = RouteClassifier(log_path=None)
+
+    records = load_fixture(path)
+    timings = {}
+    for _ in range(rounds):
+        _isolate_caches()
+        # questions run interleaved, so every recording is served at once and matched by its prompt
+        backend.load([call for fixture in records for call in fixture['calls']])
+        start = time.perf_counter()
+        results = asyncio.run(_replay_concurrently(records, concurrency, classifier))
+        elapsed = time.perf_counter() - start
+        print('%d questions in %.2f s, %.1f questions/s' % (len(records), elapsed, len(records) / elapsed))
+        for question_timings in results:
+            for name, values in question_timings.items():
+                timings.setdefault(name, []).append(sum(values))
+    if backend.misses:
+        print('%d model calls were replayed out of order, the pipeline prompts changed since recording' % backend.misses)
+    return timings
+
+
+def report(timings: dict):
+    from utils.candidates import get_candidate_stats
+
+    print('%-20s %6s %10s %10s %10s' % ('stage', 'n', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name in STAGES + sorted(set(timings) - set(STAGES)):
+        if name in timings:
+            values = timings[name]
+            print('%-20s %6d %10.2f %10.2f %10.2f' % (name, len(values), 1000 * percentile(values, 50),
+                                                      1000 * percentile(values, 95), 1000 * percentile(values, 99)))
+    candidates = get_candidate_stats().report()
+    if candidates['races']:
+        print('sql candidates: %d races, %d all failed, win rate by candidate %s, %.1f ms saved per race'
+              % (candidates['races'], candidates['all_failed'],
+                 {index: round(rate, 2) for index, rate in candidates['win_rate'].items()},
+                 1000 * candidates['mean_saved_s']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('--fixture', default=FIXTURE_PATH)
+    parser.add_argument('--db', help='AOP database to execute the SQL on, sets LLMAO_DB')
+    parser.add_argument('--data', default='./data/data.csv', help='csv with a Question column, used by record')
+    parser.add_argument('--limit', type=int, default=20, help='number of questions to record')
+    parser.add_argument('--metrics', nargs='*', default=['faithfulness', 'answer_relevancy'])
+    parser.add_argument('--rounds', type=int, default=3, help='replays of the whole fixture')
+    parser.add_argument('--latency', type=float, help='fixed seconds per model call instead of the recorded latency')
+    parser.add_argument('--latency-scale', type=float, default=0.0, help='factor applied to the recorded latency')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='seconds between streamed answer chunks')
+    parser.add_argument('--concurrency', type=int, help='replay all questions at once through the async pipeline')
+    parser.add_argument('--candidates', type=int, help='SQL candidates per question, sets LLMAO_SQL_CANDIDATES')
+    args = parser.parse_args()
+
+    # the pipeline modules read the database location when they are first imported
+    if args.db:
+        os.environ['LLMAO_DB'] = args.db
+    if args.candidates:
+        os.environ['LLMAO_SQL_CANDIDATES'] = str(args.candidates)
+
+    if args.mode == 'record':
+        questions = list(QUESTIONS)
+        if os.path.exists(args.data):
+            questions = pd.read_csv(args.data)['Question'].astype(str).tolist() + questions
+        record_fixture(questions[:args.limit], args.fixture, args.metrics)
+    elif args.concurrency:
+        report(replay_fixture_async(args.fixture, args.rounds, args.concurrency, args.latency, args.latency_scale,
+                                    args.token_latency))
+    else:
+        report(replay_fixture(args.fixture, args.rounds, args.metrics, args.latency, args.latency_scale, args.token_latency))
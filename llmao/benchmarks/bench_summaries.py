@@ -0,0 +1,95 @@
+'''
+Latency of questions walking the chemical -> gene -> pathway/disease and AOP -> event join paths,
+written as the multi-way joins the SQL generator writes today (before) and as lookups in the
+materialized summary tables (after)
+
+usage (from the llmao/ directory)
+    python -m benchmarks.bench_summaries                        # synthetic database
+    python -m benchmarks.bench_summaries --db ./aopdb_08-25-2020.db --rounds 5
+'''
+import argparse
+import os
+import tempfile
+import time
+from benchmarks.synthetic import make_aop_db, percentile
+from utils.catalog import SchemaCatalog
+from utils.connection import ConnectionPool
+from utils.summaries import SCHEMA, build_summaries, summaries_path
+
+# the join paths materialized for the lookups below
+PATHS = [
+    {'tables': ['chemical_info', 'chemical_gene', 'gene_info', 'gene_pathway']},
+    {'tables': ['chemical_info', 'chemical_gene', 'gene_info', 'disease_gene']},
+    {'tables': ['aop_info', 'event_info']},
+]
+
+# (name, join query, summary query) pairs returning the same rows
+LOOKUPS = [
+    ('pathways of a chemical',
+     "SELECT DISTINCT p.PathwayName FROM chemical_info c JOIN chemical_gene cg ON cg.ChemicalID = c.ChemicalID "
+     "JOIN gene_info g ON g.GeneID = cg.GeneID JOIN gene_pathway p ON p.GeneID = g.GeneID "
+     "WHERE c.ChemicalName = 'chlorobenzene' ORDER BY 1;",
+     "SELECT DISTINCT PathwayName FROM mv_chemical_gene_pathway WHERE ChemicalName = 'chlorobenzene' ORDER BY 1;"),
+    ('diseases of a chemical',
+     "SELECT DISTINCT d.DiseaseName FROM chemical_info c JOIN chemical_gene cg ON cg.ChemicalID = c.ChemicalID "
+     "JOIN gene_info g ON g.GeneID = cg.GeneID JOIN disease_gene d ON d.GeneID = g.GeneID "
+     "WHERE c.ChemicalName = 'chlorobenzene' ORDER BY 1;",
+     "SELECT DISTINCT DiseaseName FROM mv_chemical_gene_disease WHERE ChemicalName = 'chlorobenzene' ORDER BY 1;"),
+    ('how many pathways',
+     "SELECT COUNT(DISTINCT p.PathwayID) FROM chemical_info c JOIN chemical_gene cg ON cg.ChemicalID = c.ChemicalID "
+     "JOIN gene_info g ON g.GeneID = cg.GeneID JOIN gene_pathway p ON p.GeneID = g.GeneID "
+     "WHERE c.ChemicalName = 'chlorobenzene';",
+     "SELECT PathwayID_count FROM mv_chemical_gene_pathway_counts WHERE ChemicalName = 'chlorobenzene';"),
+    ('chemicals with most genes',
+     "SELECT c.ChemicalName, COUNT(DISTINCT cg.GeneID) AS n FROM chemical_info c "
+     "LEFT JOIN chemical_gene cg ON cg.ChemicalID = c.ChemicalID GROUP BY c.ChemicalID ORDER BY n DESC, 1 LIMIT 10;",
+     "SELECT ChemicalName, GeneID_count FROM mv_chemical_gene_pathway_counts ORDER BY GeneID_count DESC, 1 LIMIT 10;"),
+    ('events of an AOP',
+     "SELECT e.event_title FROM aop_info a JOIN event_info e ON e.AOP_id = a.AOP_id WHERE a.AOP_id = 3 ORDER BY 1;",
+     "SELECT event_title FROM mv_aop_event WHERE AOP_id = 3 ORDER BY 1;"),
+]
+
+
+def timed(pool, query, rounds):
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        with pool.cursor() as cursor:
+            cursor.execute(query)
+            rows = cursor.fetchall()
+        latencies.append(time.perf_counter() - start)
+    return latencies, rows
+
+
+def run(db_name, rounds, out_name):
+    catalog = SchemaCatalog(db_name, sidecar=os.path.join(tempfile.gettempdir(), 'bench_summaries_catalog.json'))
+    if not os.path.exists(out_name):
+        start = time.perf_counter()
+        manifest = build_summaries(db_name, out_name, PATHS, catalog=catalog)
+        print('built %d summary tables (%d rows) in %.2f s' % (len(manifest), sum(entry['rows'] for entry in manifest.values()),
+                                                               time.perf_counter() - start))
+    pool = ConnectionPool(db_name, attach={SCHEMA: out_name})
+
+    print('%-26s %11s %14s %8s %6s' % ('lookup', 'join p50 ms', 'summary p50 ms', 'speedup', 'same'))
+    for name, join_query, summary_query in LOOKUPS:
+        joined, joined_rows = timed(pool, join_query, rounds)
+        summary, summary_rows = timed(pool, summary_query, rounds)
+        print('%-26s %11.3f %14.3f %7.1fx %6s' % (name, 1000 * percentile(joined, 50), 1000 * percentile(summary, 50),
+                                                  percentile(joined, 50) / percentile(summary, 50),
+                                                  summary_rows == joined_rows))
+    pool.close_all()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='path to the AOP database, a synthetic one is built if omitted')
+    parser.add_argument('--scale', type=int, default=20000, help='size of the synthetic database')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.db:
+        run(args.db, args.rounds, summaries_path(args.db))
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_name = make_aop_db(os.path.join(tmp_dir, 'aop.db'), scale=args.scale)
+            run(db_name, args.rounds, summaries_path(db_name))
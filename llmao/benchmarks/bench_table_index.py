@@ -0,0 +1,63 @@
+'''
+Prompt size and preselection latency of AOP_route with and without the local table index
+
+For each question the schema dictionary that would be sent to the LLM is measured for the
+full AOP_Info (before) and for the top-k candidates (after); questions where one table clearly
+wins skip the LLM call altogether.
+
+usage (from the llmao/ directory)
+    python -m benchmarks.bench_table_index                       # synthetic database
+    python -m benchmarks.bench_table_index --db ./aopdb_08-25-2020.db --top-k 8
+'''
+import argparse
+import os
+import tempfile
+import time
+import pandas as pd
+from benchmarks.synthetic import QUESTIONS, make_aop_db, percentile
+from utils.catalog import SchemaCatalog
+from utils.serialize import approx_tokens
+from utils.table_index import TableIndex
+
+
+def run(db_name, questions, top_k):
+    aop_info = SchemaCatalog(db_name, sidecar=os.path.join(tempfile.gettempdir(), 'bench_catalog.json')).aop_info
+
+    start = time.perf_counter()
+    index = TableIndex(aop_info)
+    build = time.perf_counter() - start
+
+    full_tokens = approx_tokens(str(aop_info))
+    after_tokens, latencies, skipped = [], [], 0
+    for question in questions:
+        start = time.perf_counter()
+        candidates, decisive = index.select(question, top_k=top_k)
+        latencies.append(time.perf_counter() - start)
+        if decisive:
+            skipped += 1
+            after_tokens.append(0)
+        else:
+            after_tokens.append(approx_tokens(str(candidates if candidates else aop_info)))
+
+    print('%d tables, index built in %.1f ms' % (len(aop_info), 1000 * build))
+    print('schema tokens per AOP_route prompt: before %d, after %.0f (mean)' % (full_tokens, sum(after_tokens) / len(after_tokens)))
+    print('LLM call skipped for %d/%d questions' % (skipped, len(questions)))
+    print('preselection latency: p50 %.3f ms, p99 %.3f ms' % (1000 * percentile(latencies, 50), 1000 * percentile(latencies, 99)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help='path to the AOP database, a synthetic one is built if omitted')
+    parser.add_argument('--data', default='./data/data.csv', help='csv with a Question column')
+    parser.add_argument('--top-k', type=int, default=8)
+    args = parser.parse_args()
+
+    questions = list(QUESTIONS)
+    if os.path.exists(args.data):
+        questions += pd.read_csv(args.data)['Question'].astype(str).tolist()
+
+    if args.db:
+        run(args.db, questions, args.top_k)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run(make_aop_db(os.path.join(tmp_dir, 'aop.db'), scale=200), questions, args.top_k)
@@ -0,0 +1,186 @@
+'''
+Record-and-replay of the chat model calls made by the pipeline
+
+LLMRecorder is a langchain callback handler capturing every chat model call (the pipeline stage it
+ran in, the prompt and the output) while the real models answer. ReplayBackend serves those outputs
+back through ReplayChatModel, a model registry backend standing in for Bedrock, so the pipeline can run offline with the
+same prompts, SQL and answers, optionally with the recorded or a fixed latency injected.
+'''
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from utils.timing import current_stage
+
+# fixture written by `bench_pipeline record` and read by `bench_pipeline replay`
+FIXTURE_PATH = './data/replay_fixture.json'
+
+FIXTURE_FORMAT = 1
+
+
+def _message_list(messages) -> list:
+    return [[message.type, message.content] for message in messages]
+
+
+def prompt_key(messages) -> str:
+    '''
+    hash of a prompt, messages given as langchain messages or [type, content] pairs
+    '''
+    pairs = messages if messages and isinstance(messages[0], list) else _message_list(messages)
+    return hashlib.sha1(json.dumps(pairs).encode('utf-8')).hexdigest()
+
+
+class LLMRecorder(BaseCallbackHandler):
+    '''
+    Callback handler recording each chat model call as
+    {'stage', 'model_id', 'prompt', 'key', 'output', 'latency'}.
+    '''
+    def __init__(self):
+        self.calls = []
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        model_id = (serialized or {}).get('kwargs', {}).get('model_id') or (kwargs.get('invocation_params') or {}).get('model_id')
+        with self._lock:
+            self._pending[run_id] = {'stage': current_stage() or 'unknown', 'model_id': model_id,
+                                     'prompt': _message_list(messages[0]), 'start': time.perf_counter()}
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            call = self._pending.pop(run_id, None)
+        if call is None:
+            return
+        call['latency'] = time.perf_counter() - call.pop('start')
+        call['key'] = prompt_key(call['prompt'])
+        call['output'] = response.generations[0][0].text
+        with self._lock:
+            self.calls.append(call)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._pending.pop(run_id, None)
+
+    def take(self) -> list:
+        '''
+        return the calls recorded so far and start over
+        '''
+        with self._lock:
+            calls, self.calls = self.calls, []
+        return calls
+
+
+class ReplayBackend():
+    '''
+    Serves recorded outputs to ReplayChatModel instances. A call is matched to the unused recording
+    with the same prompt first, then to the next one recorded in the same stage, then to the next one.
+
+    init params
+        latency - fixed seconds before each response, None to use the recorded latency
+        latency_scale - factor applied to the recorded latency, 0 for no delay
+        token_latency - seconds between streamed chunks
+    '''
+    def __init__(self, latency: float = None, latency_scale: float = 0.0, token_latency: float = 0.0):
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.token_latency = token_latency
+        self.misses = 0
+        self._calls = []
+        self._lock = threading.Lock()
+
+    def load(self, calls: list):
+        '''
+        replace the recordings served, typically those of the next question
+        '''
+        with self._lock:
+            self._calls = [dict(call, used=False) for call in calls]
+
+    def next(self, messages) -> dict:
+        key = prompt_key(messages)
+        stage = current_stage()
+        with self._lock:
+            unused = [call for call in self._calls if not call['used']]
+            for match in (lambda call: call['key'] == key, lambda call: call['stage'] == stage, lambda call: True):
+                found = next((call for call in unused if match(call)), None)
+                if found is not None:
+                    break
+            if found is None:
+                raise ValueError('No recorded chat model output left to replay for stage ' + str(stage))
+            if found['key'] != key:
+                self.misses += 1
+            found['used'] = True
+            return found
+
+    def delay(self, call: dict) -> float:
+        return self.latency if self.latency is not None else self.latency_scale * call.get('latency', 0.0)
+
+    def chat_model(self, **kwargs):
+        '''
+        ModelRegistry backend building replay models, only model_id is kept
+        '''
+        return ReplayChatModel(backend=self, model_id=kwargs.get('model_id') or 'replay')
+
+
+class ReplayChatModel(BaseChatModel):
+    '''
+    Stub chat model answering with the outputs recorded by LLMRecorder.
+    '''
+    backend: Any
+    model_id: Optional[str] = 'replay'
+
+    @property
+    def _llm_type(self) -> str:
+        return 'replay'
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        call = self.backend.next(messages)
+        time.sleep(self.backend.delay(call))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=call['output']))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        call = self.backend.next(messages)
+        time.sleep(self.backend.delay(call))
+        for piece in re.findall(r'\s*\S+\s*', call['output']) or ['']:
+            if self.backend.token_latency:
+                time.sleep(self.backend.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # waits on the event loop rather than a worker thread, like a natively async client would
+        call = self.backend.next(messages)
+        await asyncio.sleep(self.backend.delay(call))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=call['output']))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        call = self.backend.next(messages)
+        await asyncio.sleep(self.backend.delay(call))
+        for piece in re.findall(r'\s*\S+\s*', call['output']) or ['']:
+            if self.backend.token_latency:
+                await asyncio.sleep(self.backend.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+
+def save_fixture(records: list, path: str = FIXTURE_PATH):
+    with open(path, 'w') as fixture_file:
+        json.dump({'format': FIXTURE_FORMAT, 'recorded': time.time(), 'questions': records}, fixture_file, indent=1)
+
+
+def load_fixture(path: str = FIXTURE_PATH) -> list:
+    with open(path) as fixture_file:
+        fixture = json.load(fixture_file)
+    if fixture.get('format') != FIXTURE_FORMAT:
+        raise ValueError('Replay fixture ' + path + ' has an unsupported format, record it again')
+    return fixture['questions']
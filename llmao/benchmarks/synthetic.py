@@ -0,0 +1,82 @@
+import random
+import sqlite3
+
+# a handful of AOP-DB tables with the real table/column names, used when the 16GB database is not available
+SCHEMA = """
+    CREATE TABLE chemical_info (ChemicalID TEXT PRIMARY KEY, ChemicalName TEXT, CasRN TEXT, Definition TEXT);
+    CREATE TABLE gene_info (GeneID INTEGER PRIMARY KEY, GeneSymbol TEXT, GeneName TEXT, TaxID INTEGER);
+    CREATE TABLE chemical_gene (ChemicalID TEXT REFERENCES chemical_info(ChemicalID),
+                                GeneID INTEGER REFERENCES gene_info(GeneID),
+                                InteractionActions TEXT, PubMedIDs TEXT);
+    CREATE TABLE aop_info (AOP_id INTEGER PRIMARY KEY, AOP_name TEXT, abstract TEXT);
+    CREATE TABLE event_info (event_id INTEGER PRIMARY KEY, AOP_id INTEGER REFERENCES aop_info(AOP_id),
+                             event_title TEXT, event_type TEXT);
+    CREATE TABLE gene_pathway (GeneID INTEGER REFERENCES gene_info(GeneID), PathwayID TEXT, PathwayName TEXT);
+    CREATE TABLE disease_gene (GeneID INTEGER REFERENCES gene_info(GeneID), DiseaseID TEXT, DiseaseName TEXT);
+    """
+
+_WORDS = ['liver', 'receptor', 'oxidative', 'stress', 'mitochondrial', 'inhibition', 'binding', 'estrogen',
+          'androgen', 'thyroid', 'neuron', 'apoptosis', 'kidney', 'toxicity', 'activation', 'hepatocellular',
+          'carcinoma', 'development', 'reproductive', 'chloro', 'benzene', 'phenol', 'acid', 'oxide']
+
+# example questions and the SQL a generator would write for them, shared by the benchmarks
+QUESTIONS = {
+    'Look up 2 chemicals in the AOP database': 'SELECT ChemicalName, ChemicalID FROM chemical_info LIMIT 2;',
+    'Which genes interact with chlorobenzene?': """SELECT g.GeneSymbol FROM chemical_info c
+        JOIN chemical_gene cg ON c.ChemicalID = cg.ChemicalID JOIN gene_info g ON g.GeneID = cg.GeneID
+        WHERE c.ChemicalName = 'chlorobenzene' LIMIT 5;""",
+    'How many AOPs are in the database?': 'SELECT COUNT(*) FROM aop_info;',
+    'What key events are in AOP 3?': 'SELECT event_title, event_type FROM event_info WHERE AOP_id = 3 LIMIT 5;',
+    'Which pathways involve gene 42?': 'SELECT PathwayName FROM gene_pathway WHERE GeneID = 42 LIMIT 5;',
+}
+
+
+def _text(rng, n):
+    return ' '.join(rng.choice(_WORDS) for _ in range(n))
+
+
+def make_aop_db(path: str, scale: int = 1000, seed: int = 0) -> str:
+    '''
+    build a synthetic database with AOP-DB's layout
+    args
+        path - where to write the sqlite file
+        scale - number of chemicals/genes, interaction tables are 20x larger
+    returns
+        path
+    '''
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    chemicals = [('MESH:C%06d' % i, 'chlorobenzene' if i == 0 else _text(rng, 2), '%d-%02d-%d' % (i, i % 97, i % 10),
+                  _text(rng, 12)) for i in range(scale)]
+    connection.executemany('INSERT INTO chemical_info VALUES (?, ?, ?, ?);', chemicals)
+    connection.executemany('INSERT INTO gene_info VALUES (?, ?, ?, ?);',
+                           [(i, 'G%d' % i, _text(rng, 3), rng.choice([9606, 10090, 10116])) for i in range(scale)])
+    connection.executemany('INSERT INTO chemical_gene VALUES (?, ?, ?, ?);',
+                           [(rng.choice(chemicals)[0], rng.randrange(scale), rng.choice(['increases^expression', 'decreases^activity', 'affects^binding']),
+                             str(rng.randrange(10**7))) for _ in range(scale * 20)])
+    n_aops = max(10, scale // 10)
+    connection.executemany('INSERT INTO aop_info VALUES (?, ?, ?);',
+                           [(i, _text(rng, 6), _text(rng, 30)) for i in range(n_aops)])
+    connection.executemany('INSERT INTO event_info VALUES (?, ?, ?, ?);',
+                           [(i, rng.randrange(n_aops), _text(rng, 5), rng.choice(['MIE', 'KE', 'AO'])) for i in range(n_aops * 5)])
+    connection.executemany('INSERT INTO gene_pathway VALUES (?, ?, ?);',
+                           [(rng.randrange(scale), 'WP%d' % rng.randrange(500), _text(rng, 4)) for _ in range(scale * 5)])
+    connection.executemany('INSERT INTO disease_gene VALUES (?, ?, ?);',
+                           [(rng.randrange(scale), 'MESH:D%06d' % rng.randrange(2000), _text(rng, 3)) for _ in range(scale * 5)])
+    connection.commit()
+    connection.close()
+    return path
+
+
+def percentile(values: list, q: float) -> float:
+    '''
+    q-th percentile (0-100) of values using linear interpolation
+    '''
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
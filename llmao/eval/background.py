@@ -0,0 +1,280 @@
+import atexit
+import random
+import threading
+import time
+from collections import OrderedDict
+from utils.concurrency import BoundedWorkerPool
+from utils.sinks import BufferedWriter
+from utils.timing import stage
+
+# user satisfaction ratings written by Chat_Evaluator
+CHAT_EVAL_PATH = "/home/ubuntu/llmao/llmao/data/chat_eval.csv"
+
+# fraction of answers scored on each route, anything not listed is scored every time
+SAMPLING_RATES = {
+    'aop_db': 1.0,
+}
+
+# chat sessions whose satisfaction rating is kept, the least recently active are forgotten first
+MAX_SESSIONS = 1000
+
+# seconds the interpreter waits at exit for queued answers to be scored before sending the scores
+EXIT_TIMEOUT = 30.0
+
+
+def _evaluator_scores(metrics, question, answer, context) -> dict:
+    '''
+    default scorer, runs the LLMao Evaluator on a single (question, answer, context) row
+    '''
+    from eval.evaluator import Evaluator
+    return Evaluator(metrics=metrics, data=[[question, answer, context]]).get_scores()
+
+
+def _langfuse_client():
+    from eval.evaluator import _get_langfuse
+    return _get_langfuse()
+
+
+class EvaluationQueue():
+    '''
+    Scores answers on background workers so evaluation never blocks the user's answer. Jobs are
+    sampled per route, dropped (and counted) when the queue is full, and the resulting scores are
+    sent to langfuse in batches: once batch_size scores are buffered, or by a timer once the oldest
+    buffered score is flush_interval seconds old. Scores langfuse refuses are counted in failed_scores.
+
+    init params
+        metrics - LLMao metrics to score each answer with
+        workers - number of scoring threads
+        maxsize - maximum number of queued jobs before new ones are dropped
+        sampling_rates - {route: fraction of jobs scored}, defaults to SAMPLING_RATES
+        batch_size - number of scores buffered before they are sent to langfuse
+        flush_interval - seconds after which a partial batch is sent anyway
+        scorer - function(metrics, question, answer, context) -> {metric: score}
+        client - langfuse client, created lazily if not given
+    '''
+    def __init__(self, metrics: list = None, workers: int = 2, maxsize: int = 100, sampling_rates: dict = None,
+                 batch_size: int = 20, flush_interval: float = 5.0, scorer=None, client=None):
+        self.metrics = metrics if metrics is not None else ['faithfulness', 'answer_relevancy']
+        self.sampling_rates = dict(SAMPLING_RATES if sampling_rates is None else sampling_rates)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.scorer = scorer if scorer is not None else _evaluator_scores
+        self._client = client
+        self._pool = BoundedWorkerPool(workers=workers, maxsize=maxsize, name='llmao-eval')
+        self._scores = []
+        self._scores_lock = threading.Lock()
+        self._oldest = None
+        self._flusher = None
+        self.sampled_out = 0
+        self.failed_scores = 0
+
+    @property
+    def dropped(self) -> int:
+        '''
+        number of jobs dropped because the queue was full
+        '''
+        return self._pool.dropped
+
+    def set_sampling_rate(self, route: str, rate: float):
+        if not 0 <= rate <= 1:
+            raise ValueError('Invalid sampling rate given: ' + str(rate) + ' must be between 0 and 1.')
+        self.sampling_rates[route] = rate
+
+    def submit(self, trace_id, question, answer, context, route: str = 'aop_db') -> bool:
+        '''
+        queue an answer for scoring, returns immediately
+        returns
+            True if the job was queued, False if it was sampled out or dropped
+        '''
+        if random.random() >= self.sampling_rates.get(route, 1.0):
+            self.sampled_out += 1
+            return False
+        return self._pool.submit(self._score, trace_id, question, answer, context)
+
+    def _score(self, trace_id, question, answer, context):
+        with stage('evaluation'):
+            scores = self.scorer(self.metrics, question, answer, context)
+        with self._scores_lock:
+            if not self._scores:
+                self._oldest = time.monotonic()
+            for metric in self.metrics:
+                self._scores.append({'trace_id': trace_id, 'name': metric, 'value': scores[metric]})
+            due = len(self._scores) >= self.batch_size
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name='llmao-eval-flush', daemon=True)
+                self._flusher.start()
+        if due:
+            self.flush()
+
+    def _flush_periodically(self):
+        # sends a partial batch once it has waited flush_interval, even when no further job arrives
+        while True:
+            with self._scores_lock:
+                oldest = self._oldest if self._scores else None
+            wait = self.flush_interval if oldest is None else oldest + self.flush_interval - time.monotonic()
+            time.sleep(max(wait, 0.0))
+            with self._scores_lock:
+                due = bool(self._scores) and time.monotonic() - self._oldest >= self.flush_interval
+            if due:
+                try:
+                    self.flush()
+                except Exception:
+                    # langfuse being unreachable must not stop later flushes
+                    pass
+
+    def flush(self):
+        '''
+        send all buffered scores to langfuse as one batch
+        '''
+        with self._scores_lock:
+            batch, self._scores = self._scores, []
+            if not batch:
+                return
+            # the timer thread and the scoring workers both flush
+            if self._client is None:
+                self._client = _langfuse_client()
+        for score in batch:
+            try:
+                self._client.score(**score)
+            except Exception:
+                # one score langfuse refused does not take the rest of the batch with it
+                with self._scores_lock:
+                    self.failed_scores += 1
+        self._client.flush()
+
+    def join(self, timeout: float = None) -> bool:
+        '''
+        wait for every queued job to be scored, or at most timeout seconds, then flush the remaining scores
+        returns
+            False if jobs were still queued when the timeout ran out
+        '''
+        drained = self._pool.join(timeout)
+        self.flush()
+        return drained
+
+    def stats(self) -> dict:
+        stats = self._pool.stats()
+        stats['sampled_out'] = self.sampled_out
+        with self._scores_lock:
+            stats['buffered_scores'] = len(self._scores)
+            stats['failed_scores'] = self.failed_scores
+        return stats
+
+
+_evaluation_queue = None
+_evaluation_queue_lock = threading.Lock()
+
+def get_evaluation_queue() -> EvaluationQueue:
+    '''
+    shared EvaluationQueue for the process, queued jobs are scored and their scores flushed on interpreter exit
+    '''
+    global _evaluation_queue
+    if _evaluation_queue is None:
+        with _evaluation_queue_lock:
+            if _evaluation_queue is None:
+                _evaluation_queue = EvaluationQueue()
+                atexit.register(_evaluation_queue.join, EXIT_TIMEOUT)
+    return _evaluation_queue
+
+
+def _chat_evaluator(question, chat_history, previous_rating):
+    from eval.tools import Chat_Evaluator
+    return Chat_Evaluator(question, chat_history, previous_rating=previous_rating)
+
+
+class SatisfactionScorer():
+    '''
+    Rates user satisfaction off the request path. Each session is rated incrementally: only the turns
+    added since the session was last rated are sent, together with the previous rating. Only the
+    max_sessions most recently active sessions are remembered, an evicted session that comes back is
+    rated from its first turn again. Without a session id (outside Streamlit) every call is rated on
+    its own, on the whole history.
+
+    init params
+        workers - number of rating threads
+        maxsize - maximum number of queued ratings before new ones are dropped
+        evaluator - function(question, new_turns, previous_rating) -> rating, defaults to Chat_Evaluator
+        max_sessions - number of sessions whose progress and rating are kept
+    '''
+    def __init__(self, workers: int = 1, maxsize: int = 100, evaluator=None, max_sessions: int = MAX_SESSIONS):
+        self.evaluator = evaluator if evaluator is not None else _chat_evaluator
+        self.max_sessions = max_sessions
+        self._pool = BoundedWorkerPool(workers=workers, maxsize=maxsize, name='llmao-chat-eval')
+        # session id -> {'turns': number of turns rated, 'rating': last rating}, least recently active first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def dropped(self) -> int:
+        return self._pool.dropped
+
+    def submit(self, session_id, question, chat_history) -> bool:
+        '''
+        queue the new turns of a session for rating, returns immediately
+        returns
+            False if there was nothing new to rate or the job was dropped
+        '''
+        if not chat_history:
+            return False
+        # snapshot now, the caller keeps appending to its history while the job waits
+        chat_history = list(chat_history)
+        if session_id is None:
+            return self._pool.submit(self._rate, None, question, chat_history)
+        with self._lock:
+            session = self._sessions.setdefault(session_id, {'turns': 0, 'rating': None})
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            start = session['turns']
+            if start >= len(chat_history):
+                return False
+            session['turns'] = len(chat_history)
+        return self._pool.submit(self._rate, session_id, question, chat_history[start:])
+
+    def _rate(self, session_id, question, new_turns):
+        with stage('chat_evaluation'):
+            rating = self.evaluator(question, new_turns, self.rating(session_id))
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions[session_id]['rating'] = rating
+
+    def rating(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session['rating'] if session is not None else None
+
+    def join(self):
+        self._pool.join()
+
+    def stats(self) -> dict:
+        stats = self._pool.stats()
+        with self._lock:
+            stats['sessions'] = len(self._sessions)
+        return stats
+
+
+_chat_eval_sink = None
+_satisfaction_scorer = None
+_chat_eval_lock = threading.Lock()
+
+def get_chat_eval_sink() -> BufferedWriter:
+    '''
+    shared buffered sink for chat satisfaction ratings
+    '''
+    global _chat_eval_sink
+    if _chat_eval_sink is None:
+        with _chat_eval_lock:
+            if _chat_eval_sink is None:
+                _chat_eval_sink = BufferedWriter(CHAT_EVAL_PATH, flush_every=20)
+    return _chat_eval_sink
+
+def get_satisfaction_scorer() -> SatisfactionScorer:
+    '''
+    shared SatisfactionScorer for the process
+    '''
+    global _satisfaction_scorer
+    if _satisfaction_scorer is None:
+        with _chat_eval_lock:
+            if _satisfaction_scorer is None:
+                _satisfaction_scorer = SatisfactionScorer()
+    return _satisfaction_scorer
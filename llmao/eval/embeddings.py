@@ -0,0 +1,264 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# default embedding model for semantic similarity in the LLMao metrics
+EMBEDDING_MODEL = "amazon.titan-embed-text-v1"
+
+# on-disk layer of the embedding cache, relative to the llmao/ directory
+CACHE_PATH = './data/embedding_cache.db'
+
+
+def text_key(model_id: str, text: str) -> str:
+    '''
+    content address of a text for a given embedding model
+    '''
+    return model_id + ':' + hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# constants for the local n-gram hashing vectorizer
+_HASH_PRIME = np.uint64(1099511628211)
+_HASH_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+class BedrockEmbeddingProvider():
+    '''
+    Embeds text with a Bedrock embedding model over the network, one client is shared by every call
+    '''
+    # bedrock embeddings are slow and billed, so they are worth persisting to disk
+    persistent = True
+
+    def __init__(self, model_id: str = EMBEDDING_MODEL):
+        self.model_id = model_id
+        self._client = None
+
+    def embed_documents(self, texts: list) -> list:
+        if self._client is None:
+            from langchain_community.embeddings.bedrock import BedrockEmbeddings
+            self._client = BedrockEmbeddings(credentials_profile_name='default', model_id=self.model_id)
+        return self._client.embed_documents(texts)
+
+
+class HashingEmbeddingProvider():
+    '''
+    Local CPU embeddings for offline scoring: character n-grams hashed into a fixed number of
+    features, sublinear tf weighted by an optional idf learned with fit(), l2 normalized.
+    Needs no network access and scores thousands of pairs per second.
+
+    init params
+        n_features - dimension of the hashed feature space
+        ngram_range - (min, max) character n-gram length
+    '''
+    # recomputing is cheaper than a sqlite lookup, keep these vectors in memory only
+    persistent = False
+
+    def __init__(self, n_features: int = 4096, ngram_range: tuple = (3, 5)):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.idf = None
+        self.model_id = 'local-char' + str(ngram_range[0]) + '-' + str(ngram_range[1]) + '-' + str(n_features)
+
+    def _counts(self, text: str):
+        data = np.frombuffer((' ' + ' '.join(text.lower().split()) + ' ').encode('utf-8'), dtype=np.uint8).astype(np.uint64)
+        hashes = []
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            if len(data) < n:
+                continue
+            # polynomial hash of every n-gram at once, uint64 arithmetic wraps instead of overflowing;
+            # unlike hash() this is stable across processes
+            ngram_hash = np.full(len(data) - n + 1, n, dtype=np.uint64)
+            for k in range(n):
+                ngram_hash = ngram_hash * _HASH_PRIME + data[k:len(data) - n + 1 + k]
+            hashes.append(ngram_hash)
+        if not hashes:
+            return np.zeros(self.n_features, dtype=np.int64)
+        # fibonacci hashing spreads the n-gram hashes before folding them into n_features buckets
+        mixed = (np.concatenate(hashes) * _HASH_MIX) >> np.uint64(32)
+        return np.bincount((mixed % np.uint64(self.n_features)).astype(np.int64), minlength=self.n_features)
+
+    def fit(self, corpus: list):
+        '''
+        learn idf weights from a corpus, e.g. the questions and answers of an evaluation dataset
+        returns
+            a new provider with the idf weights and its own model_id, this one is left unchanged so
+            caches already keyed by its model_id keep holding plain tf vectors
+        '''
+        document_frequency = np.zeros(self.n_features)
+        for text in corpus:
+            document_frequency += self._counts(text) > 0
+        fitted = HashingEmbeddingProvider(self.n_features, self.ngram_range)
+        fitted.idf = np.log((1 + len(corpus)) / (1 + document_frequency)) + 1
+        # idf weighted vectors differ from plain tf ones, so they must not share cache entries
+        fitted.model_id += '-idf' + hashlib.sha256(fitted.idf.tobytes()).hexdigest()[:8]
+        return fitted
+
+    def embed_documents(self, texts: list):
+        vectors = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vectors[row] = np.log1p(self._counts(text))
+        if self.idf is not None:
+            vectors *= self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+
+# embedding backends selectable by name, e.g. LLMAO_EMBEDDINGS=local for air-gapped runs
+PROVIDERS = {
+    'bedrock': BedrockEmbeddingProvider,
+    'local': HashingEmbeddingProvider,
+}
+
+_provider = None
+
+def set_provider(provider):
+    '''
+    choose the embedding backend used by cos_similarity
+    args
+        provider - a key of PROVIDERS or an object with model_id and embed_documents(texts)
+    '''
+    global _provider
+    if isinstance(provider, str):
+        if provider not in PROVIDERS:
+            raise ValueError('Invalid embedding provider given: ' + provider + ' is not one of ' + str(list(PROVIDERS)))
+        provider = PROVIDERS[provider]()
+    _provider = provider
+    return provider
+
+def get_provider():
+    '''
+    current embedding backend, chosen by the LLMAO_EMBEDDINGS environment variable by default
+    '''
+    if _provider is None:
+        set_provider(os.environ.get('LLMAO_EMBEDDINGS', 'bedrock'))
+    return _provider
+
+
+class EmbeddingCache():
+    '''
+    Content-addressed embedding cache: an in-memory LRU in front of a persistent sqlite table,
+    keyed by model id and text hash. Cache misses are embedded together in one batch.
+
+    init params
+        model_id - embedding model, part of every cache key
+        embedder - function(list[str]) -> list[list[float]], defaults to a BedrockEmbeddingProvider for model_id
+        path - sqlite file for the persistent layer, None to keep the cache in memory only
+        max_entries - size of the in-memory LRU layer
+    '''
+    def __init__(self, model_id: str = EMBEDDING_MODEL, embedder=None, path: str = CACHE_PATH, max_entries: int = 10000):
+        self.model_id = model_id
+        self._embedder = embedder
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.embed_calls = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _get_embedder(self):
+        if self._embedder is None:
+            self._embedder = BedrockEmbeddingProvider(self.model_id).embed_documents
+        return self._embedder
+
+    def _get_db(self):
+        if self._db is None and self.path is not None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB);')
+            self._db.commit()
+        return self._db
+
+    def _remember(self, key, vector):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def _lookup(self, keys: list) -> dict:
+        '''
+        find the keys already cached, in memory first and then on disk
+        '''
+        found = {}
+        missing = []
+        for key in keys:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                found[key] = self._lru[key]
+            else:
+                missing.append(key)
+        db = self._get_db()
+        if db is not None and missing:
+            placeholders = ','.join('?' * len(missing))
+            rows = db.execute('SELECT key, vector FROM embeddings WHERE key IN (' + placeholders + ');', missing).fetchall()
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                found[key] = vector
+                self._remember(key, vector)
+        return found
+
+    def embed(self, texts: list) -> list:
+        '''
+        embed texts, only calling the embedding model for texts not seen before
+        args
+            texts - list of strings
+        returns
+            list of numpy vectors in the same order as texts
+        '''
+        keys = [text_key(self.model_id, text) for text in texts]
+        with self._lock:
+            found = self._lookup(list(dict.fromkeys(keys)))
+
+        # embed each distinct missing text once, in a single batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            self.embed_calls += 1
+            vectors = self._get_embedder()(list(missing.values()))
+            new = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, vectors)}
+            with self._lock:
+                for key, vector in new.items():
+                    self._remember(key, vector)
+                db = self._get_db()
+                if db is not None:
+                    db.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?);',
+                                   [(key, vector.tobytes()) for key, vector in new.items()])
+                    db.commit()
+            found.update(new)
+
+        return [found[key] for key in keys]
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'embed_calls': self.embed_calls,
+                'in_memory': len(self._lru)}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache(provider=None) -> EmbeddingCache:
+    '''
+    shared EmbeddingCache per embedding model for the process
+    args
+        provider - embedding backend, defaults to get_provider()
+    '''
+    if provider is None:
+        provider = get_provider()
+    model_id = provider.model_id
+    if model_id not in _caches:
+        with _caches_lock:
+            if model_id not in _caches:
+                _caches[model_id] = EmbeddingCache(model_id, embedder=provider.embed_documents,
+                                                   path=CACHE_PATH if provider.persistent else None)
+    return _caches[model_id]
+
+
+def cosine(vector1, vector2) -> float:
+    return float(np.dot(vector1, vector2) / (np.linalg.norm(vector1) * np.linalg.norm(vector2)))
@@ -1,12 +1,29 @@
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
-from langchain_community.chat_models import BedrockChat
+from utils.models import EVAL_MODEL, get_chat_model
 import eval.prompts
 from eval.metrics import PARSER_DICT
 from langfuse.decorators import langfuse_context
 from typing import Optional
-from pydantic import BaseModel, computed_field
+import threading
+from pydantic import BaseModel, PrivateAttr, computed_field
 from langchain_core.exceptions import OutputParserException
+from langfuse import Langfuse
+from utils.concurrency import ProgressReport, ordered_map
+
+_langfuse = None
+_langfuse_lock = threading.Lock()
+
+def _get_langfuse() -> Langfuse:
+    '''
+    langfuse client shared by the evaluators for scoring traces by id, called from the scoring threads
+    '''
+    global _langfuse
+    if _langfuse is None:
+        with _langfuse_lock:
+            if _langfuse is None:
+                _langfuse = Langfuse()
+    return _langfuse
 
 class _Metric_Handler():
     '''
@@ -46,6 +63,9 @@ class Evaluator(BaseModel):
         data - list of lists in format: ['human_question', 'ai_response', 'context', 'truth']
                 truth - optional ground truth required for 'correctness'
         batch - 
+        max_concurrency - maximum number of (row, metric) LLM calls in flight
+        requests_per_second - cap on the rate LLM calls are started at, None for no cap
+        progress - print a progress and throughput report as pairs complete
      '''
     
     metrics: list[str] = ["faithfulness", "answer_relevancy"]
@@ -53,6 +73,10 @@ class Evaluator(BaseModel):
     output: Optional[str] = "dict"
     model: Optional[str] = "anthropic.claude-3-sonnet-20240229-v1:0"
     batch: Optional[bool] = False
+    max_concurrency: Optional[int] = 4
+    requests_per_second: Optional[float] = None
+    progress: Optional[bool] = False
+    _report: Optional[ProgressReport] = PrivateAttr(default=None)
 
     def _get_data(self):
         return self.data
@@ -69,75 +93,104 @@ class Evaluator(BaseModel):
     def _get_data(self):
         return self.data
     
+    def _compile_chains(self, llm) -> dict:
+        '''
+        build the prompt | llm | parser chain once per metric, shared by every row
+        '''
+        chains = {}
+        for metric_name in self._get_metrics():
+            # initialize _Metric_Handler object
+            metric = _Metric_Handler(metric_name)
+            prompt = metric.get_metric_prompt()
+            # get output parser based on the metric type
+            parser = metric.get_parser()
+            prompt_template = PromptTemplate(template=prompt,
+                                            input_variables=['question', 'response', 'context'],
+                                            partial_variables={"format_instructions": parser.get_format_instructions()})
+            # invoking this chain will generate a metric object
+            chains[metric_name] = prompt_template | llm | parser
+        return chains
+
+    @staticmethod
+    def _score(chain, metric_name, input_dict) -> float:
+        try:
+            metric_object = chain.invoke(input_dict)
+        except OutputParserException:
+            metric_object = chain.invoke(input_dict)
+
+        if metric_name == 'answer_relevancy':
+            metric_object.user_question = input_dict['question']
+        elif metric_name == 'correctness':
+            metric_object.ai_response = input_dict['response']
+            metric_object.true_answer = input_dict['truth']
+        return metric_object.score
+
     @computed_field
     @property
     def _evaluate(self) -> dict:
-        #metrics = self._get_metrics()
-        model = "anthropic.claude-3-haiku-20240307-v1:0"
-        llm = BedrockChat(credentials_profile_name="default", model_id=model, verbose=True)
-        #llm = Bedrock(credentials_profile_name="default", model_id="mistral.mixtral-8x7b-instruct-v0:1", verbose=True)
-        # llm = Bedrock(credentials_profile_name="default", model_id=self._get_model(), verbose=True)
-
-        if self.batch:
-            scores_list = []
+        llm = get_chat_model(EVAL_MODEL)
+        chains = self._compile_chains(llm)
 
-        # iterate through each entry of question, answer, context for each passed metric
+        rows = []
         for data_list in self._get_data():
             input_dict = {
                         'question': data_list[0],
                         'response': data_list[1],
                         'context': data_list[2]
                         }
+            if len(data_list) > 3:
+                input_dict['truth'] = data_list[3]
+            rows.append(input_dict)
 
-            scores = {} # define score for each entry
-
-            for metric_name in self._get_metrics():
-                # initialize _Metric_Handler object
-                metric = _Metric_Handler(metric_name)
-                prompt = metric.get_metric_prompt()
-                # get output parser based on the metric type
-                parser = metric.get_parser()
-                prompt_template = PromptTemplate(template=prompt,
-                                                input_variables=list(input_dict.keys()),
-                                                partial_variables={"format_instructions": parser.get_format_instructions()})
-                
-                # invoking this chain will generate a metric object
-                chain = prompt_template | llm | parser
+        # fan out every (row, metric) pair instead of N x M sequential round-trips
+        pairs = [(i, metric_name) for i in range(len(rows)) for metric_name in self._get_metrics()]
+        self._report = ProgressReport(len(pairs))
+        pair_scores = ordered_map(lambda pair: self._score(chains[pair[1]], pair[1], rows[pair[0]]),
+                                  pairs,
+                                  max_concurrency=self.max_concurrency,
+                                  requests_per_second=self.requests_per_second,
+                                  progress=print if self.progress else None,
+                                  report=self._report)
 
-                try:
-                    metric_object = chain.invoke(input_dict)
-                except OutputParserException:
-                    metric_object = chain.invoke(input_dict)
+        scores_list = [{} for _ in rows]
+        for (i, metric_name), score in zip(pairs, pair_scores):
+            scores_list[i][metric_name] = score
 
-                if metric_name == 'answer_relevancy':
-                  metric_object.user_question = input_dict['question']
-                elif metric_name == 'correctness':
-                    metric_object.ai_response = input_dict['response']
-                    metric_object.true_answer = input_dict['truth']
-                scores[metric_name] = metric_object.score
-                
-                if self.batch:
-                    scores_list.append(scores)
-                    
         if self.batch:
             return scores_list
         else:
-            return scores
+            return scores_list[-1] if scores_list else {}
+
+    def get_report(self) -> Optional[ProgressReport]:
+        '''
+        progress and throughput of the last evaluation run
+        '''
+        return self._report
 
     def get_scores(self) -> dict:
         return self._evaluate
 
-    def trace_scores(self):
+    def trace_scores(self, trace_id: Optional[str] = None):
         '''
         send scores to langfuse
+        args
+            trace_id - trace to score, defaults to the current trace; required when called
+                after the observed function returned (e.g. once a streamed answer finished)
         '''
         metrics = self._get_metrics()
         scores = self.get_scores()
         for i in range(0, len(self._get_metrics())):
             metric = metrics[i]
             score = scores[metric]
-            langfuse_context.score_current_trace(
-                name=metric,
-                value=score
-            )
+            if trace_id is None:
+                langfuse_context.score_current_trace(
+                    name=metric,
+                    value=score
+                )
+            else:
+                _get_langfuse().score(
+                    trace_id=trace_id,
+                    name=metric,
+                    value=score
+                )
         return
\ No newline at end of file
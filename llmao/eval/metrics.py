@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, computed_field
-from eval.tools import f1_score, cos_similarity
+from eval.tools import f1_score, cos_similarity, cos_similarities
 from typing import Union
 
 """
@@ -80,9 +80,8 @@ class Answer_Relevancy(BaseModel):
 
     @computed_field
     def score(self) -> float:
-        scores = []
-        for synthetic_question in self.questions:
-            scores.append(cos_similarity([self.user_question, synthetic_question]))
+        # the user question is embedded once for all synthetic questions
+        scores = cos_similarities(self.user_question, self.questions)
         return sum(scores) / len(scores)
     
 
@@ -1,13 +1,14 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_community.chat_models import BedrockChat
-from utils.utils import AOP_Info, Queries
+from utils.models import CHAT_MODEL, get_chat_model
+from utils.utils import Queries
+from utils.catalog import get_catalog
 import pandas as pd
 import numpy as np
-from numpy.linalg import norm
 from langchain_core.runnables import RunnablePassthrough
-from langchain_community.embeddings.bedrock import BedrockEmbeddings
+from eval.embeddings import get_embedding_cache, cosine
 from typing import Union
+from eval.background import get_chat_eval_sink
 
 def Generator(n: int = 10, k: int=5, return_list: bool=True) -> Union[list[list], pd.DataFrame]:
     '''
@@ -20,7 +21,7 @@ def Generator(n: int = 10, k: int=5, return_list: bool=True) -> Union[list[list]
         data - dictionary {question:query} or 
             pandas dataframe, column 1 is the question and column 2 is the SQLite query
     '''
-    from utils.querying import AOP_query_chain
+    from utils.AOP_db_query import AOP_query_chain
 
     generate_prompt = """ <instructions>
     You are an expert at adverse outcome pathways (AOP) and SQLite databases; you have familiarity with executing SQLite queries
@@ -45,20 +46,20 @@ def Generator(n: int = 10, k: int=5, return_list: bool=True) -> Union[list[list]
     </formatting>
     """
 
-    llm = BedrockChat(
-            credentials_profile_name="default", model_id="anthropic.claude-3-sonnet-20240229-v1:0", verbose=True)
+    llm = get_chat_model(CHAT_MODEL)
     
     chain = ChatPromptTemplate.from_template(generate_prompt) | llm | StrOutputParser()
 
     skill_level= ["No AOP knowledge","Beginner level AOP knowledge", "Intermediate level AOP knowledge", "Expert level AOP knowledge"]
 
+    aop_info = get_catalog().aop_info
     questions = []
     contexts = []
     responses = []
 
     for i in range(0, n):
         question = chain.invoke({
-            'aop_dict': AOP_Info,
+            'aop_dict': aop_info,
             'examples': Queries,
             'skill_level': skill_level[i % len(skill_level)],
             'top_k': k,
@@ -79,14 +80,16 @@ def Generator(n: int = 10, k: int=5, return_list: bool=True) -> Union[list[list]
     else:
         return pd.DataFrame(result, columns=["Question", "AI_Response", "Context"])
 
-def Chat_Evaluator(question, chat_history):
+def Chat_Evaluator(question, chat_history, previous_rating=None, sink=None):
     '''
     Evaluate user satisfaction based on chat history
     args
         user question
-        chat history
+        chat history - the turns to rate, e.g. only the turns added since the session was last rated
+        previous_rating - rating given to the earlier turns of the session, if any
+        sink - BufferedWriter for the ratings, defaults to the shared chat_eval.csv sink
     returns
-        no returns, (current human question, previous AI response, and rating) are written to /llmao/data/chat_eval.csv
+        rating, (current human question, previous AI response, and rating) are written to /llmao/data/chat_eval.csv
     '''
 
     prompt = ''' <instructions> 
@@ -97,6 +100,7 @@ def Chat_Evaluator(question, chat_history):
     on the criterion below: </instructions>
 
     <context>
+    Rating of the earlier conversation: {previous_rating}
     Chat history: {chat_history}
     Current question: {question}
     Rating criteria:
@@ -111,23 +115,24 @@ def Chat_Evaluator(question, chat_history):
     with anything other than the user satisfaction rating: </formatting>
     '''
 
-    llm = BedrockChat(
-        credentials_profile_name="default", model_id="anthropic.claude-3-sonnet-20240229-v1:0", verbose=True)
+    llm = get_chat_model(CHAT_MODEL)
 
     chain = ChatPromptTemplate.from_template(prompt) | llm | StrOutputParser()
     
     rating = chain.invoke({
         'question': question,
-        'chat_history': chat_history
+        'chat_history': chat_history,
+        'previous_rating': previous_rating if previous_rating is not None else "none, this is the start of the conversation"
     })
 
     # user question, ai_resposne, rating
     if len(chat_history) >= 2:
-        with open("/home/ubuntu/llmao/llmao/data/chat_eval.csv","a") as rating_file:
-            rating_file.write((str(chat_history[-1]) + ',' + str(chat_history[-2]) + ',' + str(rating)) + "\n")
+        # buffered, so concurrent sessions don't each open the csv on every turn
+        sink = sink if sink is not None else get_chat_eval_sink()
+        sink.write(str(chat_history[-1]) + ',' + str(chat_history[-2]) + ',' + str(rating))
     else:
         pass
-    return    
+    return rating
 
 def AOP_Query_Evaluator(question, query):
     '''
@@ -160,24 +165,30 @@ def AOP_Query_Evaluator(question, query):
     </formatting>
     '''
 
-    llm = BedrockChat(
-        credentials_profile_name="default", model_id="anthropic.claude-3-sonnet-20240229-v1:0", verbose=True)
+    llm = get_chat_model(CHAT_MODEL)
     
     chain = ChatPromptTemplate.from_template(prompt) | llm | StrOutputParser()
 
     return chain.invoke({
         'question': question,
         'query': query,
-        'aop_dict': AOP_Info
+        'aop_dict': get_catalog().aop_info
     })
 
 def cos_similarity(embedding_list: list):
     '''
-    perform cosine similarity calculation between two vectors (lists)
+    perform cosine similarity calculation between the embeddings of two strings
+    embeddings are served from the shared embedding cache, only unseen strings reach the embedding model
     '''
-    embedding_model = BedrockEmbeddings(credentials_profile_name='default', model_id="amazon.titan-embed-text-v1")
-    embedding1, embedding2 = embedding_model.embed_documents(embedding_list)
-    return np.dot(embedding1, embedding2)/(norm(embedding1)*norm(embedding2))
+    embedding1, embedding2 = get_embedding_cache().embed(embedding_list)
+    return cosine(embedding1, embedding2)
+
+def cos_similarities(text: str, others: list) -> list:
+    '''
+    cosine similarity between one string and each of a list of strings, embedded in a single batch
+    '''
+    embedding, *other_embeddings = get_embedding_cache().embed([text] + list(others))
+    return [cosine(embedding, other) for other in other_embeddings]
 
 def f1_score(var_list: list):
     '''
@@ -1,13 +1,11 @@
 import streamlit as st
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from utils.AOP_db_query import AOP_query_chain
-from utils.utils import Questions, AOP_Info, langfuse_handler
-from eval.tools import Chat_Evaluator
+from utils.utils import Questions, langfuse_handler, get_session
+from utils.pipeline import answer_question
+from utils.models import CHAT_MODEL, get_chat_model
+from utils.timing import start_metrics_dump
+from eval.background import get_satisfaction_scorer
 from eval.evaluator import Evaluator
-from langchain_community.chat_models import BedrockChat
 import random
 from langfuse import Langfuse
 from langfuse.decorators import observe
@@ -15,8 +13,11 @@ from langfuse.decorators import observe
 langfuse = Langfuse()
 langfuse.auth_check()
 
-llm = BedrockChat(credentials_profile_name="default", model_id="anthropic.claude-3-sonnet-20240229-v1:0", verbose=True)
-#llm = BedrockChat(credentials_profile_name="default", model_id="mistral.mixtral-8x7b-instruct-v0:1", verbose=True)
+# per-stage latency percentiles and failure counts, written for the Prometheus textfile collector
+start_metrics_dump()
+
+llm = get_chat_model(CHAT_MODEL)
+#llm = get_chat_model("mistral.mixtral-8x7b-instruct-v0:1")
 
 # page configuration
 st.set_page_config(
@@ -48,58 +49,15 @@ for message in st.session_state.chat_history:
 # first, classify the users question by topic
 @observe()
 def route(human_question, chat_history):
-    intro_prompt =  PromptTemplate.from_template("""
-        Given the user question below, classify whether it has anything at all to do with the
-        adverse outcome pathway (AOP) database or any of its tables, listed below. 
-        If the question directly mentions the AOP database, any of its tables, or any of its columns, respond with database. Otherwise, respond with none.
-        Do not respond with more than one word, and do not include punctuation or uppercase letters.
-                        
-            Question: Describe the AOP gene table
-            Your response: database
-            Question: Can you tell me which molecules in the AOP database are the nastiest nasties of the bunch?
-            Your response: database
-
-        AOP database schema dictionary: {aop_dict}
-        User question: {question}
-        Classification: """
-    )
-
-    route_chain = intro_prompt | llm | StrOutputParser()
-
-    # path variable is database or none
-    path = (route_chain.invoke({
-        "question": human_question,
-        "aop_dict": AOP_Info
-    }))
-
+    # satisfaction is rated in the background on the new turns only, the user never waits for it
     if chat_history is not None:
-        Chat_Evaluator(human_question, chat_history)
-    else:
-        pass
+        get_satisfaction_scorer().submit(get_session(), human_question, chat_history)
 
-    # if aop database is needed to answer the question
-    if str(path[0]) == 'd':
-        # enter sql chain
-        return AOP_query_chain(human_question, chat_history)
-    # if a database is not needed to answer the question, answer normally
-    else:
-        # generic template
-        template = """ <instructions>
-        You are a friendly, cheerful, and helpful assistant. 
-        Answer the following questions considering the chat history and user question.
-        If the chat history is empty, do not mention the chat history </instructions>
-
-        Chat history: {chat_history}
-        question: {user_question}
-        """
-
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = prompt | llm | StrOutputParser() 
-
-        return chain.stream({
-            "user_question": human_question, 
-            "chat_history": chat_history
-        })
+    # path is database or none; the local classifier answers clear cases itself and only falls back
+    # to the routing LLM when it is not confident enough. Table selection starts at the same time and
+    # is dropped if the database is not needed, otherwise the sql chain picks up its result
+    path, answer = answer_question(human_question, chat_history, llm)
+    return answer
 
 def reset_conversation():
     '''
@@ -0,0 +1,142 @@
+from eval.background import EvaluationQueue, SatisfactionScorer
+from utils.sinks import BufferedWriter
+import threading
+import time
+
+class FakeLangfuse():
+    def __init__(self):
+        self.scores = []
+        self.flushes = 0
+
+    def score(self, **kwargs):
+        self.scores.append(kwargs)
+
+    def flush(self):
+        self.flushes += 1
+
+def fake_scorer(metrics, question, answer, context):
+    return {metric: 1.0 for metric in metrics}
+
+# scores are computed off the caller's thread and sent to langfuse in batches
+def test_queue_scores_in_batches():
+    client = FakeLangfuse()
+    evaluation_queue = EvaluationQueue(scorer=fake_scorer, client=client, workers=1, batch_size=4,
+                                       flush_interval=60)
+    for i in range(3):
+        assert evaluation_queue.submit("trace-" + str(i), "question", "answer", "context")
+    evaluation_queue.join()
+    assert len(client.scores) == 6
+    assert {score['trace_id'] for score in client.scores} == {"trace-0", "trace-1", "trace-2"}
+    assert client.flushes == 2
+
+# a partial batch is sent once it has waited flush_interval, without another job arriving
+def test_queue_flushes_on_timer():
+    client = FakeLangfuse()
+    evaluation_queue = EvaluationQueue(scorer=fake_scorer, client=client, batch_size=100, flush_interval=0.05)
+    evaluation_queue.submit("trace", "question", "answer", "context")
+    evaluation_queue._pool.join()
+    deadline = time.monotonic() + 2
+    while not client.scores and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(client.scores) == 2 and client.flushes == 1
+
+# joining at exit drains the queue before the last flush, and gives up after the timeout
+def test_queue_join_drains():
+    release = threading.Event()
+
+    def slow_scorer(metrics, question, answer, context):
+        release.wait()
+        return fake_scorer(metrics, question, answer, context)
+
+    client = FakeLangfuse()
+    evaluation_queue = EvaluationQueue(scorer=slow_scorer, client=client, workers=1, flush_interval=60)
+    evaluation_queue.submit("trace", "question", "answer", "context")
+    assert not evaluation_queue.join(timeout=0.05)
+    assert client.scores == []
+    release.set()
+    assert evaluation_queue.join(timeout=2)
+    assert len(client.scores) == 2
+
+# a score langfuse refuses is counted, the rest of the batch is still sent
+def test_queue_failed_score():
+    class FlakyLangfuse(FakeLangfuse):
+        def score(self, **kwargs):
+            if kwargs['name'] == 'faithfulness':
+                raise ConnectionError('langfuse unreachable')
+            super().score(**kwargs)
+
+    client = FlakyLangfuse()
+    evaluation_queue = EvaluationQueue(scorer=fake_scorer, client=client, workers=1, flush_interval=60)
+    evaluation_queue.submit("trace", "question", "answer", "context")
+    evaluation_queue.join()
+    assert [score['name'] for score in client.scores] == ['answer_relevancy']
+    assert evaluation_queue.stats()['failed_scores'] == 1 and client.flushes == 1
+
+# a full queue drops new jobs and counts them instead of blocking
+def test_queue_backpressure():
+    release = threading.Event()
+
+    def blocked_scorer(metrics, question, answer, context):
+        release.wait()
+        return fake_scorer(metrics, question, answer, context)
+
+    evaluation_queue = EvaluationQueue(scorer=blocked_scorer, client=FakeLangfuse(), workers=1, maxsize=1)
+    results = [evaluation_queue.submit(str(i), "q", "a", "c") for i in range(5)]
+    release.set()
+    evaluation_queue.join()
+    assert results[0]
+    assert evaluation_queue.dropped == results.count(False)
+    assert evaluation_queue.dropped >= 3
+
+def test_queue_sampling():
+    evaluation_queue = EvaluationQueue(scorer=fake_scorer, client=FakeLangfuse(), sampling_rates={'aop_db': 0})
+    assert not evaluation_queue.submit("trace", "q", "a", "c", route='aop_db')
+    assert evaluation_queue.stats()['sampled_out'] == 1
+
+# each session is rated on the turns added since its last rating, off the caller's thread
+def test_satisfaction_scorer_incremental():
+    calls = []
+
+    def evaluator(question, new_turns, previous_rating):
+        calls.append((new_turns, previous_rating))
+        return len(calls)
+
+    scorer = SatisfactionScorer(evaluator=evaluator)
+    history = ["Hi", "Hello!"]
+    assert scorer.submit("session-1", "Hi", history)
+    scorer.join()
+    assert not scorer.submit("session-1", "Hi", history)
+    history += ["Look up 2 chemicals", "Bevonium and Insulin"]
+    assert scorer.submit("session-1", "Look up 2 chemicals", history)
+    scorer.join()
+    assert calls == [(["Hi", "Hello!"], None), (["Look up 2 chemicals", "Bevonium and Insulin"], 1)]
+    assert scorer.rating("session-1") == 2
+
+# calls without a session are rated on their own, and only the most recent sessions are remembered
+def test_satisfaction_scorer_sessions():
+    calls = []
+
+    def evaluator(question, new_turns, previous_rating):
+        calls.append((new_turns, previous_rating))
+        return len(calls)
+
+    scorer = SatisfactionScorer(evaluator=evaluator, max_sessions=2)
+    assert scorer.submit(None, "Hi", ["Hi", "Hello!"])
+    assert scorer.submit(None, "Hi", ["Hi", "Hello!"])
+    scorer.join()
+    assert calls == [(["Hi", "Hello!"], None)] * 2
+    for session_id in ("session-1", "session-2", "session-3"):
+        assert scorer.submit(session_id, "Hi", ["Hi", "Hello!"])
+    scorer.join()
+    assert scorer.stats()['sessions'] == 2
+    assert scorer.rating("session-1") is None and scorer.rating("session-3") == 5
+    # the evicted session is rated from its first turn again
+    assert scorer.submit("session-1", "Hi", ["Hi", "Hello!"])
+
+def test_buffered_writer(tmp_path):
+    sink = BufferedWriter(str(tmp_path / "chat_eval.csv"), flush_every=3)
+    sink.write("a,b,1")
+    sink.write("c,d,2")
+    assert not (tmp_path / "chat_eval.csv").exists()
+    sink.write("e,f,0")
+    assert (tmp_path / "chat_eval.csv").read_text() == "a,b,1\nc,d,2\ne,f,0\n"
@@ -0,0 +1,66 @@
+from eval.embeddings import EmbeddingCache, HashingEmbeddingProvider, cosine, get_embedding_cache, set_provider
+from eval import embeddings
+import numpy as np
+import pytest
+
+class CountingEmbedder():
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0, float(text.count("a"))] for text in texts]
+
+# repeated texts are embedded once, misses go to the model in a single batch
+def test_cache_batches_misses():
+    embedder = CountingEmbedder()
+    cache = EmbeddingCache(model_id="test", embedder=embedder, path=None)
+    vectors = cache.embed(["question", "answer", "question"])
+    assert embedder.calls == [["question", "answer"]]
+    assert np.allclose(vectors[0], vectors[2])
+    cache.embed(["answer", "question"])
+    assert len(embedder.calls) == 1
+    assert cache.stats()['hits'] == 3
+
+# the sqlite layer survives a new cache object, e.g. a second evaluation run
+def test_cache_persistent(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    EmbeddingCache(model_id="test", embedder=CountingEmbedder(), path=path).embed(["Hello"])
+    embedder = CountingEmbedder()
+    cache = EmbeddingCache(model_id="test", embedder=embedder, path=path)
+    assert np.isclose(cosine(*cache.embed(["Hello", "Hello"])), 1)
+    assert embedder.calls == []
+    # a different model never reuses another model's vectors
+    EmbeddingCache(model_id="other", embedder=embedder, path=path).embed(["Hello"])
+    assert embedder.calls == [["Hello"]]
+
+# the local provider needs no network and ranks paraphrases above unrelated text
+def test_local_provider():
+    previous = embeddings._provider
+    try:
+        provider = set_provider("local")
+        assert isinstance(provider, HashingEmbeddingProvider)
+        cache = get_embedding_cache()
+        assert cache.path is None
+        question, paraphrase, unrelated = cache.embed(["What chemicals are in the AOP database?",
+                                                       "Which chemicals does the AOP database contain?",
+                                                       "Describe the gene table"])
+        assert np.isclose(cosine(question, question), 1)
+        assert cosine(question, paraphrase) > cosine(question, unrelated)
+        # vectors are deterministic across provider instances
+        assert np.allclose(HashingEmbeddingProvider().embed_documents(["Hello"]), provider.embed_documents(["Hello"]))
+        with pytest.raises(ValueError):
+            set_provider("word2vec")
+    finally:
+        set_provider(previous)
+
+# fitting returns a new provider, the cache of the unfitted one keeps its plain tf vectors
+def test_fit_new_provider():
+    provider = HashingEmbeddingProvider()
+    cache = get_embedding_cache(provider)
+    plain = provider.embed_documents(["chlorobenzene"])
+    fitted = provider.fit(["chlorobenzene", "benzene", "gene table"])
+    assert fitted.model_id != provider.model_id and provider.idf is None
+    assert get_embedding_cache(fitted) is not cache
+    assert np.allclose(cache.embed(["chlorobenzene"])[0], plain[0])
+    assert not np.allclose(get_embedding_cache(fitted).embed(["chlorobenzene"])[0], plain[0])
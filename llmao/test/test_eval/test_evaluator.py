@@ -22,4 +22,21 @@ def test_init_eval_edge_cases():
         evaluator = Evaluator(data = invalid_data, metrics = ["faithfulness", "answer_relevancy"])
         evaluator = Evaluator(data = sample_data, metrics = ["faithfulness", 2])
         evaluator = Evaluator()
-        evaluator = Evaluator(data = sample_df, metrics = ["faithfulness", "answer_relevancy"])
\ No newline at end of file
+        evaluator = Evaluator(data = sample_df, metrics = ["faithfulness", "answer_relevancy"])
+# the scoring threads share one langfuse client
+def test_get_langfuse_threads(monkeypatch):
+    from eval import evaluator
+    from concurrent.futures import ThreadPoolExecutor
+    import time
+    created = []
+
+    def Langfuse():
+        time.sleep(0.01)
+        created.append(object())
+        return created[-1]
+
+    monkeypatch.setattr(evaluator, 'Langfuse', Langfuse)
+    monkeypatch.setattr(evaluator, '_langfuse', None)
+    with ThreadPoolExecutor(8) as pool:
+        clients = list(pool.map(lambda _: evaluator._get_langfuse(), range(8)))
+    assert len(created) == 1 and all(client is created[0] for client in clients)
@@ -0,0 +1,107 @@
+from utils.backends import ColumnarBackend, RoutingBackend
+from utils.catalog import SchemaCatalog
+from utils.columnar import duckdb_type, export_parquet, parquet_path, read_manifest
+from utils.connection import ConnectionPool
+from utils.execution import QueryExecutor, QueryRejected
+from utils.index_advisor import read_query_log
+from utils.result_cache import get_result_cache
+from benchmarks.synthetic import make_aop_db
+import sqlite3
+import pytest
+
+EXPORTED = ['chemical_gene', 'gene_pathway']
+
+@pytest.fixture
+def database(tmp_path):
+    db_name = make_aop_db(str(tmp_path / "aop.db"), scale=100)
+    pool = ConnectionPool(db_name)
+    catalog = SchemaCatalog(db_name, sidecar=str(tmp_path / "aop.catalog.json"))
+    get_result_cache().clear()
+    yield db_name, pool, catalog
+    pool.close_all()
+
+def test_duckdb_type():
+    assert duckdb_type('INTEGER') == 'BIGINT'
+    assert duckdb_type('VARCHAR(20)') == duckdb_type('') == 'VARCHAR'
+    assert duckdb_type('REAL') == duckdb_type('NUMERIC') == 'DOUBLE'
+    assert duckdb_type('BLOB') == 'BLOB'
+
+# values keep their sqlite type through the export, floats at full precision and blobs byte for byte
+def test_export_types(tmp_path):
+    duckdb = pytest.importorskip('duckdb')
+    db_name = str(tmp_path / "types.db")
+    source = sqlite3.connect(db_name)
+    source.execute("CREATE TABLE measures (id INTEGER, value REAL, label TEXT, raw BLOB);")
+    source.executemany("INSERT INTO measures VALUES (?, ?, ?, ?);",
+                       [(1, 0.1 + 0.2, 'a', b'\x00\xff'), (2.0, 7, 3, 'text'), ('x', 'y', None, None)])
+    source.commit()
+    source.close()
+    catalog = SchemaCatalog(db_name, sidecar=str(tmp_path / "types.catalog.json"))
+    export_parquet(db_name, tables=['measures'], catalog=catalog)
+    rows = duckdb.sql("SELECT id, value, label, raw FROM read_parquet('" + parquet_path(db_name) +
+                      "/measures/*.parquet') ORDER BY id NULLS FIRST").fetchall()
+    assert rows == [(None, None, None, None), (1, 0.1 + 0.2, 'a', b'\x00\xff'), (2, 7.0, '3', b'text')]
+
+# aggregates scanning an exported large table go to the columnar engine, everything else stays on SQLite
+def test_choose(database):
+    db_name, pool, catalog = database
+    manifest = {table: {'rows': catalog.row_count(table), 'columns': catalog.columns(table), 'files': 1}
+                for table in EXPORTED}
+    router = RoutingBackend(QueryExecutor(pool, catalog), ColumnarBackend(parquet_path(db_name), manifest, catalog),
+                            pool, catalog, min_rows=400)
+    assert router.choose("SELECT GeneID, COUNT(*) FROM chemical_gene GROUP BY GeneID ORDER BY 2 DESC LIMIT 10") == 'duckdb'
+    assert router.choose("SELECT COUNT(DISTINCT PathwayID) FROM gene_pathway") == 'duckdb'
+    # not an aggregate, SQLite stops at the LIMIT
+    assert router.choose("SELECT * FROM chemical_gene LIMIT 5") == 'sqlite'
+    # small table, or one that was not exported
+    assert router.choose("SELECT COUNT(*) FROM gene_info") == 'sqlite'
+    assert router.choose("SELECT COUNT(*) FROM chemical_gene cg JOIN chemical_info c ON c.ChemicalID = cg.ChemicalID") == 'sqlite'
+    # LIKE is case-insensitive in SQLite only
+    assert router.choose("SELECT COUNT(*) FROM chemical_gene WHERE InteractionActions LIKE '%binding%'") == 'sqlite'
+    assert RoutingBackend(QueryExecutor(pool, catalog), None, pool, catalog).choose("SELECT COUNT(*) FROM chemical_gene") == 'sqlite'
+
+# the row backend's guardrails hold for queries the columnar engine would run: a cartesian join is rejected
+def test_choose_guardrails(database):
+    db_name, pool, catalog = database
+    manifest = {table: {'rows': catalog.row_count(table), 'columns': catalog.columns(table), 'files': 1}
+                for table in EXPORTED}
+    executor = QueryExecutor(pool, catalog, large_table_rows=400, use_cache=False)
+    router = RoutingBackend(executor, ColumnarBackend(parquet_path(db_name), manifest, catalog), pool, catalog,
+                            min_rows=400)
+    query = "SELECT COUNT(*) FROM chemical_gene, gene_pathway"
+    assert router.choose(query) == 'sqlite'
+    with pytest.raises(QueryRejected):
+        router.run(query)
+    assert executor.counts['rejected'] == 1 and router.counts['duckdb'] == 0
+
+def test_columnar(database, tmp_path):
+    pytest.importorskip('duckdb')
+    db_name, pool, catalog = database
+    manifest = export_parquet(db_name, tables=EXPORTED, catalog=catalog, batch=700)
+    assert manifest['chemical_gene']['rows'] == 2000 and manifest['chemical_gene']['files'] == 3
+    assert read_manifest(parquet_path(db_name), 'other version') == {}
+
+    log_path = str(tmp_path / "query_log.jsonl")
+    columnar = ColumnarBackend(parquet_path(db_name), catalog=catalog, use_cache=False, log_path=log_path)
+    executor = QueryExecutor(pool, catalog, use_cache=False)
+    router = RoutingBackend(executor, columnar, pool, catalog, min_rows=1000)
+    query = "SELECT GeneID, COUNT(DISTINCT ChemicalID) AS n FROM chemical_gene GROUP BY GeneID ORDER BY n DESC, GeneID LIMIT 10"
+    result = router.run(query)
+    assert result.plan == ['DUCKDB']
+    assert result.rows == executor.run(query).rows
+    assert router.counts['duckdb'] == 1
+    # logged like the executor's queries, with the SQLite plan the index advisor reads
+    columnar._log.flush()
+    record = read_query_log(log_path)[-1]
+    assert record['backend'] == 'duckdb' and record['status'] == 'ok'
+    assert any(detail.startswith('SCAN chemical_gene') for detail in record['plan'])
+
+    # every run opens its own cursor and closes it, none is left behind by a finished thread
+    with columnar.cursor() as cursor:
+        assert cursor.execute("SELECT COUNT(*) FROM gene_pathway").fetchall() == [(500,)]
+    with pytest.raises(Exception):
+        cursor.execute("SELECT 1")
+
+    capped = ColumnarBackend(parquet_path(db_name), catalog=catalog, use_cache=False, max_bytes=2000)
+    result = capped.run("SELECT ChemicalID, GeneID, InteractionActions FROM chemical_gene ORDER BY GeneID")
+    assert result.truncated and 0 < result.row_count < 100
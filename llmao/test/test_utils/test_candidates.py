@@ -0,0 +1,74 @@
+from utils.candidates import CandidatesFailed, CandidateStats, race_candidates, race_candidates_async
+from utils.execution import QueryResult
+import asyncio
+import sqlite3
+import time
+import pytest
+
+# candidate i is written after delays[i] seconds
+QUERIES = ["SELECT Nme FROM chemical_info", "SELECT ChemicalName FROM chemical_info WHERE 0",
+           "SELECT ChemicalName FROM chemical_info"]
+
+def execute(query):
+    if 'Nme' in query:
+        raise sqlite3.OperationalError('no such column: Nme')
+    return QueryResult(query, [] if 'WHERE 0' in query else [('aspirin',)], ['ChemicalName'])
+
+def generator(delays):
+    def generate(i):
+        time.sleep(delays[i])
+        return QUERIES[i]
+    return generate
+
+def wait_for(stats, races):
+    deadline = time.monotonic() + 2
+    while stats.races < races and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+# the first candidate returning rows wins even when others finish earlier, repair is not needed
+def test_race_candidates():
+    stats = CandidateStats()
+    start = time.perf_counter()
+    execution, winner, query = race_candidates(generator([0.01, 0.02, 0.05]), execute, 3, stats=stats)
+    assert winner == 2 and execution.rows == [('aspirin',)]
+    assert query == QUERIES[2]
+    assert time.perf_counter() - start < 0.2
+    wait_for(stats, 1)
+    report = stats.report()
+    assert report['win_rate'] == {2: 1.0}
+    # the first candidate failed, the sequential path would have needed a repair round trip
+    assert report['mean_saved_s'] < 0.05
+
+# a slow winner is not waited for once an earlier one returned rows
+def test_race_candidates_first_wins():
+    stats = CandidateStats()
+    start = time.perf_counter()
+    execution, winner, query = race_candidates(generator([0.3, 0.3, 0.01]), execute, 3, stats=stats)
+    assert winner == 2 and time.perf_counter() - start < 0.2
+    wait_for(stats, 1)
+    assert stats.report()['mean_saved_s'] > 0.4
+
+# an empty result is used when nothing returns rows, all failures are reported together
+def test_race_candidates_fallback():
+    execution, winner, query = race_candidates(generator([0.0, 0.01]), execute, 2, stats=CandidateStats())
+    assert winner == 1 and execution.rows == [] and query == QUERIES[1]
+    with pytest.raises(CandidatesFailed) as failed:
+        race_candidates(lambda i: QUERIES[0], execute, 2, stats=CandidateStats())
+    assert failed.value.query == QUERIES[0]
+    assert len(failed.value.failures) == 2
+    assert isinstance(failed.value, sqlite3.OperationalError)
+
+def test_race_candidates_async():
+    async def generate(i):
+        await asyncio.sleep([0.01, 0.02, 0.05][i])
+        return QUERIES[i]
+
+    async def race():
+        stats = CandidateStats()
+        result = await race_candidates_async(generate, execute, 3, stats=stats)
+        await asyncio.sleep(0.1)
+        return result, stats
+
+    (execution, winner, query), stats = asyncio.run(race())
+    assert winner == 2 and query == QUERIES[2]
+    assert stats.report()['races'] == 1
@@ -0,0 +1,53 @@
+from utils.catalog import SchemaCatalog, db_fingerprint
+import utils.catalog
+import sqlite3
+import os
+import pytest
+
+def make_db(path):
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE chemical_info (ChemicalID TEXT PRIMARY KEY, ChemicalName TEXT);
+        CREATE TABLE chemical_gene (ChemicalID TEXT REFERENCES chemical_info(ChemicalID), GeneID INTEGER);
+        INSERT INTO chemical_info VALUES ('MESH:C000002', 'Bevonium'), ('MESH:C000006', 'Insulin, neutral');
+        INSERT INTO chemical_gene VALUES ('MESH:C000002', 1);
+        """)
+    connection.commit()
+    connection.close()
+
+# test case where the catalog is built from the database and written to the sidecar file
+def test_catalog_build(tmp_path):
+    db_name = str(tmp_path / "aop.db")
+    make_db(db_name)
+    catalog = SchemaCatalog(db_name)
+    assert catalog.aop_info == {'chemical_gene': ['ChemicalID', 'GeneID'],
+                                'chemical_info': ['ChemicalID', 'ChemicalName']}
+    assert catalog.row_count('chemical_info') == 2
+    assert catalog.column_types('chemical_gene') == {'ChemicalID': 'TEXT', 'GeneID': 'INTEGER'}
+    assert catalog.foreign_keys('chemical_gene') == [{'column': 'ChemicalID', 'ref_table': 'chemical_info', 'ref_column': 'ChemicalID'}]
+    assert os.path.exists(catalog.sidecar)
+
+# warm starts reuse the sidecar, changes to the database trigger a rebuild
+def test_catalog_warm_start(tmp_path, monkeypatch):
+    db_name = str(tmp_path / "aop.db")
+    make_db(db_name)
+    version = SchemaCatalog(db_name).version
+
+    def fail(*args, **kwargs):
+        raise AssertionError("snapshot should have been reused")
+    with monkeypatch.context() as patch:
+        patch.setattr(utils.catalog, "build_snapshot", fail)
+        assert SchemaCatalog(db_name).version == version
+
+    connection = sqlite3.connect(db_name)
+    connection.execute("CREATE TABLE gene_info (GeneID INTEGER, GeneName TEXT);")
+    connection.commit()
+    connection.close()
+    catalog = SchemaCatalog(db_name)
+    assert 'gene_info' in catalog.aop_info
+    assert catalog.version != version
+    assert catalog.version == db_fingerprint(db_name)['hash'][:16]
+
+def test_catalog_missing_db(tmp_path):
+    with pytest.raises(Exception):
+        SchemaCatalog(str(tmp_path / "missing.db")).aop_info
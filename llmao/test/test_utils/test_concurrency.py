@@ -0,0 +1,33 @@
+from utils.concurrency import RateLimiter, ProgressReport, ordered_map
+import time
+import pytest
+
+# results come back in input order even when later items finish first
+def test_ordered_map_order():
+    def slow_first(i):
+        time.sleep(0.05 if i == 0 else 0)
+        return i * i
+    report = ProgressReport(5)
+    assert ordered_map(slow_first, range(5), max_concurrency=5, report=report) == [0, 1, 4, 9, 16]
+    assert report.completed == 5
+
+# fan-out time scales with the allowed concurrency instead of the number of items
+def test_ordered_map_concurrency():
+    start = time.monotonic()
+    ordered_map(lambda i: time.sleep(0.05), range(8), max_concurrency=8)
+    assert time.monotonic() - start < 0.3
+
+def test_ordered_map_errors():
+    def fail(i):
+        if i == 2:
+            raise ValueError("bad row")
+        return i
+    with pytest.raises(ValueError):
+        ordered_map(fail, range(4))
+
+def test_rate_limiter():
+    limiter = RateLimiter(50)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.wait()
+    assert time.monotonic() - start >= 0.09
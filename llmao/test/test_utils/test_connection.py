@@ -0,0 +1,57 @@
+from utils.connection import ConnectionPool
+from benchmarks.synthetic import make_aop_db
+import sqlite3
+import threading
+import pytest
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(make_aop_db(str(tmp_path / "aop.db"), scale=50))
+    yield pool
+    pool.close_all()
+
+# connections are handed back after each checkout and shared by whichever thread comes next,
+# so many short-lived threads never open more than size connections
+def test_pool_bounded(pool):
+    with pool.connection() as first:
+        # nested checkouts on one thread share its connection
+        with pool.cursor() as cursor:
+            assert cursor.connection is first
+    seen = []
+    def query():
+        with pool.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM gene_info;")
+            seen.append(cursor.connection)
+    threads = [threading.Thread(target=query) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(seen) == 20 and len(pool) <= pool.size
+    assert set(map(id, seen)) <= {id(connection) for connection, _ in pool._idle}
+
+def test_pool_waits_when_exhausted(tmp_path):
+    pool = ConnectionPool(make_aop_db(str(tmp_path / "aop.db"), scale=10), size=1)
+    got = []
+    def checkout():
+        with pool.connection() as connection:
+            got.append(connection)
+    with pool.connection() as held:
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive() and not got
+    thread.join()
+    assert got == [held] and len(pool) == 1
+    # the connection was last used on another thread and is closed all the same
+    pool.close_all()
+    assert len(pool) == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        held.execute("SELECT 1;")
+
+def test_pool_read_only(pool):
+    with pool.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM chemical_info;")
+        assert cursor.fetchone()[0] == 50
+        with pytest.raises(sqlite3.Error):
+            cursor.execute("DELETE FROM chemical_info;")
@@ -0,0 +1,95 @@
+from utils.catalog import SchemaCatalog
+from utils.connection import ConnectionPool
+from utils.execution import QueryExecutor, QueryRejected, QueryTimeout, has_limit, table_aliases
+from utils.result_cache import get_result_cache
+from benchmarks.synthetic import make_aop_db
+import pytest
+
+@pytest.fixture
+def database(tmp_path):
+    db_name = make_aop_db(str(tmp_path / "aop.db"), scale=50)
+    pool = ConnectionPool(db_name)
+    catalog = SchemaCatalog(db_name, sidecar=str(tmp_path / "aop.catalog.json"))
+    get_result_cache().clear()
+    yield pool, catalog
+    pool.close_all()
+
+def test_helpers():
+    assert has_limit("select ChemicalName from chemical_info limit 5;")
+    assert has_limit("SELECT ChemicalName FROM chemical_info LIMIT 5 OFFSET 10")
+    assert not has_limit("SELECT ChemicalName FROM (SELECT * FROM chemical_info LIMIT 5)")
+    assert table_aliases("SELECT c.ChemicalName FROM chemical_info c JOIN chemical_gene AS cg ON 1 WHERE 1") == \
+        {'chemical_info': 'chemical_info', 'c': 'chemical_info', 'chemical_gene': 'chemical_gene', 'cg': 'chemical_gene'}
+
+# small queries run untouched and report their size and timing
+def test_executor_result(database):
+    pool, catalog = database
+    executor = QueryExecutor(pool, catalog, use_cache=False)
+    result = executor.run("SELECT ChemicalID, ChemicalName FROM chemical_info LIMIT 3;")
+    assert result.row_count == 3
+    assert result.columns == ['ChemicalID', 'ChemicalName']
+    assert not result.truncated and not result.rewritten
+    assert result.elapsed > 0
+    assert result.report()['rows'] == 3
+
+# a full scan of a large table without a LIMIT gets one, or is refused
+def test_executor_full_scan(database):
+    pool, catalog = database
+    executor = QueryExecutor(pool, catalog, large_table_rows=500, max_rows=10, use_cache=False)
+    result = executor.run("SELECT * FROM chemical_gene cg WHERE cg.InteractionActions LIKE '%binding%'")
+    assert result.rewritten
+    assert result.query.endswith('LIMIT 10')
+    assert result.row_count == 10
+    # an explicit LIMIT is left alone
+    assert not executor.run("SELECT * FROM chemical_gene LIMIT 5").rewritten
+    # indexed lookups never count as scans
+    assert not executor.run("SELECT * FROM chemical_info WHERE ChemicalID = 'MESH:C000001'").rewritten
+
+    strict = QueryExecutor(pool, catalog, large_table_rows=500, on_full_scan='reject', use_cache=False)
+    with pytest.raises(QueryRejected):
+        strict.run("SELECT * FROM chemical_gene")
+    assert strict.counts['rejected'] == 1
+
+# two large tables read in full is a cartesian join and is always refused
+def test_executor_cartesian(database):
+    pool, catalog = database
+    executor = QueryExecutor(pool, catalog, large_table_rows=200, use_cache=False)
+    with pytest.raises(QueryRejected):
+        executor.run("SELECT * FROM chemical_gene, gene_pathway LIMIT 5")
+    # a correlated subquery scans its table once per row of the outer one
+    with pytest.raises(QueryRejected):
+        executor.run("SELECT * FROM chemical_gene cg WHERE EXISTS (SELECT 1 FROM gene_pathway gp "
+                     "WHERE gp.PathwayID || cg.GeneID = 'x') LIMIT 5")
+    # the SELECTs of a compound query and an uncorrelated subquery each run once, not nested
+    assert executor.run("SELECT GeneID FROM chemical_gene UNION SELECT GeneID FROM gene_pathway LIMIT 5").row_count == 5
+    assert executor.run("SELECT COUNT(*) FROM chemical_gene WHERE GeneID IN (SELECT GeneID FROM gene_pathway "
+                        "WHERE PathwayName LIKE '%a%') LIMIT 5").row_count == 1
+
+# fetching stops at the row and byte caps and reports the truncation
+def test_executor_caps(database):
+    pool, catalog = database
+    executor = QueryExecutor(pool, catalog, max_rows=7, use_cache=False)
+    result = executor.run("SELECT ChemicalID FROM chemical_info")
+    assert result.row_count == 7 and result.truncated
+    assert not executor.run("SELECT ChemicalID FROM chemical_info LIMIT 7").truncated
+
+    executor = QueryExecutor(pool, catalog, max_bytes=2000, use_cache=False)
+    result = executor.run("SELECT Definition FROM chemical_info")
+    assert result.truncated and 0 < result.row_count < 50
+
+# queries past their time budget are interrupted
+def test_executor_time_budget(database):
+    pool, catalog = database
+    executor = QueryExecutor(pool, catalog, time_budget=0.05, use_cache=False)
+    with pytest.raises(QueryTimeout):
+        executor.run("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n")
+    assert executor.counts['timeouts'] == 1
+    # the handler is removed, the connection keeps working
+    assert executor.run("SELECT COUNT(*) FROM chemical_info").rows == [(50,)]
+
+def test_executor_cache(database):
+    pool, catalog = database
+    executor = QueryExecutor(pool, catalog)
+    first = executor.run("SELECT ChemicalName FROM chemical_info LIMIT 2")
+    assert executor.run("select ChemicalName from chemical_info limit 2;") is first
+    assert executor.counts['queries'] == 1
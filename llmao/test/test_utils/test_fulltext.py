@@ -0,0 +1,37 @@
+from utils.catalog import SchemaCatalog
+from utils.connection import ConnectionPool
+from utils.fulltext import build_fulltext_index, describe_fulltext, fulltext_path, read_manifest, text_columns
+from benchmarks.synthetic import make_aop_db
+import pytest
+
+@pytest.fixture
+def database(tmp_path):
+    db_name = make_aop_db(str(tmp_path / "aop.db"), scale=50)
+    return db_name, SchemaCatalog(db_name, sidecar=str(tmp_path / "aop.catalog.json"))
+
+# names and free text are indexed, identifiers and codes are not
+def test_text_columns(database):
+    _, catalog = database
+    columns = text_columns(catalog)
+    assert columns['chemical_info'] == ['ChemicalName', 'Definition']
+    assert columns['event_info'] == ['event_title']
+    assert 'PathwayID' not in columns['gene_pathway']
+    assert 'chemical_gene' not in columns or 'PubMedIDs' not in columns['chemical_gene']
+
+def test_build_fulltext_index(database):
+    db_name, catalog = database
+    manifest = build_fulltext_index(db_name, columns={'chemical_info': ['ChemicalName']}, catalog=catalog)
+    assert manifest['fts_chemical_info']['rows'] == 50
+    assert read_manifest(fulltext_path(db_name), catalog.version)['fts_chemical_info']['columns'] == ['ChemicalName']
+    # a sidecar built for another version of the database is ignored
+    assert read_manifest(fulltext_path(db_name), 'other version') == {}
+    assert 'fts_chemical_info indexes chemical_info(ChemicalName)' in describe_fulltext(manifest)
+    assert describe_fulltext({}) == ''
+
+    # the attached sidecar answers MATCH lookups joined back to the base table
+    pool = ConnectionPool(db_name, attach={'fts': fulltext_path(db_name)})
+    with pool.cursor() as cursor:
+        cursor.execute("SELECT c.ChemicalID FROM fts_chemical_info JOIN chemical_info c ON c.rowid = fts_chemical_info.rowid "
+                       "WHERE fts_chemical_info MATCH 'Chlorobenzene';")
+        assert cursor.fetchall() == [('MESH:C000000',)]
+    pool.close_all()
@@ -0,0 +1,73 @@
+from utils.catalog import SchemaCatalog
+from utils.connection import ConnectionPool
+from utils.execution import QueryExecutor, QueryRejected
+from utils.index_advisor import QueryShape, advise, index_name, project_speedup, read_query_log
+from benchmarks.synthetic import make_aop_db
+import pytest
+
+@pytest.fixture
+def database(tmp_path):
+    db_name = make_aop_db(str(tmp_path / "aop.db"), scale=300)
+    pool = ConnectionPool(db_name)
+    yield db_name, pool, SchemaCatalog(db_name, sidecar=str(tmp_path / "aop.catalog.json"))
+    pool.close_all()
+
+def test_query_shape(database):
+    _, _, catalog = database
+    shape = QueryShape("SELECT g.GeneSymbol, COUNT(*) FROM chemical_gene cg JOIN gene_info g ON g.GeneID = cg.GeneID "
+                       "WHERE cg.ChemicalID = 'MESH:C000001' AND g.TaxID > 9000 GROUP BY g.GeneSymbol", catalog)
+    assert shape.equality == {'chemical_gene': ['ChemicalID']}
+    assert shape.join == {'gene_info': ['GeneID'], 'chemical_gene': ['GeneID']}
+    assert shape.range == {'gene_info': ['TaxID']}
+    assert shape.group == {'gene_info': ['GeneSymbol']}
+    assert shape.columns('chemical_gene') == ['ChemicalID', 'GeneID']
+
+def test_project_speedup():
+    assert project_speedup(1000000, 1e-5, scanned=True, sort_removed=False) > 1000
+    assert project_speedup(1000000, 1.0, scanned=True, sort_removed=False) < 1.01
+
+# executed statements are logged with their plan, the advisor proposes indexes and measures them on a copy
+def test_advise(database, tmp_path):
+    db_name, pool, catalog = database
+    log_path = str(tmp_path / "query_log.jsonl")
+    executor = QueryExecutor(pool, catalog, log_path=log_path, use_cache=False, large_table_rows=1000)
+    for _ in range(2):
+        executor.run("SELECT PathwayName FROM gene_pathway WHERE GeneID = 42")
+    executor.run("SELECT * FROM chemical_info WHERE ChemicalID = 'MESH:C000001'")
+    with pytest.raises(QueryRejected):
+        executor.run("SELECT * FROM chemical_gene, gene_pathway")
+    executor._log.flush()
+
+    records = read_query_log(log_path)
+    assert [record['status'] for record in records] == ['ok', 'ok', 'ok', 'rejected']
+    assert records[0]['plan'] == ['SCAN gene_pathway'] and records[0]['rows'] > 0
+    assert records[3]['plan']
+
+    statements, report = advise(log_path, db_name, catalog, apply_to=str(tmp_path / "indexed.db"), rounds=1)
+    assert statements == ['CREATE INDEX IF NOT EXISTS "%s" ON "gene_pathway" ("GeneID", "PathwayName");'
+                          % index_name('gene_pathway', ['GeneID', 'PathwayName'])]
+    # the primary key lookup needs nothing, the repeated query is reported once
+    assert len(report) == 1
+    assert report[0]['count'] == 2
+    assert report[0]['projected'] > 1
+    assert report[0]['measured'] > 0
+
+# truncated names stay unique
+def test_index_name():
+    columns = ['Column%d' % i for i in range(20)]
+    assert len(index_name('gene_pathway', columns)) <= 60
+    assert index_name('gene_pathway', columns) != index_name('gene_pathway', columns[:-1])
+    assert index_name('gene_pathway', columns) == index_name('gene_pathway', list(columns))
+
+# a query whose index is led by another recommended index reports the one that is built
+def test_advise_redundant(database, tmp_path):
+    db_name, pool, catalog = database
+    log_path = str(tmp_path / "query_log.jsonl")
+    executor = QueryExecutor(pool, catalog, log_path=log_path, use_cache=False, large_table_rows=1000)
+    executor.run("SELECT PathwayName FROM gene_pathway WHERE GeneID = 42")
+    executor.run("SELECT * FROM gene_pathway WHERE GeneID = 7")
+    executor._log.flush()
+
+    statements, report = advise(log_path, db_name, catalog)
+    assert len(statements) == 1 and len(report) == 2
+    assert [entry['indexes'] for entry in report] == [statements, statements]
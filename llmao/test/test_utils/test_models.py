@@ -0,0 +1,41 @@
+from utils.models import CHAT_MODEL, EVAL_MODEL, FAKE_RESPONSE, ModelRegistry, get_chat_model, get_model_registry, set_model_registry
+from benchmarks.replay import LLMRecorder
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+import pytest
+
+def fake_backend(model_id, **kwargs):
+    return FakeListChatModel(responses=[model_id], **kwargs)
+
+# one model per model id and arguments, built once and reused by every call site
+def test_registry_reuses_models():
+    registry = ModelRegistry(backend=fake_backend)
+    llm = registry.get(CHAT_MODEL)
+    assert registry.get(CHAT_MODEL) is llm
+    assert registry.get(EVAL_MODEL) is not llm
+    assert registry.get(CHAT_MODEL, max_tokens=5) is not llm
+    assert llm.invoke('hi').content == CHAT_MODEL
+    stats = registry.stats()
+    assert stats['models'] == 3 and stats['created'] == 3 and stats['reused'] == 1
+
+def test_registry_callbacks():
+    recorder = LLMRecorder()
+    registry = ModelRegistry(backend=fake_backend, callbacks=[recorder])
+    registry.get(EVAL_MODEL).invoke('score this')
+    assert [call['output'] for call in recorder.take()] == [EVAL_MODEL]
+
+# the named fake backend needs no credentials and takes the Bedrock-only arguments as well
+def test_fake_backend():
+    registry = ModelRegistry(backend='fake')
+    assert registry.get(CHAT_MODEL).invoke('Hello!').content == FAKE_RESPONSE
+    assert registry.get(CHAT_MODEL, model_kwargs={'temperature': 0.7}).invoke('hi').content == FAKE_RESPONSE
+
+def test_set_model_registry():
+    previous = get_model_registry()
+    try:
+        registry = set_model_registry(fake_backend)
+        assert get_model_registry() is registry
+        assert get_chat_model(EVAL_MODEL).invoke('hi').content == EVAL_MODEL
+    finally:
+        set_model_registry(previous)
+    with pytest.raises(ValueError):
+        ModelRegistry(backend='openai')
@@ -0,0 +1,121 @@
+from utils import AOP_db_query, pipeline, router
+from utils.pipeline import AsyncPipeline, answer_question, answer_question_async
+from utils.models import get_model_registry, set_model_registry
+from utils.router import RouteClassifier
+from utils.table_index import TableIndex
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from types import SimpleNamespace
+import asyncio
+import threading
+import pytest
+
+async def slow_answer(question, chat_history):
+    async def chunks():
+        for word in question.split():
+            await asyncio.sleep(0.01)
+            yield word + ' '
+    return chunks()
+
+# questions are answered concurrently, in order, and never more than max_in_flight at once
+def test_async_pipeline():
+    pipeline = AsyncPipeline(max_in_flight=4, answer=slow_answer)
+    questions = ['question number %d' % i for i in range(20)]
+    answers = asyncio.run(pipeline.answer_all(questions))
+    assert answers == [question + ' ' for question in questions]
+    assert pipeline.peak == 4
+    assert pipeline.in_flight == 0
+
+@pytest.fixture
+def turn(monkeypatch):
+    aop_info = {'chemical_info': ['ChemicalID', 'ChemicalName']}
+    index = TableIndex(aop_info)
+    monkeypatch.setattr(router, 'get_table_index', lambda: index)
+    # the routing prompt falls back to the whole schema when no table matches
+    monkeypatch.setattr(router, 'get_catalog', lambda: SimpleNamespace(aop_info=aop_info))
+    classifier = RouteClassifier(table_index=index, model_path=None, log_path=None)
+    # one model for every call of a turn, so the routing answer comes before the generic one
+    llm = FakeListChatModel(responses=["none", "Hi there!"])
+    previous = get_model_registry()
+    set_model_registry(lambda model_id, **kwargs: llm)
+    calls = []
+    monkeypatch.setattr(AOP_db_query, 'AOP_query_chain', lambda question, chat_history, stream, selection:
+                        calls.append(('chain', selection)) or iter(["From the database"]))
+    yield classifier, llm, calls
+    set_model_registry(previous)
+
+# small talk is routed locally and answered with the generic prompt, no table selection is started
+def test_answer_question_async(turn, monkeypatch):
+    classifier, _, calls = turn
+
+    async def select_tables_async(question, chat_history):
+        calls.append('selection')
+
+    monkeypatch.setattr(AOP_db_query, 'select_tables_async', select_tables_async)
+    llm = FakeListChatModel(responses=["Hi there!"])
+    set_model_registry(lambda model_id, **kwargs: llm)
+    answer = asyncio.run(AsyncPipeline(answer=lambda question, chat_history:
+                                       answer_question_async(question, chat_history, classifier)).answer("Hello!", ''))
+    assert answer == "Hi there!"
+    assert classifier.counts['fast'] == 1
+    assert calls == []
+
+# when the routing LLM has to be asked, the selection runs alongside it and is cancelled for small talk
+def test_answer_question_async_cancels_selection(turn, monkeypatch):
+    classifier, _, calls = turn
+
+    async def select_tables_async(question, chat_history):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            calls.append('cancelled')
+            raise
+
+    monkeypatch.setattr(AOP_db_query, 'select_tables_async', select_tables_async)
+
+    async def ask():
+        answer = ''.join([chunk async for chunk in await answer_question_async("What is the weather like?", '', classifier)])
+        await asyncio.sleep(0)
+        return answer
+
+    assert classifier.needs_llm("What is the weather like?")
+    assert asyncio.run(ask()) == "Hi there!"
+    assert classifier.counts['llm'] == 1
+    assert calls == ['cancelled']
+
+# a confident route starts nothing speculatively, an unsure one is not held up by a dropped selection
+def test_answer_question(turn, monkeypatch):
+    classifier, llm, calls = turn
+    release = threading.Event()
+
+    def select_tables(question, chat_history):
+        calls.append('selection')
+        release.wait(2)
+        return {'cached': None, 'table_dict': {}}
+
+    monkeypatch.setattr(AOP_db_query, 'select_tables', select_tables)
+    path, answer = answer_question("List the chemical names in the AOP database", '', llm, classifier, stream=False)
+    assert path == 'database' and ''.join(answer) == "From the database"
+    assert calls == [('chain', None)]
+
+    calls.clear()
+    path, answer = answer_question("What is the weather like?", '', llm, classifier, stream=False)
+    assert path == 'none' and answer == "Hi there!"
+    assert ('chain', None) not in calls
+    release.set()
+
+# an unsure route that needs the database gets the selection speculated alongside it, a failed route drops it
+def test_answer_question_speculated(turn, monkeypatch):
+    classifier, _, calls = turn
+    selection = {'cached': None, 'table_dict': {'chemical_info': ['ChemicalName']}}
+    monkeypatch.setattr(AOP_db_query, 'select_tables', lambda question, chat_history: selection)
+    llm = FakeListChatModel(responses=["database"])
+    path, answer = answer_question("What is the weather like?", '', llm, classifier, stream=False)
+    assert path == 'database' and calls == [('chain', selection)]
+    assert calls[0][1] is selection
+
+    cancelled = []
+    monkeypatch.setattr(pipeline.StageGraph, 'cancel', lambda graph, name: cancelled.append(name))
+    monkeypatch.setattr(pipeline, 'route_question', lambda question, llm, classifier: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        answer_question("What is the weather like?", '', llm, classifier)
+    assert cancelled == ['selection']
@@ -0,0 +1,97 @@
+from utils import AOP_db_query
+from utils.AOP_db_query import _arun_steps, _retrieval_steps, _run_steps
+from utils.execution import QueryResult
+from utils.question_cache import QuestionCache, set_question_cache
+from types import ModuleType
+import asyncio
+import sqlite3
+import sys
+import pytest
+
+SELECTION = {'cached': None, 'table_dict': {'chemical_info': ['ChemicalName']}}
+BROKEN = "SELECT Nme FROM chemical_info"
+FIXED = "SELECT ChemicalName FROM chemical_info LIMIT 1"
+
+@pytest.fixture
+def chain(monkeypatch):
+    calls = []
+
+    def generate_query(llm, question, table_dict):
+        calls.append('generate')
+        return BROKEN
+
+    def repair_query(llm, question, query, error, table_dict):
+        calls.append('repair')
+        assert query == BROKEN and 'Nme' in str(error)
+        return FIXED
+
+    def execute_query(query):
+        calls.append('execute')
+        if query == BROKEN:
+            raise sqlite3.OperationalError('no such column: Nme')
+        return QueryResult(query, [('aspirin',)], ['ChemicalName'])
+
+    async def generate_query_async(*args):
+        return generate_query(*args)
+
+    async def repair_query_async(*args):
+        return repair_query(*args)
+
+    for function in (generate_query, repair_query, execute_query, generate_query_async, repair_query_async):
+        monkeypatch.setattr(AOP_db_query, function.__name__, function)
+    monkeypatch.setattr(AOP_db_query, 'validate_query', lambda query: query)
+    cache = set_question_cache(QuestionCache(path=None, schema_version=lambda: "v1"))
+    yield calls, cache
+    set_question_cache(None)
+
+# both entry points run the same steps: a failed query is repaired once, executed and cached
+def test_retrieval_steps(chain):
+    calls, cache = chain
+    steps = lambda: _retrieval_steps("Look up a chemical", "", None, False, SELECTION, 1)
+    retrieved = _run_steps(steps())
+    assert calls == ['generate', 'execute', 'repair', 'execute']
+    assert asyncio.run(_arun_steps(steps())) == retrieved
+    assert calls[4:] == calls[:4]
+
+    answer_input, context = retrieved
+    assert answer_input['query'] == FIXED and 'aspirin' in answer_input['result']
+    assert context is None
+    assert cache.lookup("Look up a chemical")['query'] == FIXED
+
+# in candidate mode the winning candidate's query is cached, not None
+def test_retrieval_steps_candidates(chain, monkeypatch):
+    calls, cache = chain
+    monkeypatch.setattr(AOP_db_query, 'generate_query', lambda llm, question, table_dict: llm)
+    monkeypatch.setattr(AOP_db_query, '_candidate_llm', lambda llm, i: [BROKEN, FIXED][i])
+    answer_input, _ = _run_steps(_retrieval_steps("Look up a chemical", "", None, False, SELECTION, 2))
+    assert answer_input['query'] == FIXED
+    assert cache.lookup("Look up a chemical")['query'] == FIXED
+
+# by default the result is turned into context by utils.utils' parser, awaited in the async chain
+@pytest.fixture
+def context_parser(monkeypatch):
+    parsed = []
+    # the real utils.utils needs the streamlit runtime
+    module = ModuleType('utils.utils')
+
+    def SQL_context_parser(llm, query, query_results):
+        parsed.append('sync')
+        return 'context of ' + query
+
+    async def SQL_context_parser_async(llm, query, query_results):
+        parsed.append('async')
+        return 'context of ' + query
+
+    module.SQL_context_parser, module.SQL_context_parser_async = SQL_context_parser, SQL_context_parser_async
+    monkeypatch.setitem(sys.modules, 'utils.utils', module)
+    return parsed
+
+def test_retrieval_steps_context(chain, context_parser):
+    _, context = _run_steps(_retrieval_steps("Look up a chemical", "", None, True, SELECTION, 1))
+    assert context == 'context of ' + FIXED
+    assert context_parser == ['sync']
+
+def test_retrieval_steps_context_async(chain, context_parser):
+    _, context = asyncio.run(_arun_steps(_retrieval_steps("Look up a chemical", "", None, True, SELECTION, 1)))
+    assert context == 'context of ' + FIXED
+    assert context_parser == ['async']
@@ -0,0 +1,38 @@
+from utils.question_cache import QuestionCache, content_words, normalize_question
+
+query = 'SELECT ChemicalName, ChemicalID FROM chemical_info LIMIT 2;'
+
+def test_normalize_question():
+    assert normalize_question("  Look up 2 chemicals in the AOP database? ") == "look up 2 chemicals in the aop database"
+    assert content_words("which genes interact with chlorobenzene") == ("genes", "interact", "with", "chlorobenzene")
+
+# exact and near-identical questions hit, different numbers or unrelated questions miss
+def test_question_cache_lookup():
+    cache = QuestionCache(path=None, schema_version=lambda: "v1")
+    assert cache.lookup("Look up 2 chemicals in the AOP database") is None
+    cache.store("Look up 2 chemicals in the AOP database", query, "{'chemical_info': ['ChemicalName', 'ChemicalID']}")
+    assert cache.lookup("look up 2 chemicals in the AOP database!")['similarity'] == 1.0
+    assert cache.lookup("Look up 2 chemicals in the AOP database please")['query'] == query
+    assert cache.lookup("Look up 20 chemicals in the AOP database") is None
+    assert cache.lookup("Describe the AOP gene table") is None
+    assert cache.stats()['exact_hits'] == 1
+
+# near-identical questions that differ in an entity, an operator or a count never reuse each other's SQL
+def test_question_cache_content_words():
+    cache = QuestionCache(path=None, schema_version=lambda: "v1")
+    cache.store("Which chemicals increase expression of the gene CYP1A1?", query, "{}")
+    cache.store("Which genes interact with chlorobenzene?", query, "{}")
+    assert cache.lookup("Which chemicals decrease expression of the gene CYP1A1?") is None
+    assert cache.lookup("Which genes interact with dichlorobenzene?") is None
+    assert cache.lookup("Which genes interact with chlorobenzene and benzene?") is None
+    assert cache.lookup("Which genes interact with chlorobenzene please?")['query'] == query
+
+# entries from an older schema version are never served, but survive in the sqlite layer
+def test_question_cache_schema_version(tmp_path):
+    version = ["v1"]
+    path = str(tmp_path / "questions.db")
+    QuestionCache(path=path, schema_version=lambda: version[0]).store("Look up 2 chemicals", query, "{}")
+    cache = QuestionCache(path=path, schema_version=lambda: version[0])
+    assert cache.lookup("Look up 2 chemicals")['query'] == query
+    version[0] = "v2"
+    assert cache.lookup("Look up 2 chemicals") is None
@@ -0,0 +1,59 @@
+from benchmarks.replay import LLMRecorder, ReplayBackend, load_fixture, save_fixture
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from utils.timing import stage
+import asyncio
+import time
+import pytest
+
+prompt = ChatPromptTemplate.from_template("Question: {question}")
+
+def _record():
+    recorder = LLMRecorder()
+    llm = FakeListChatModel(responses=["SELECT ChemicalName FROM chemical_info LIMIT 2;", "Here are two chemicals."],
+                            callbacks=[recorder])
+    chain = prompt | llm | StrOutputParser()
+    with stage('sql_generation'):
+        chain.invoke({'question': 'Look up 2 chemicals'})
+    with stage('answer'):
+        list(chain.stream({'question': 'Answer: Look up 2 chemicals'}))
+    return recorder.take()
+
+def test_recorder():
+    calls = _record()
+    assert [call['stage'] for call in calls] == ['sql_generation', 'answer']
+    assert calls[0]['prompt'] == [['human', 'Question: Look up 2 chemicals']]
+    assert calls[1]['output'] == "Here are two chemicals."
+
+# recorded outputs are served back by prompt, whatever order the calls come in
+def test_replay(tmp_path):
+    save_fixture([{'question': 'Look up 2 chemicals', 'calls': _record()}], str(tmp_path / "fixture.json"))
+    backend = ReplayBackend(token_latency=0.0)
+    backend.load(load_fixture(str(tmp_path / "fixture.json"))[0]['calls'])
+    chain = prompt | backend.chat_model(model_id="anthropic.claude-3-sonnet-20240229-v1:0") | StrOutputParser()
+    assert "".join(chain.stream({'question': 'Answer: Look up 2 chemicals'})) == "Here are two chemicals."
+    assert chain.invoke({'question': 'Look up 2 chemicals'}) == "SELECT ChemicalName FROM chemical_info LIMIT 2;"
+    assert backend.misses == 0
+    with pytest.raises(ValueError):
+        chain.invoke({'question': 'Look up 2 chemicals'})
+
+def test_replay_latency():
+    backend = ReplayBackend(latency_scale=2.0)
+    assert backend.delay({'latency': 0.5}) == 1.0
+    assert ReplayBackend(latency=0.1, latency_scale=2.0).delay({'latency': 0.5}) == 0.1
+
+# replayed latency is awaited, concurrent calls overlap on one event loop
+def test_replay_async():
+    calls = [{'key': str(i), 'stage': 'answer', 'output': 'answer %d' % i, 'latency': 0.05} for i in range(50)]
+    backend = ReplayBackend(latency_scale=1.0)
+    backend.load(calls)
+    chain = prompt | backend.chat_model() | StrOutputParser()
+
+    async def ask_all():
+        return await asyncio.gather(*(chain.ainvoke({'question': str(i)}) for i in range(50)))
+
+    start = time.perf_counter()
+    answers = asyncio.run(ask_all())
+    assert time.perf_counter() - start < 1.0
+    assert sorted(answers) == sorted(call['output'] for call in calls)
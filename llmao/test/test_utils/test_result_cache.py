@@ -0,0 +1,35 @@
+from utils.result_cache import ResultCache, canonicalize_sql, result_size
+
+# formatting differences map to the same key, literals and identifiers keep their case
+def test_canonicalize_sql():
+    canonical = canonicalize_sql("SELECT ChemicalName, ChemicalID FROM chemical_info WHERE ChemicalName = 'Benzene' LIMIT 2;")
+    assert canonicalize_sql("select ChemicalName ,ChemicalID\n  from chemical_info -- chemicals\n"
+                            "where ChemicalName='Benzene' limit 2 ;;") == canonical
+    assert canonicalize_sql("SELECT ChemicalName FROM chemical_info WHERE ChemicalName = 'benzene'") != \
+        canonicalize_sql("SELECT ChemicalName FROM chemical_info WHERE ChemicalName = 'Benzene'")
+    assert canonicalize_sql("SELECT 'a  b'") == "SELECT 'a  b'"
+
+def test_result_cache_hits():
+    cache = ResultCache()
+    rows = [('Bevonium', 'MESH:C000002')]
+    assert cache.get("SELECT ChemicalName, ChemicalID FROM chemical_info LIMIT 1", "v1") is None
+    cache.put("SELECT ChemicalName, ChemicalID FROM chemical_info LIMIT 1", "v1", rows)
+    assert cache.get("select ChemicalName,ChemicalID from chemical_info limit 1;", "v1") == rows
+    # a different database fingerprint never sees the old result
+    assert cache.get("SELECT ChemicalName, ChemicalID FROM chemical_info LIMIT 1", "v2") is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+# least recently used results are evicted once the byte budget is exceeded
+def test_result_cache_eviction():
+    rows = [(i, 'chemical ' + str(i)) for i in range(10)]
+    cache = ResultCache(max_bytes=result_size(rows) * 2, max_entry_bytes=result_size(rows))
+    for i in range(3):
+        cache.put("SELECT " + str(i), "v1", rows)
+    assert cache.get("SELECT 0", "v1") is None
+    assert cache.get("SELECT 2", "v1") == rows
+    assert cache.stats()['evictions'] == 1
+    assert cache.bytes <= cache.max_bytes
+    # oversized results are never cached
+    cache.put("SELECT big", "v1", rows * 10)
+    assert cache.get("SELECT big", "v1") is None
@@ -0,0 +1,71 @@
+from utils import router
+from utils.router import RouteClassifier, route_question, normalize_label, read_routing_log, threshold_report, train_route_model
+from utils.table_index import TableIndex
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+import asyncio
+import pytest
+
+aop_info = {
+    'chemical_info': ['ChemicalID', 'ChemicalName', 'CasRN'],
+    'gene_info': ['GeneID', 'GeneSymbol', 'GeneName'],
+    'event_info': ['event_id', 'AOP_id', 'event_title', 'event_type'],
+}
+
+@pytest.fixture
+def classifier(tmp_path):
+    return RouteClassifier(table_index=TableIndex(aop_info), model_path=None, log_path=str(tmp_path / "routing.jsonl"))
+
+def test_normalize_label():
+    assert normalize_label("database") == 'database'
+    assert normalize_label(" none") == 'none'
+
+# clear cases are answered locally, unclear ones fall back to the LLM
+def test_classifier_route(classifier, tmp_path):
+    def llm_never():
+        raise AssertionError("the LLM should not be called")
+    assert classifier.route("Describe the AOP gene table", llm_never) == 'database'
+    assert classifier.route("What is the CAS number of MESH:C000002?", llm_never) == 'database'
+    assert classifier.route("Hello, how are you?", llm_never) == 'none'
+    assert classifier.route("Which molecules are the nastiest of the bunch?", lambda: "database") == 'database'
+    assert classifier.counts == {'fast': 3, 'llm': 1}
+
+    classifier._log.flush()
+    records = read_routing_log(str(tmp_path / "routing.jsonl"))
+    assert [record['source'] for record in records] == ['fast', 'fast', 'fast', 'llm']
+    assert records[-1]['llm_label'] == 'database'
+    assert threshold_report(str(tmp_path / "routing.jsonl"))[0]['fast_share'] >= 0.75
+
+# a model trained on the LLM-labelled log is picked up by new classifiers
+def test_train_route_model(classifier, tmp_path):
+    for question in ["Which molecules are nasty?", "Tell me about toxic molecules", "Write me a poem"]:
+        classifier.route(question, lambda: "none" if "poem" in question else "database")
+    classifier._log.flush()
+    model_path = str(tmp_path / "route_model.npz")
+    train_route_model(str(tmp_path / "routing.jsonl"), model_path, classifier=classifier)
+    trained = RouteClassifier(table_index=TableIndex(aop_info), model_path=model_path, log_path=None)
+    assert trained.weights is not None
+    assert trained.classify("Which molecules are nasty?")[0] == 'database'
+
+# the async router awaits the routing LLM only when the local classifier is unsure
+def test_classifier_aroute(classifier):
+    asked = []
+
+    async def llm():
+        asked.append(True)
+        return "database"
+
+    assert asyncio.run(classifier.aroute("Hello, how are you?", llm)) == 'none'
+    assert asyncio.run(classifier.aroute("Which molecules are the nastiest of the bunch?", llm)) == 'database'
+    assert len(asked) == 1
+    assert classifier.counts == {'fast': 1, 'llm': 1}
+
+# the candidate tables for the routing prompt are only looked up when the LLM is asked
+def test_route_question(classifier, monkeypatch):
+    index = TableIndex(aop_info)
+    looked_up = []
+    monkeypatch.setattr(router, 'get_table_index', lambda: looked_up.append(True) or index)
+    llm = FakeListChatModel(responses=["database"])
+    assert route_question("Hello, how are you?", llm, classifier) == 'none'
+    assert looked_up == []
+    assert route_question("Which chemicals are the nastiest of the bunch?", llm, classifier) == 'database'
+    assert looked_up == [True]
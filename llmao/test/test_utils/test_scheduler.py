@@ -0,0 +1,60 @@
+from utils.scheduler import StageGraph
+from utils.timing import collect, stage
+from concurrent.futures import CancelledError
+import threading
+import time
+import pytest
+
+# independent stages overlap, a dependent stage starts once its inputs are ready
+def test_stage_graph_concurrent():
+    graph = StageGraph()
+    graph.add('route', lambda: time.sleep(0.2) or 'database')
+    graph.add('selection', lambda: time.sleep(0.2) or {'chemical_info': ['ChemicalName']})
+    graph.add('query', lambda path, tables: path + ':' + ','.join(tables), after=('route', 'selection'))
+    start = time.perf_counter()
+    graph.start()
+    assert graph.result('query') == 'database:chemical_info'
+    assert time.perf_counter() - start < 0.35
+
+# a speculative stage still waiting is never run once cancelled, nor is anything depending on it
+def test_stage_graph_cancel():
+    release = threading.Event()
+    ran = []
+    graph = StageGraph()
+    graph.add('route', lambda: 'none')
+    graph.add('selection', lambda: release.wait() and ran.append('selection'))
+    graph.add('query', lambda selection: ran.append('query'), after=('selection',))
+    graph.start()
+    assert graph.result('route') == 'none'
+    graph.cancel('selection')
+    release.set()
+    with pytest.raises(CancelledError):
+        graph.result('query')
+    with pytest.raises(CancelledError):
+        graph.result('selection')
+    time.sleep(0.05)
+    assert 'query' not in ran
+
+# stage timings made on the worker threads reach the caller's collector
+def test_stage_graph_context():
+    def timed_stage():
+        with stage('table_selection'):
+            return 1
+
+    with collect() as timings:
+        graph = StageGraph().add('selection', timed_stage)
+        graph.start()
+        assert graph.result('selection') == 1
+    assert 'table_selection' in timings
+
+def test_stage_graph_errors():
+    graph = StageGraph()
+    graph.add('route', lambda: 1 / 0)
+    graph.add('query', lambda path: path, after=('route',))
+    graph.start()
+    with pytest.raises(ZeroDivisionError):
+        graph.result('route')
+    with pytest.raises(CancelledError):
+        graph.result('query')
+    with pytest.raises(ValueError):
+        StageGraph().add('query', print, after=('route',))
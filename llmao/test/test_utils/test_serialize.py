@@ -0,0 +1,39 @@
+from utils.execution import QueryResult
+from utils.serialize import approx_tokens, serialize_result
+
+def test_serialize_small_result():
+    text = serialize_result([('MESH:C000002', 'Bevonium'), ('MESH:C000003', 'Benzene')], ['ChemicalID', 'ChemicalName'])
+    assert text.splitlines()[0] == '| ChemicalID | ChemicalName |'
+    assert '| MESH:C000003 | Benzene |' in text
+    assert text.endswith('(2 rows)')
+    # error messages pass through untouched
+    assert serialize_result("The SQLite query was not valid") == "The SQLite query was not valid"
+    assert serialize_result([], ['ChemicalID']) == '(no rows)'
+
+# constant columns are stated once and identical rows are merged with a count
+def test_serialize_deduplicates():
+    rows = [('chlorobenzene', 'increases^expression', 'CYP1A1')] * 3 + [('chlorobenzene', 'increases^expression', 'AHR')]
+    text = serialize_result(rows, ['ChemicalName', 'InteractionActions', 'GeneSymbol'], style='columnar')
+    assert 'ChemicalName = chlorobenzene (every row)' in text
+    assert 'GeneSymbol: CYP1A1 | AHR' in text
+    assert 'n: 3 | 1' in text
+    assert text.count('chlorobenzene') == 1
+
+# the serialized size stays flat as the result grows, the tail is summarized instead
+def test_serialize_token_budget():
+    columns = ['ChemicalID', 'ChemicalName', 'Score']
+    sizes = []
+    for n in (100, 1000, 10000):
+        rows = [('MESH:C%06d' % i, 'chemical %d' % (i % 7), i / 2) for i in range(n)]
+        text = serialize_result(rows, columns, token_budget=400)
+        assert approx_tokens(text) <= 400
+        assert 'more rows not shown' in text
+        assert 'ChemicalName: 7 distinct, top' in text
+        sizes.append(approx_tokens(text))
+    assert max(sizes) - min(sizes) < 40
+
+def test_serialize_query_result():
+    result = QueryResult('SELECT ChemicalName FROM chemical_info', [('a',), ('b',)], ['ChemicalName'], truncated=True)
+    text = serialize_result(result)
+    assert text.startswith('| ChemicalName |')
+    assert 'more rows than were fetched' in text
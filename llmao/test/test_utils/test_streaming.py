@@ -0,0 +1,31 @@
+from utils.streaming import atee_stream, tee_stream
+import asyncio
+
+# chunks are passed through unchanged and the callback sees the full text exactly once
+def test_tee_stream():
+    seen = []
+    chunks = list(tee_stream(iter(["The ", "AOP ", "database"]), on_complete=[seen.append]))
+    assert chunks == ["The ", "AOP ", "database"]
+    assert seen == ["The AOP database"]
+
+# an abandoned stream is never post-processed
+def test_tee_stream_partial():
+    seen = []
+    stream = tee_stream(iter(["a", "b", "c"]), on_complete=[seen.append])
+    next(stream)
+    stream.close()
+    assert seen == []
+
+async def _chunks(chunks):
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+def test_atee_stream():
+    seen = []
+
+    async def consume():
+        return [chunk async for chunk in atee_stream(_chunks(["The ", "AOP"]), on_complete=[seen.append])]
+
+    assert asyncio.run(consume()) == ["The ", "AOP"]
+    assert seen == ["The AOP"]
@@ -0,0 +1,65 @@
+from utils.catalog import SchemaCatalog
+from utils.connection import ConnectionPool
+from utils.execution import QueryExecutor
+from utils.summaries import (build_summaries, describe_summaries, read_manifest, specs_from_log, summaries_path,
+                             summary_name)
+from utils.validator import SQLValidator
+from benchmarks.synthetic import make_aop_db
+import pytest
+
+PATH = ['chemical_info', 'chemical_gene', 'gene_info', 'gene_pathway']
+
+@pytest.fixture
+def database(tmp_path):
+    db_name = make_aop_db(str(tmp_path / "aop.db"), scale=100)
+    return db_name, SchemaCatalog(db_name, sidecar=str(tmp_path / "aop.catalog.json"))
+
+def test_summary_name():
+    assert summary_name(PATH) == 'chemical_gene_pathway'
+    assert summary_name(['aop_info', 'event_info']) == 'aop_event'
+
+# the joins run most often are materialized, counts when they were counted
+def test_specs_from_log(database, tmp_path):
+    db_name, catalog = database
+    log_path = str(tmp_path / "query_log.jsonl")
+    executor = QueryExecutor(ConnectionPool(db_name), catalog, log_path=log_path, use_cache=False)
+    for _ in range(3):
+        executor.run("SELECT p.PathwayName FROM gene_pathway p JOIN gene_info g ON g.GeneID = p.GeneID "
+                     "JOIN chemical_gene cg ON cg.GeneID = g.GeneID JOIN chemical_info c ON c.ChemicalID = cg.ChemicalID "
+                     "WHERE c.ChemicalName = 'chlorobenzene'")
+    for _ in range(2):
+        executor.run("SELECT COUNT(*) FROM event_info e JOIN aop_info a ON a.AOP_id = e.AOP_id WHERE a.AOP_id = 3")
+    executor.run("SELECT * FROM disease_gene d JOIN gene_info g ON g.GeneID = d.GeneID")
+    executor._log.flush()
+
+    assert specs_from_log(log_path, catalog) == [{'tables': PATH, 'counts': False},
+                                                 {'tables': ['aop_info', 'event_info'], 'counts': True}]
+
+def test_build_summaries(database):
+    db_name, catalog = database
+    manifest = build_summaries(db_name, specs=[{'tables': PATH}], catalog=catalog)
+    assert manifest['mv_chemical_gene_pathway']['kind'] == 'join'
+    assert manifest['mv_chemical_gene_pathway_counts']['columns'] == ['CasRN', 'ChemicalID', 'ChemicalName',
+                                                                      'GeneID_count', 'PathwayID_count']
+    # one row per chemical, long text like the definitions is not copied into the join
+    assert manifest['mv_chemical_gene_pathway_counts']['rows'] == 100
+    assert 'Definition' not in manifest['mv_chemical_gene_pathway']['columns']
+    assert read_manifest(summaries_path(db_name), 'other version') == {}
+    assert catalog.summary_tables['mv_chemical_gene_pathway'] == manifest['mv_chemical_gene_pathway']['columns']
+
+    assert 'mv_chemical_gene_pathway_counts(' in describe_summaries(manifest, str({'chemical_info': [], 'gene_pathway': []}))
+    assert describe_summaries(manifest, str({'chemical_info': [], 'aop_info': []})) == ''
+
+    # the attached sidecar answers what the four-way join does
+    pool = ConnectionPool(db_name, attach={'mv': summaries_path(db_name)})
+    with pool.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT p.PathwayName FROM chemical_info c JOIN chemical_gene cg ON cg.ChemicalID = c.ChemicalID "
+                       "JOIN gene_info g ON g.GeneID = cg.GeneID JOIN gene_pathway p ON p.GeneID = g.GeneID "
+                       "WHERE c.ChemicalName = 'chlorobenzene' ORDER BY 1")
+        joined = cursor.fetchall()
+        cursor.execute("SELECT DISTINCT PathwayName FROM mv_chemical_gene_pathway WHERE ChemicalName = 'chlorobenzene' ORDER BY 1")
+        assert cursor.fetchall() == joined
+        cursor.execute("SELECT PathwayID_count FROM mv_chemical_gene_pathway_counts WHERE ChemicalName = 'chlorobenzene'")
+        assert cursor.fetchone()[0] > 0
+    assert SQLValidator(catalog, pool).check_identifiers("SELECT GeneID_count FROM mv_chemical_gene_pathway_counts") == []
+    pool.close_all()
@@ -0,0 +1,37 @@
+from utils.table_index import TableIndex, tokenize
+
+aop_info = {
+    'chemical_info': ['ChemicalID', 'ChemicalName', 'CasRN'],
+    'chemical_gene': ['ChemicalID', 'GeneID', 'InteractionActions'],
+    'gene_info': ['GeneID', 'GeneSymbol', 'GeneName'],
+    'event_info': ['event_id', 'AOP_id', 'event_title', 'event_type'],
+}
+
+def test_tokenize():
+    assert tokenize("ChemicalName") == ['chemical', 'name']
+    assert tokenize("What are the key events in AOP_id 3?") == ['key', 'event', 'id', '3']
+
+# the table matching every term of the question ranks first, tables matching one term follow,
+# unrelated tables are left out
+def test_table_index_rank():
+    index = TableIndex(aop_info)
+    ranked = [table for table, _ in index.rank("Which genes interact with chemicals?")]
+    assert ranked[0] == 'chemical_gene'
+    assert set(ranked[1:]) == {'gene_info', 'chemical_info'}
+
+def test_table_index_select():
+    index = TableIndex(aop_info)
+    table_dict, decisive = index.select("List the key event titles")
+    assert decisive
+    assert table_dict == {'event_info': aop_info['event_info']}
+    table_dict, decisive = index.select("What is the weather like?")
+    assert table_dict == {} and not decisive
+
+# a decisive table comes with the runner-up when the two share a join key, the question may need both
+def test_table_index_select_join():
+    index = TableIndex(aop_info)
+    table_dict, decisive = index.select("Which interaction actions does chemical MESH:C1 have on genes?")
+    assert decisive
+    assert table_dict == {'chemical_gene': aop_info['chemical_gene'], 'gene_info': aop_info['gene_info']}
+    assert index.join_keys('chemical_gene', 'gene_info') == ['GeneID']
+    assert index.join_keys('event_info', 'gene_info') == []
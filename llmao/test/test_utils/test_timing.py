@@ -0,0 +1,81 @@
+from utils.timing import (LatencyHistogram, StageMetrics, collect, current_stage, get_stage_metrics, record, stage,
+                          time_stream, timed)
+import random
+import threading
+import pytest
+
+# nested stages are all timed and the innermost one is the current stage
+def test_stage_collect():
+    with collect() as timings:
+        with stage('sql_repair'):
+            with stage('sql_execution'):
+                assert current_stage() == 'sql_execution'
+            assert current_stage() == 'sql_repair'
+        with stage('sql_execution'):
+            pass
+        record('answer_first_token', 0.25)
+    assert current_stage() is None
+    assert len(timings['sql_execution']) == 2
+    assert timings['sql_repair'][0] >= timings['sql_execution'][0]
+    assert timings['answer_first_token'] == [0.25]
+
+# without a collector stages cost nothing, and collectors are per context
+def test_stage_without_collector():
+    with stage('route'):
+        record('route', 1.0)
+    seen = []
+    with collect() as timings:
+        thread = threading.Thread(target=lambda: seen.append(current_stage()))
+        with stage('evaluation'):
+            thread.start()
+            thread.join()
+    assert seen == [None]
+    assert list(timings) == ['evaluation']
+
+# percentiles from the log-linear buckets stay within a few percent of the exact ones
+def test_latency_histogram():
+    values = [random.lognormvariate(-3, 1) for _ in range(5000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    for q in (50, 95, 99):
+        exact = values[int(q / 100 * len(values)) - 1]
+        assert histogram.percentile(q) == pytest.approx(exact, rel=0.05)
+    assert histogram.count == 5000
+    assert LatencyHistogram().percentile(50) != LatencyHistogram().percentile(50)
+
+def test_stage_metrics_prometheus():
+    metrics = StageMetrics()
+    for seconds in (0.1, 0.2, 0.3):
+        metrics.observe('sql_generation', seconds)
+    metrics.failure('sql_execution')
+    metrics.retry('sql_execution')
+    snapshot = metrics.snapshot()
+    assert snapshot['sql_generation']['count'] == 3
+    assert snapshot['sql_generation']['p50'] == pytest.approx(0.2, rel=0.05)
+    assert snapshot['sql_execution']['failures'] == 1 and snapshot['sql_execution']['count'] == 0
+    text = metrics.prometheus_text()
+    assert '# TYPE llmao_stage_seconds summary' in text
+    assert 'llmao_stage_seconds_count{stage="sql_generation"} 3' in text
+    assert 'llmao_stage_failures_total{stage="sql_execution"} 1' in text
+    assert 'llmao_stage_retries_total{stage="sql_execution"} 1' in text
+
+# failures are counted, decorated functions and streams are timed
+def test_stage_failures_and_streams():
+    metrics = get_stage_metrics()
+    metrics.reset()
+
+    @timed('context_parsing')
+    def parse(text):
+        return text.upper()
+
+    with collect() as timings:
+        with pytest.raises(ValueError):
+            with stage('sql_execution'):
+                raise ValueError('no such table')
+        assert parse('ok') == 'OK'
+        assert ''.join(time_stream(iter(['a', 'b']), 'answer', first_name='answer_first_token')) == 'ab'
+    assert set(timings) == {'sql_execution', 'context_parsing', 'answer', 'answer_first_token'}
+    assert timings['answer_first_token'][0] <= timings['answer'][0]
+    assert metrics.snapshot()['sql_execution']['failures'] == 1
@@ -0,0 +1,69 @@
+from utils.catalog import SchemaCatalog
+from utils.candidates import CandidatesFailed
+from utils.connection import ConnectionPool
+from utils.validator import SQLValidationError, SQLValidator, error_hints, extract_sql
+from benchmarks.synthetic import make_aop_db
+import pytest
+
+@pytest.fixture
+def validator(tmp_path):
+    db_name = make_aop_db(str(tmp_path / "aop.db"), scale=100)
+    pool = ConnectionPool(db_name)
+    yield SQLValidator(SchemaCatalog(db_name, sidecar=str(tmp_path / "aop.catalog.json")), pool)
+    pool.close_all()
+
+def test_extract_sql():
+    assert extract_sql("SELECT 1;") == "SELECT 1"
+    assert extract_sql("Here is the query:\n```sql\nSELECT ChemicalName FROM chemical_info LIMIT 2;\n```\n"
+                       "This returns two chemicals.") == "SELECT ChemicalName FROM chemical_info LIMIT 2"
+    assert extract_sql('Response: "Select ChemicalName FROM chemical_info LIMIT 2;"') == \
+        "Select ChemicalName FROM chemical_info LIMIT 2"
+    # semicolons in literals are kept, a second statement is dropped
+    assert extract_sql("SELECT * FROM aop_info WHERE AOP_name = 'a;b'; DROP TABLE aop_info") == \
+        "SELECT * FROM aop_info WHERE AOP_name = 'a;b'"
+    # a clause after a blank line is part of the query, a sentence is not
+    assert extract_sql("SELECT * FROM aop_info\n\nWHERE AOP_id = 1\n\nThis query selects AOP 1.") == \
+        "SELECT * FROM aop_info\nWHERE AOP_id = 1"
+    assert extract_sql("I cannot answer that from the database.") == ''
+    # "select" and "with" in the prose before the query do not start it
+    assert extract_sql("Here is a query to select two chemicals:\n\nSELECT ChemicalName FROM chemical_info LIMIT 2;") == \
+        "SELECT ChemicalName FROM chemical_info LIMIT 2"
+    assert extract_sql("To select the chemicals, use SELECT ChemicalName FROM chemical_info LIMIT 2") == \
+        "SELECT ChemicalName FROM chemical_info LIMIT 2"
+    assert extract_sql("With the gene table:\nWITH g AS (SELECT GeneID FROM gene_info) SELECT * FROM g") == \
+        "WITH g AS (SELECT GeneID FROM gene_info) SELECT * FROM g"
+
+def test_validate(validator):
+    assert validator.validate("```sql\nSELECT GeneSymbol FROM gene_info WHERE GeneID = 3 LIMIT 5;\n```") == \
+        "SELECT GeneSymbol FROM gene_info WHERE GeneID = 3 LIMIT 5"
+    # the row cap is the executor's, which decides on the plan
+    assert validator.validate("SELECT * FROM gene_info") == "SELECT * FROM gene_info"
+    assert validator.counts == {'validated': 2, 'rejected': 0, 'extracted': 1}
+    # the identifier check only runs for the repair of a query sqlite refused
+    validator.check_identifiers = lambda query: pytest.fail('identifiers checked on a valid query')
+    assert validator.validate("SELECT GeneSymbol FROM gene_info") == "SELECT GeneSymbol FROM gene_info"
+
+def test_check_identifiers(validator):
+    assert validator.check_identifiers("SELECT g.GeneSymbol, COUNT(*) AS n FROM chemical_gene cg JOIN gene_info AS g "
+                                       "ON g.GeneID = cg.GeneID WHERE cg.ChemicalID = 'x' GROUP BY g.GeneSymbol "
+                                       "ORDER BY n DESC") == []
+    hints = validator.check_identifiers("SELECT GeneSymbl, ChemicalName FROM gene_infos JOIN gene_pathway p "
+                                        "ON p.GeneId = 1 WHERE p.PathwayNme = 'x'")
+    assert {'kind': 'unknown_table', 'name': 'gene_infos', 'suggestions': ['gene_info']} in hints
+    assert {'kind': 'unknown_column', 'name': 'PathwayNme', 'table': 'gene_pathway',
+            'suggestions': ['PathwayName']} in hints
+    assert {'kind': 'column_elsewhere', 'name': 'ChemicalName', 'tables': ['gene_pathway'],
+            'owners': ['chemical_info']} in hints
+
+def test_rejected(validator):
+    with pytest.raises(SQLValidationError) as raised:
+        validator.validate("SELECT GeneSymbl FROM gene_info")
+    assert raised.value.query == "SELECT GeneSymbl FROM gene_info"
+    assert 'no such column' in str(raised.value)
+    assert 'did you mean GeneSymbol?' in error_hints(raised.value)
+
+    with pytest.raises(SQLValidationError):
+        validator.validate("DELETE FROM gene_info")
+    assert validator.counts['rejected'] == 2
+    # every candidate failed, the repair hears about the first
+    assert 'GeneSymbl' in error_hints(CandidatesFailed([("SELECT 1", raised.value), (None, ValueError('x'))]))
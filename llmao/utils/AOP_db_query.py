@@ -1,43 +1,33 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+import asyncio
 import sqlite3
-from langchain_community.chat_models import BedrockChat
-from utils.utils import AOP_Info, SQL_context_parser
-from utils.utils import get_session
-from eval.evaluator import Evaluator
+from utils.models import CHAT_MODEL, TABLE_MODEL, get_chat_model
+from utils.catalog import get_catalog
+from utils.fulltext import describe_fulltext, get_fulltext_tables
+from utils.summaries import describe_summaries, get_summary_tables
+from utils.table_index import get_table_index
+from utils.candidates import CANDIDATE_TEMPERATURE, SQL_CANDIDATES, race_candidates, race_candidates_async
+from utils.execution import execute_query
+from utils.validator import error_hints, validate_query
+from utils.serialize import serialize_result
+from utils.streaming import atee_stream, tee_stream
+from utils.timing import atime_stream, count_retry, stage, time_stream
+from utils.question_cache import get_question_cache
+from eval.background import get_evaluation_queue
 from langfuse.decorators import observe, langfuse_context
 from langchain_core.messages import AIMessage
 
-
-@observe(capture_input=False)
-def AOP_query_chain(question, chat_history, save_context=True, stream=True):
-    ''' Answer user questions using the adverse outcome pathway database by constructing & executing SQLite queries
-
-    Args
-        question - 
-        chat_history -
-        stream - stream the LLM chain repsonse, if False use chain.invoke()
-    Output
-    '''
-    langfuse_context.update_current_trace(name = "AOP_DB_RAG", session_id=get_session())
-    langfuse_context.update_current_observation(name="retrieval", session_id=get_session(), input=question)
-    try:
-        langfuse_handler = langfuse_context.get_current_langchain_handler()
-    except IndexError:
-        pass
-    table_dict = AOP_route(question, chat_history)
-
-    llm = BedrockChat(
-        credentials_profile_name="default", model_id="anthropic.claude-3-sonnet-20240229-v1:0", verbose=True)
-
-    # first, generate the SQL query based on the user's question
-    query_generator = """ <instructions>
+# prompt writing the SQLite query from the tables chosen by AOP_route
+QUERY_PROMPT = ChatPromptTemplate.from_template(""" <instructions>
     You are a SQLite expert. At the end of this query, you will be given a user question about the adverse outcome pathway (AOP)
     database. Your sole purpose is to find a SQL query to retrieve information from the AOP database which would answer the question.
     Your goal is not to execute the query or provide any information other than the SQLite query. Form the simplest query possible
     to answer the user question. The query SHOULD NOT for any reason mention Bedrock or us-east-1 region.
     Unless the user's question suggests otherwise, limit your response to the {top_k} results by using a LIMIT clause.
-    Use any or all of tables found in the keys of {table_dict} and only the columns found in the values of {table_dict}. </instructions> 
+    Use any or all of tables found in the keys of {table_dict} and only the columns found in the values of {table_dict}.
+    {fulltext}
+    {summaries} </instructions> 
     
     <example1>
     User Input: "Look up 2 chemicals in the AOP Database"
@@ -53,77 +43,30 @@ def AOP_query_chain(question, chat_history, save_context=True, stream=True):
     <formatting>    
     Respond ONLY with the SQLite query:
     </formatting>
-    """
+    """)
 
-    chain = ChatPromptTemplate.from_template(query_generator) | llm | StrOutputParser()
-
-    query = chain.invoke({
-        'question': question,
-        'top_k': 5,
-        'table_dict': table_dict
-    })
-
-    db_name = './aopdb_08-25-2020.db'
-    sqliteConnection = sqlite3.connect(db_name)
-    cursor = sqliteConnection.cursor()
-
-    try:
-        cursor.execute(query)
-        result = cursor.fetchall()
-    except sqlite3.ProgrammingError:
-        result = "The SQLite query was not valid, the AOP database could not be queried"
-    except sqlite3.Error:
-        checker_prompt = """ <instructions>
+# prompt correcting a query the database could not execute
+REPAIR_PROMPT = ChatPromptTemplate.from_template(""" <instructions>
         You are an assisstant with deep expertise in SQLite and the Adverse Outcome Pathway database. A previous assistant was tasked
         with transforming the user's question into a SQLite query, but their query was not properly executable. Your task is to correct
         the query, or write a new query to answer the user's question, and ensure that it is syntactically correct and executable.
         The query SHOULD NOT for any reason mention Bedrock or us-east-1 region.
-        
+    
         Use any or all of tables found in the keys of {table_dict} and only the columns found in the values of {table_dict}. </instructions> 
-        
+    
         <context>
         User question: {question}
         Failed SQLite query: {query}
+        Problems found in the failed query: {errors}
         </context>
-        
+    
         <formatting>
         Respond ONLY with the executable SQL query here:
         </formatting>
-        """
-
-        check_chain = ChatPromptTemplate.from_template(checker_prompt) | llm | StrOutputParser()
-        
-        query = check_chain.invoke({
-            'question': question,
-            'top_k': 5,
-            'query': query,
-            'table_dict': table_dict
-            })
-        try:
-            cursor.execute(query)
-            result = cursor.fetchall()
-        except sqlite3.OperationalError:
-            # implement some sort of error chain
-            result = "The SQLite query was not valid"
-            return failed_response(question, chat_history)
+        """)
 
-    cursor.close()
-    sqliteConnection.close()
-
-    if save_context:
-        # transform the SQL query + result into full sentence context
-        context = SQL_context_parser(llm, query=query, query_results=result)
-        langfuse_context.update_current_observation(
-            name='aop_db_retrieval',
-            input=question,
-            output=context,
-            tags=["retrieval"]
-        )
-        AOP_query_chain.context = context
-    else:
-        pass
-
-    aop_answer = """ <instructions>
+# prompt answering the user's question from the executed query and its result
+ANSWER_PROMPT = ChatPromptTemplate.from_template(""" <instructions>
     You are a helpful assistant trying to answer a user's question using the results of a SQLite query that was already executed for you. 
     Use all of the information to fully answer the user's question in the context of the adverse outcome pathway database. 
     Be concise, but feel free to give more context if the user asks an open-ended question. Your goal first and foremost is to address
@@ -139,46 +82,10 @@ def AOP_query_chain(question, chat_history, save_context=True, stream=True):
     <formatting>
     Answer in complete sentences, and do your best to explain how the query answers the user's question.
     </formatting>
-    """
+    """)
 
-    answer_chain = ChatPromptTemplate.from_template(aop_answer) | llm | StrOutputParser()    
-    
-    answer_stream = answer_chain.invoke({
-            'question': question,
-            'query': query,
-            'result': result,
-            'chat_history': chat_history
-        })
-
-    evaluator = Evaluator(metrics = ['faithfulness', 'answer_relevancy'], data=[[question, answer_stream, context]])
-    evaluator.trace_scores()
-    
-    if stream:
-        return answer_chain.stream({
-            'question': question,
-            'query': query,
-            'result': result,
-            'chat_history': chat_history
-        }, config={"callbacks": [langfuse_handler]})
-    else:
-        return [answer_chain.invoke({
-            'question': question,
-            'query': query,
-            'result': result,
-            'chat_history': chat_history
-            }), context]
-
-def AOP_route(question, chat_history):
-    ''' The goal of this function is to take in a question about the AOP Database and use a LLM chain to determine which table(s) to use when answering
-        the user's question. 
-    
-    Args
-        question -
-    Output
-        table_dict - {'table': [column1, column2, ...]}
-    '''
-
-    prompt = """ <instructions>
+# prompt choosing the tables and columns needed to answer a question
+TABLE_PROMPT = ChatPromptTemplate.from_template(""" <instructions>
     You are an expert at Adverse Outcome Pathways (AOPs). Your goal is to take a user's question, look at the AOP database scehema provided, and determine
     what table(s) and what column(s) of those tables are needed to answer the question. Do not include any tables or columns that are not essential
     to answering the user's question. If the users mentions any of the values in the AOP database scheme, include them in your response. 
@@ -192,21 +99,10 @@ def AOP_route(question, chat_history):
     <formatting>
     Respond ONLY with a dictionary in the same style as the schema dictionary. Do not explain your answer.
     </formatting>
-    """
-
-    llm = BedrockChat(credentials_profile_name="default", model_id="mistral.mistral-7b-instruct-v0:2", verbose=True)
-
-    chain = ChatPromptTemplate.from_template(prompt) | llm | StrOutputParser()
-
-    table_dict = chain.invoke({
-        'aop_dict': AOP_Info,
-        'question': question
-    })
-
-    return table_dict
+    """)
 
-def failed_response(question, chat_history, stream=True):
-    prompt ='''
+# prompt explaining that the database could not answer the question
+FAILED_PROMPT = ChatPromptTemplate.from_template('''
     You are a helpful assisstant who is trying to help a user who asked a question about the
     adverse outcome pathway database. Unfortunately, the user's question could not be answered
     using the adverse outcome pathway database because the information could not be found.
@@ -216,15 +112,404 @@ def failed_response(question, chat_history, stream=True):
     Context:
     User question: {question}
     Chat history: {chat_history}
+    ''')
+
+
+def _langfuse_callbacks():
+    try:
+        langfuse_handler = langfuse_context.get_current_langchain_handler()
+    except IndexError:
+        langfuse_handler = None
+    return [langfuse_handler] if langfuse_handler is not None else []
+
+def _use_execution(execution, question, query, table_dict, cached, question_cache):
+    ''' Bookkeeping once a query ran: trace metadata, question cache, serialized result
+
+    Output
+        (query that produced the rows, serialized result)
+    '''
+    langfuse_context.update_current_observation(metadata={'execution': execution.report()})
+    # only SQL that ran and returned rows is worth replaying for the next similar question
+    if cached is None and execution.rows:
+        question_cache.store(question, query, table_dict)
+    # the guardrails may have added a LIMIT, show the LLM the query that produced the rows;
+    # a headed, de-duplicated table within a fixed token budget rather than the raw list of tuples,
+    # so the prompts below stay the same size however many rows came back
+    return execution.query, serialize_result(execution)
+
+def _candidate_llm(llm, i):
+    # the first candidate is the usual query, the others are sampled to differ from it
+    return llm if i == 0 else get_chat_model(CHAT_MODEL, model_kwargs={'temperature': CANDIDATE_TEMPERATURE})
+
+def _validated_execution(query):
+    # a candidate is checked and run in one go on its worker thread
+    return execute_query(validate_query(query))
+
+def _evaluator(question, context, result):
+    # the stream is consumed after AOP_query_chain returns, so remember which trace to score
+    trace_id = langfuse_context.get_current_trace_id()
+
+    def evaluate(answer):
+        # scoring runs on background workers, the caller never waits on the evaluator
+        # without a parsed context the evaluator judges the answer against the serialized result
+        get_evaluation_queue().submit(trace_id, question, answer, context if context is not None else result,
+                                      route='aop_db')
+    return evaluate
+
+
+def select_tables(question, chat_history):
+    ''' The part of AOP_query_chain that depends on the question alone: a near-identical question answered
+        before skips table routing and SQL generation entirely, otherwise AOP_route picks the tables.
+        It can run before the routing decision is known, see utils.pipeline.answer_question
+
+    Output
+        selection - {'cached': question cache entry or None, 'table_dict': text of {'table': [column1, ...]}}
     '''
+    with stage('question_cache'):
+        cached = get_question_cache().lookup(question)
+    if cached is not None:
+        return {'cached': cached, 'table_dict': cached['table_dict']}
+    with stage('table_selection'):
+        return {'cached': None, 'table_dict': AOP_route(question, chat_history)}
+
+async def select_tables_async(question, chat_history):
+    ''' select_tables for the async pipeline
+    '''
+    with stage('question_cache'):
+        cached = await asyncio.to_thread(get_question_cache().lookup, question)
+    if cached is not None:
+        return {'cached': cached, 'table_dict': cached['table_dict']}
+    with stage('table_selection'):
+        return {'cached': None, 'table_dict': await AOP_route_async(question, chat_history)}
+
+def _step(function, *args, coroutine=None):
+    # one blocking call of the chain: function(*args) in AOP_query_chain, awaited as coroutine(*args) in
+    # AOP_query_chain_async, or on a worker thread there when the call has no async version
+    return function, coroutine, args
+
+def _run_steps(steps):
+    ''' Drive _retrieval_steps on the calling thread: every step is called and its result sent back,
+        an exception it raised is thrown back into the chain at the step
+    '''
+    value, error = None, None
+    while True:
+        try:
+            function, _, args = steps.send(value) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = function(*args), None
+        except Exception as exc:
+            value, error = None, exc
+
+async def _arun_steps(steps):
+    ''' _run_steps on the event loop
+    '''
+    value, error = None, None
+    while True:
+        try:
+            function, coroutine, args = steps.send(value) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            if coroutine is not None:
+                value = await coroutine(*args)
+            else:
+                value = await asyncio.to_thread(function, *args)
+            error = None
+        except Exception as exc:
+            value, error = None, exc
+
+def _retrieval_steps(question, chat_history, llm, save_context, selection, candidates):
+    ''' Everything AOP_query_chain and AOP_query_chain_async do before the answer: table selection, SQL
+        generation, validation, execution and repair, and the parsed context. Written once as a generator
+        yielding each blocking call as a _step, which the sync entry point runs on its thread and the async
+        one awaits, so both follow the same branches
+
+    Output (returned)
+        (answer prompt input, context), or None when no query could be executed
+    '''
+    question_cache = get_question_cache()
+    if selection is None:
+        selection = yield _step(select_tables, question, chat_history, coroutine=select_tables_async)
+    cached, table_dict = selection['cached'], selection['table_dict']
+    query = cached['query'] if cached is not None else None
+
+    execution = None
+    try:
+        if query is None and candidates > 1:
+            # the candidates are written and executed at once, repair only runs if all of them fail
+            with stage('sql_candidates'):
+                # the winner's text is what the question cache replays, as for a single generated query
+                execution, winner, query = yield _step(_race, llm, question, table_dict, candidates,
+                                                       coroutine=_race_async)
+            langfuse_context.update_current_observation(metadata={'sql_candidate': winner})
+        else:
+            if query is None:
+                with stage('sql_generation'):
+                    query = yield _step(generate_query, llm, question, table_dict, coroutine=generate_query_async)
+            # fences and prose are stripped, names checked against the schema and the query compiled
+            # before it runs, a query failing here goes to the repair with what was wrong with it
+            with stage('sql_validation'):
+                query = yield _step(validate_query, query)
+            # runs on a pooled connection within the plan, time and size guardrails,
+            # repeated queries are served from the result cache
+            with stage('sql_execution'):
+                execution = yield _step(execute_query, query)
+    except sqlite3.ProgrammingError:
+        result = "The SQLite query was not valid, the AOP database could not be queried"
+    except sqlite3.Error as error:
+        # with candidates, the first one that was written is repaired; after validation, the extracted query
+        query = getattr(error, 'query', query)
+        count_retry('sql_execution')
+        with stage('sql_repair'):
+            query = yield _step(repair_query, llm, question, query, error, table_dict, coroutine=repair_query_async)
+        try:
+            with stage('sql_validation'):
+                query = yield _step(validate_query, query)
+            with stage('sql_execution'):
+                execution = yield _step(execute_query, query)
+        except sqlite3.OperationalError:
+            # implement some sort of error chain
+            return None
+
+    if execution is not None:
+        query, result = yield _step(_use_execution, execution, question, query, table_dict, cached, question_cache)
+
+    if save_context:
+        # utils.utils needs the streamlit runtime, imported here so this module loads without it
+        from utils.utils import SQL_context_parser, SQL_context_parser_async
+        # transform the SQL query + result into full sentence context
+        with stage('context_parsing'):
+            context = yield _step(SQL_context_parser, llm, query, result, coroutine=SQL_context_parser_async)
+        langfuse_context.update_current_observation(
+            name='aop_db_retrieval',
+            input=question,
+            output=context,
+            tags=["retrieval"]
+        )
+    else:
+        context = None
+
+    answer_input = {
+        'question': question,
+        'query': query,
+        'result': result,
+        'chat_history': chat_history
+    }
+    return answer_input, context
+
+def _start_trace(question):
+    # utils.utils needs the streamlit runtime, imported here so this module loads without it
+    from utils.utils import get_session
+    langfuse_context.update_current_trace(name = "AOP_DB_RAG", session_id=get_session())
+    langfuse_context.update_current_observation(name="retrieval", session_id=get_session(), input=question)
+
+@observe(capture_input=False)
+def AOP_query_chain(question, chat_history, save_context=True, stream=True, selection=None, candidates=SQL_CANDIDATES):
+    ''' Answer user questions using the adverse outcome pathway database by constructing & executing SQLite queries
+
+    Args
+        question - 
+        chat_history -
+        stream - stream the LLM chain repsonse, if False use chain.invoke()
+        selection - result of select_tables when it already ran, e.g. concurrently with routing
+        candidates - SQL queries generated and executed concurrently, the first returning rows is used
+    Output
+        generator of answer chunks if stream, otherwise [answer, context]
+    '''
+    _start_trace(question)
+    callbacks = _langfuse_callbacks()
+    llm = get_chat_model(CHAT_MODEL)
+
+    retrieved = _run_steps(_retrieval_steps(question, chat_history, llm, save_context, selection, candidates))
+    if retrieved is None:
+        failed = failed_response(question, chat_history, stream=stream)
+        return failed if stream else [failed, None]
+    answer_input, context = retrieved
+    if save_context:
+        AOP_query_chain.context = context
+
+    answer_chain = ANSWER_PROMPT | llm | StrOutputParser()
+    evaluate = _evaluator(question, context, answer_input['result'])
+
+    # generate the answer once: tokens go straight to the caller and evaluation runs on the buffered text
+    if stream:
+        return time_stream(tee_stream(answer_chain.stream(answer_input, config={"callbacks": callbacks}), on_complete=[evaluate]),
+                           'answer', first_name='answer_first_token')
+    else:
+        with stage('answer'):
+            answer = answer_chain.invoke(answer_input, config={"callbacks": callbacks})
+        evaluate(answer)
+        return [answer, context]
+
+@observe(capture_input=False)
+async def AOP_query_chain_async(question, chat_history, save_context=True, stream=True, selection=None,
+                                candidates=SQL_CANDIDATES):
+    ''' AOP_query_chain for the asyncio pipeline: every chat model is awaited (ainvoke/astream) and the
+        SQLite work runs on worker threads, so the event loop keeps serving other sessions meanwhile.
+        The parsed context is not kept on the function as AOP_query_chain.context is, concurrent
+        questions would overwrite each other's.
+
+    Args
+        question - 
+        chat_history -
+        stream - stream the LLM chain repsonse, if False use chain.ainvoke()
+        selection - result of select_tables_async when it already ran
+        candidates - SQL queries generated and executed concurrently, the first returning rows is used
+    Output
+        async iterator of answer chunks if stream, otherwise [answer, context]
+    '''
+    _start_trace(question)
+    callbacks = _langfuse_callbacks()
+    llm = get_chat_model(CHAT_MODEL)
+
+    retrieved = await _arun_steps(_retrieval_steps(question, chat_history, llm, save_context, selection, candidates))
+    if retrieved is None:
+        failed = await failed_response_async(question, chat_history, stream=stream)
+        return failed if stream else [failed, None]
+    answer_input, context = retrieved
+
+    answer_chain = ANSWER_PROMPT | llm | StrOutputParser()
+    evaluate = _evaluator(question, context, answer_input['result'])
+
+    if stream:
+        return atime_stream(atee_stream(answer_chain.astream(answer_input, config={"callbacks": callbacks}), on_complete=[evaluate]),
+                            'answer', first_name='answer_first_token')
+    else:
+        with stage('answer'):
+            answer = await answer_chain.ainvoke(answer_input, config={"callbacks": callbacks})
+        evaluate(answer)
+        return [answer, context]
+
+def _query_input(question, table_dict, top_k):
+    return {
+        'question': question,
+        'top_k': top_k,
+        'table_dict': table_dict,
+        # empty unless the FTS5 sidecar has been built for this database
+        'fulltext': describe_fulltext(get_fulltext_tables()),
+        # the prebuilt joins of the selected tables, empty unless the summary sidecar has been built
+        'summaries': describe_summaries(get_summary_tables(), table_dict)
+    }
+
+def generate_query(llm, question, table_dict, top_k=5):
+    ''' Generate the SQLite query answering the user's question from the tables selected by AOP_route
+
+    Args
+        llm - chat model writing the query
+        question - user question
+        table_dict - text of {'table': [column1, column2, ...]} from AOP_route
+    Output
+        query - SQLite query string
+    '''
+    chain = QUERY_PROMPT | llm | StrOutputParser()
+
+    return chain.invoke(_query_input(question, table_dict, top_k))
+
+async def generate_query_async(llm, question, table_dict, top_k=5):
+    ''' generate_query for the async pipeline
+    '''
+    chain = QUERY_PROMPT | llm | StrOutputParser()
+
+    return await chain.ainvoke(_query_input(question, table_dict, top_k))
+
+def _repair_input(question, query, error, table_dict):
+    return {
+        'question': question,
+        'top_k': 5,
+        'query': query,
+        'errors': error_hints(error),
+        'table_dict': table_dict
+    }
+
+def repair_query(llm, question, query, error, table_dict):
+    ''' Correct a query that failed validation or execution, given what was wrong with it
+
+    Args
+        llm - chat model writing the query
+        query - the failed query
+        error - the sqlite3 error it failed with
+        table_dict - text of {'table': [column1, column2, ...]} from AOP_route
+    Output
+        query - SQLite query string
+    '''
+    chain = REPAIR_PROMPT | llm | StrOutputParser()
+
+    return chain.invoke(_repair_input(question, query, error, table_dict))
+
+async def repair_query_async(llm, question, query, error, table_dict):
+    ''' repair_query for the async pipeline
+    '''
+    chain = REPAIR_PROMPT | llm | StrOutputParser()
+
+    return await chain.ainvoke(_repair_input(question, query, error, table_dict))
+
+def _race(llm, question, table_dict, candidates):
+    return race_candidates(lambda i: generate_query(_candidate_llm(llm, i), question, table_dict), _validated_execution,
+                           candidates)
+
+async def _race_async(llm, question, table_dict, candidates):
+    return await race_candidates_async(lambda i: generate_query_async(_candidate_llm(llm, i), question, table_dict),
+                                       _validated_execution, candidates)
+
+def AOP_route(question, chat_history, top_k=8):
+    ''' The goal of this function is to take in a question about the AOP Database and use a LLM chain to determine which table(s) to use when answering
+        the user's question. A local lexical index preselects the top_k candidate tables first, so only those are sent to the LLM,
+        and the LLM call is skipped entirely when a single table clearly wins.
     
-    llm = BedrockChat(
-        credentials_profile_name="default", model_id="anthropic.claude-3-sonnet-20240229-v1:0", verbose=True)
-    #llm = BedrockChat(credentials_profile_name="default", model_id="mistral.mistral-7b-instruct-v0:2", verbose=True)
+    Args
+        question -
+        top_k - number of candidate tables shown to the LLM
+    Output
+        table_dict - text of {'table': [column1, column2, ...]}, as written by the LLM
+    '''
+    candidates, decisive = get_table_index().select(question, top_k=top_k)
+    if decisive:
+        # the same text as the LLM's answer and the question cache's entries
+        return str(candidates)
+
+    llm = get_chat_model(TABLE_MODEL)
 
-    chain = ChatPromptTemplate.from_template(prompt) | llm | StrOutputParser()
+    chain = TABLE_PROMPT | llm | StrOutputParser()
+
+    table_dict = chain.invoke({
+        # fall back to the full schema when no table shares a term with the question
+        'aop_dict': candidates if candidates else get_catalog().aop_info,
+        'question': question
+    })
+
+    return table_dict
+
+async def AOP_route_async(question, chat_history, top_k=8):
+    ''' AOP_route for the async pipeline, the table index lookup is in memory and stays on the event loop
+    '''
+    candidates, decisive = get_table_index().select(question, top_k=top_k)
+    if decisive:
+        return str(candidates)
+
+    chain = TABLE_PROMPT | get_chat_model(TABLE_MODEL) | StrOutputParser()
+
+    return await chain.ainvoke({
+        'aop_dict': candidates if candidates else get_catalog().aop_info,
+        'question': question
+    })
+
+def failed_response(question, chat_history, stream=True):
+    llm = get_chat_model(CHAT_MODEL)
+    #llm = get_chat_model(TABLE_MODEL)
+
+    chain = FAILED_PROMPT | llm | StrOutputParser()
 
     if stream:
         return chain.stream({"question": question, "chat_history": chat_history})
     else:
-        return chain.invoke({"question": question, "chat_history": chat_history})
\ No newline at end of file
+        return chain.invoke({"question": question, "chat_history": chat_history})
+
+async def failed_response_async(question, chat_history, stream=True):
+    chain = FAILED_PROMPT | get_chat_model(CHAT_MODEL) | StrOutputParser()
+
+    if stream:
+        return chain.astream({"question": question, "chat_history": chat_history})
+    else:
+        return await chain.ainvoke({"question": question, "chat_history": chat_history})
@@ -0,0 +1,285 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from importlib.util import find_spec
+from utils.catalog import DB_NAME, get_catalog
+from utils.columnar import get_parquet_tables, parquet_path, read_manifest
+from utils.connection import get_pool
+from utils.execution import (MAX_BYTES, MAX_ROWS, QUERY_LOG, TIME_BUDGET, QueryResult, QueryTimeout,
+                             fetch_rows, get_executor, large_scans, logged_query, query_log, table_aliases)
+from utils.result_cache import get_result_cache, result_size
+
+# backend of execute_query: 'auto' routes each query between SQLite and the columnar engine (SQLite
+# alone while there is no Parquet export or duckdb is not installed), 'sqlite' never routes
+BACKEND = os.environ.get('LLMAO_BACKEND', 'auto')
+
+# tables from this many rows on are scanned faster by the columnar engine than by SQLite
+COLUMNAR_MIN_ROWS = 100000
+
+# threads the columnar engine runs one query on
+COLUMNAR_THREADS = os.cpu_count() or 4
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_ANALYTIC = re.compile(r'\b(COUNT|SUM|AVG|MIN|MAX|GROUP\s+BY|DISTINCT|ORDER\s+BY)\b', re.IGNORECASE)
+# sqlite semantics the columnar engine does not share: case-insensitive LIKE, GLOB, full-text MATCH,
+# rowid, sqlite's date functions and total(), and integer division
+_ROW_ONLY = re.compile(r'\b(LIKE|GLOB|MATCH|REGEXP|rowid|strftime|julianday|date|datetime|total)\b|/', re.IGNORECASE)
+
+
+class ColumnarError(sqlite3.OperationalError):
+    '''
+    the columnar engine could not run the query, e.g. SQLite syntax it does not support
+    '''
+
+
+class ColumnarBackend():
+    '''
+    Runs queries with DuckDB over the Parquet export of the large tables (see utils/columnar.py):
+    only the columns a query needs are read, in vectorized batches on COLUMNAR_THREADS threads, which
+    is what counts, group-bys and top-N lists over millions of rows need. Each exported table is a
+    view of the same name, so SQL written for AOP-DB runs unchanged as long as it only reads
+    exported tables. Results are capped like the QueryExecutor's, kept in the shared result cache and
+    logged to the same query log, with the SQLite plan the router chose the engine on.
+
+    init params
+        parquet_dir - export directory, defaults to <DB_NAME>.parquet
+        manifest - {table: {'rows', 'columns', 'files'}} of the export, read from parquet_dir by default
+        catalog - SchemaCatalog the export was made from, defaults to the shared one
+        threads - DuckDB worker threads per query
+        max_rows, max_bytes - caps on the fetched result
+        time_budget - seconds before the query is interrupted, None for no budget
+        use_cache - serve repeated queries from the shared result cache
+        log_path - query log file, None to disable logging
+    '''
+    name = 'duckdb'
+
+    def __init__(self, parquet_dir: str = None, manifest: dict = None, catalog=None, threads: int = COLUMNAR_THREADS,
+                 max_rows: int = MAX_ROWS, max_bytes: int = MAX_BYTES, time_budget: float = TIME_BUDGET,
+                 use_cache: bool = True, log_path: str = None):
+        self.parquet_dir = parquet_dir if parquet_dir is not None else parquet_path(DB_NAME)
+        self._catalog = catalog
+        self.tables = manifest if manifest is not None else read_manifest(self.parquet_dir, self.catalog.version)
+        self.threads = threads
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.time_budget = time_budget
+        self.use_cache = use_cache
+        self.counts = {'queries': 0, 'errors': 0, 'timeouts': 0, 'truncated': 0}
+        self._log = query_log(log_path) if log_path is not None else None
+        self._database = None
+        self._lock = threading.Lock()
+
+    @property
+    def catalog(self):
+        return self._catalog if self._catalog is not None else get_catalog()
+
+    def _count(self, event: str):
+        with self._lock:
+            self.counts[event] += 1
+
+    def _connect(self):
+        import duckdb
+        with self._lock:
+            if self._database is None:
+                database = duckdb.connect(':memory:')
+                database.execute('SET threads TO ' + str(int(self.threads)) + ';')
+                # NULLs sort as the smallest value, like in sqlite
+                database.execute("SET default_null_order = 'nulls_first_on_asc_last_on_desc';")
+                for table in self.tables:
+                    files = os.path.join(self.parquet_dir, table, '*.parquet').replace("'", "''")
+                    database.execute('CREATE VIEW "' + table.replace('"', '""') + "\" AS SELECT * FROM read_parquet('" +
+                                     files + "');")
+                self._database = database
+        return self._database
+
+    @contextmanager
+    def cursor(self):
+        '''
+        a cursor on the shared in-memory database and its views, closed afterwards; cursors are cheap to
+        open, so none is kept per thread to pile up as Streamlit reruns come and go
+        '''
+        cursor = self._connect().cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def run(self, query: str, use_cache: bool = None, plan: list = None) -> QueryResult:
+        '''
+        execute a query on a DuckDB cursor of its own
+        args
+            plan - SQLite's plan of the query, logged for the index advisor
+        returns
+            QueryResult
+        raises
+            ColumnarError, QueryTimeout (both sqlite3.OperationalError)
+        '''
+        use_cache = self.use_cache if use_cache is None else use_cache
+        fingerprint = 'duckdb:%s:%d:%d' % (self.catalog.version, self.max_rows, self.max_bytes)
+        result_cache = get_result_cache()
+        if use_cache:
+            result = result_cache.get(query, fingerprint)
+            if result is not None:
+                return result
+
+        self._count('queries')
+        # a query DuckDB cannot run goes to SQLite, which logs it
+        with logged_query(self._log, query, self.catalog.version, ignore=(ColumnarError,), backend=self.name,
+                          plan=plan or []) as record:
+            result = self._execute(query)
+            record.update(result.report(), status='ok', executed=result.query, query=query)
+
+        if use_cache:
+            result_cache.put(query, fingerprint, result, size=result_size(result.rows))
+        return result
+
+    def _execute(self, query: str) -> QueryResult:
+        import duckdb
+        with self.cursor() as cursor:
+            start = time.perf_counter()
+            timer = None
+            if self.time_budget is not None:
+                timer = threading.Timer(self.time_budget, cursor.interrupt)
+                timer.start()
+            try:
+                cursor.execute(query.strip().rstrip(';'))
+                rows, truncated = fetch_rows(cursor, self.max_rows, self.max_bytes)
+                columns = [column[0] for column in cursor.description or []]
+            except duckdb.InterruptException as error:
+                self._count('timeouts')
+                raise QueryTimeout('query interrupted after %.1f s time budget' % self.time_budget) from error
+            except duckdb.Error as error:
+                self._count('errors')
+                raise ColumnarError(str(error)) from error
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+        if truncated:
+            self._count('truncated')
+        return QueryResult(query, rows, columns, truncated=truncated, elapsed=time.perf_counter() - start,
+                           plan=['DUCKDB'])
+
+
+class RoutingBackend():
+    '''
+    Sends every query to the engine expected to run it fastest. SQLite keeps point lookups and
+    whatever its indexes serve; the plan decides: a query goes to the columnar engine only when
+    SQLite would read a large table in full to count, aggregate, group, de-duplicate or sort it,
+    every table it reads has been exported, and it uses nothing that means something else in
+    DuckDB. A query the columnar engine cannot run goes to SQLite after all. The row backend's plan
+    guardrails apply to both engines: a plan it refuses, e.g. a cartesian join of large tables, is
+    handed to it to be rejected and logged rather than run on the columnar engine.
+
+    init params
+        row - backend for everything else, defaults to the shared QueryExecutor
+        columnar - ColumnarBackend, None to run everything on SQLite
+        pool - ConnectionPool the plans are taken on, defaults to the shared one
+        catalog - SchemaCatalog providing row counts, defaults to the shared one
+        min_rows - row count from which a full scan is worth the columnar engine
+    '''
+    name = 'auto'
+
+    def __init__(self, row=None, columnar: ColumnarBackend = None, pool=None, catalog=None,
+                 min_rows: int = COLUMNAR_MIN_ROWS):
+        self._row = row
+        self.columnar = columnar
+        self._pool = pool
+        self._catalog = catalog
+        self.min_rows = min_rows
+        self.counts = {'sqlite': 0, 'duckdb': 0, 'fallbacks': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def row(self):
+        return self._row if self._row is not None else get_executor()
+
+    @property
+    def pool(self):
+        return self._pool if self._pool is not None else get_pool()
+
+    @property
+    def catalog(self):
+        return self._catalog if self._catalog is not None else get_catalog()
+
+    def _count(self, event: str):
+        with self._lock:
+            self.counts[event] += 1
+
+    def choose(self, query: str) -> str:
+        '''
+        returns
+            'duckdb' or 'sqlite'
+        '''
+        return self._choose(query)[0]
+
+    def _choose(self, query: str) -> tuple:
+        '''
+        returns
+            ('duckdb' or 'sqlite', SQLite's plan of the query when it goes to the columnar engine)
+        '''
+        if self.columnar is None or not self.columnar.tables:
+            return 'sqlite', None
+        text = _STRING.sub("''", query)
+        if _ROW_ONLY.search(text) or not _ANALYTIC.search(text):
+            return 'sqlite', None
+        # subqueries and CTEs name tables that were never exported
+        tables = {table.lower() for table in table_aliases(query).values()}
+        exported = {table.lower() for table in self.columnar.tables}
+        if not tables or not tables <= exported:
+            return 'sqlite', None
+        try:
+            with self.pool.cursor() as cursor:
+                # a rewrite only adds a LIMIT, the columnar engine caps the rows the same way
+                _, plan, _ = self.row.check(cursor, query)
+        except sqlite3.Error:
+            # SQLite reports the error or the rejection the usual way
+            return 'sqlite', None
+        row_counts = {table.lower(): self.catalog.row_count(table) for table in self.catalog.tables}
+        if large_scans(plan, query, row_counts, self.min_rows):
+            return 'duckdb', plan
+        return 'sqlite', None
+
+    def run(self, query: str, use_cache: bool = None) -> QueryResult:
+        '''
+        execute a query on the chosen engine, see QueryExecutor.run
+        '''
+        engine, plan = self._choose(query)
+        if engine == 'duckdb':
+            try:
+                result = self.columnar.run(query, use_cache=use_cache, plan=plan)
+                self._count('duckdb')
+                return result
+            except ColumnarError:
+                self._count('fallbacks')
+        self._count('sqlite')
+        return self.row.run(query, use_cache=use_cache)
+
+
+_backend = None
+_backend_version = None
+_backend_lock = threading.Lock()
+
+def get_backend(db_name: str = DB_NAME):
+    '''
+    shared execution backend for the process, chosen by the LLMAO_BACKEND environment variable;
+    rebuilt when the catalog version changes, a new export is picked up along with it
+    '''
+    global _backend, _backend_version
+    if BACKEND == 'sqlite':
+        return get_executor()
+    if BACKEND != 'auto':
+        raise ValueError('Invalid execution backend given: ' + BACKEND + ' is not auto or sqlite')
+    version = get_catalog(db_name).version
+    if _backend is None or _backend_version != version:
+        with _backend_lock:
+            if _backend is None or _backend_version != version:
+                columnar = None
+                if find_spec('duckdb') is not None and get_parquet_tables(db_name):
+                    columnar = ColumnarBackend(parquet_path(db_name), get_parquet_tables(db_name), log_path=QUERY_LOG)
+                _backend = RoutingBackend(columnar=columnar)
+                _backend_version = version
+    return _backend
@@ -0,0 +1,199 @@
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from utils.scheduler import get_stage_executor
+
+# candidate queries generated per question, 1 turns candidate mode off; every candidate is a full
+# SQL generation call, so this multiplies the tokens spent on SQL generation
+SQL_CANDIDATES = int(os.environ.get('LLMAO_SQL_CANDIDATES', '1'))
+
+# sampling temperature of every candidate but the first, so the candidates actually differ
+CANDIDATE_TEMPERATURE = 0.7
+
+
+class CandidatesFailed(sqlite3.OperationalError):
+    '''
+    every candidate query failed to generate or execute
+
+    init params
+        failures - [(query or None, exception)] in candidate order
+    '''
+    def __init__(self, failures: list):
+        self.failures = failures
+        super().__init__('; '.join(str(error) for _, error in failures))
+
+    @property
+    def query(self) -> str:
+        '''
+        first candidate that was generated, the one handed to the repair prompt
+        '''
+        return next((query for query, _ in self.failures if query is not None), None)
+
+
+class CandidateStats():
+    '''
+    Which candidate wins how often, and the latency saved against the sequential path. That path
+    would have waited for the first candidate, and when it failed for one more generation and
+    execution round trip (the repair), estimated as the first candidate's own time again.
+    '''
+    def __init__(self):
+        self.races = 0
+        self.all_failed = 0
+        self.wins = {}
+        self.saved = []
+        self._lock = threading.Lock()
+
+    def observe(self, outcomes: list, winner: dict):
+        '''
+        args
+            outcomes - every candidate's outcome once all have finished, in candidate order
+            winner - the outcome that was used, None if all failed
+        '''
+        first = outcomes[0]
+        sequential = first['done'] if first['error'] is None else 2 * first['done']
+        with self._lock:
+            self.races += 1
+            if winner is None:
+                self.all_failed += 1
+                return
+            self.wins[winner['index']] = self.wins.get(winner['index'], 0) + 1
+            self.saved.append(sequential - winner['done'])
+
+    def report(self) -> dict:
+        with self._lock:
+            won = sum(self.wins.values())
+            return {
+                'races': self.races,
+                'all_failed': self.all_failed,
+                'win_rate': {index: count / won for index, count in sorted(self.wins.items())},
+                'mean_saved_s': sum(self.saved) / len(self.saved) if self.saved else 0.0,
+                'total_saved_s': sum(self.saved),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.races, self.all_failed, self.wins, self.saved = 0, 0, {}, []
+
+
+_candidate_stats = CandidateStats()
+
+def get_candidate_stats() -> CandidateStats:
+    return _candidate_stats
+
+
+def _outcome(index, start, query=None, generated=None, execution=None, error=None) -> dict:
+    return {'index': index, 'query': query, 'execution': execution, 'error': error,
+            'generated': generated, 'done': time.perf_counter() - start}
+
+
+def _pick(outcome: dict, fallback: dict) -> tuple:
+    '''
+    returns
+        (winner if outcome ran and returned rows, fallback: the first candidate that ran at all)
+    '''
+    if outcome['error'] is not None:
+        return None, fallback
+    if outcome['execution'].rows:
+        return outcome, fallback
+    return None, fallback if fallback is not None else outcome
+
+
+def race_candidates(generate, execute, n: int, stats: CandidateStats = None, executor=None) -> tuple:
+    '''
+    generate n candidate queries and execute them concurrently, each as soon as it is written; the
+    first one that runs and returns rows wins, the others finish in the background and only count
+    towards the stats. When no candidate returns rows, the first one that ran is used.
+    args
+        generate - function(i) -> query text of candidate i, e.g. an LLM call
+        execute - function(query) -> QueryResult, raising sqlite3.Error for a failed query
+        n - number of candidates
+        stats - CandidateStats to record the race in, the shared one by default
+        executor - concurrent.futures executor, the shared stage pool by default
+    returns
+        (QueryResult of the winner, index of the winner, query text of the winner), CandidatesFailed if
+        every candidate failed
+    '''
+    stats = stats if stats is not None else _candidate_stats
+    executor = executor if executor is not None else get_stage_executor()
+    start = time.perf_counter()
+
+    def attempt(i):
+        try:
+            query = generate(i)
+        except Exception as exc:
+            return _outcome(i, start, error=exc)
+        generated = time.perf_counter() - start
+        try:
+            return _outcome(i, start, query, generated, execution=execute(query))
+        except sqlite3.Error as exc:
+            return _outcome(i, start, query, generated, error=exc)
+
+    futures = [executor.submit(contextvars.copy_context().run, attempt, i) for i in range(n)]
+    winner, fallback, pending = None, None, set(futures)
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for outcome in sorted((future.result() for future in done), key=lambda outcome: outcome['done']):
+            winner, fallback = _pick(outcome, fallback)
+            if winner is not None:
+                break
+    winner = winner if winner is not None else fallback
+
+    # the stats need every candidate's time, record them once the losers are done too
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def finished(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            stats.observe([future.result() for future in futures], winner)
+
+    for future in futures:
+        future.add_done_callback(finished)
+    if winner is None:
+        # nothing is pending any more when no candidate ran
+        raise CandidatesFailed([(future.result()['query'], future.result()['error']) for future in futures])
+    return winner['execution'], winner['index'], winner['query']
+
+
+async def race_candidates_async(generate, execute, n: int, stats: CandidateStats = None) -> tuple:
+    '''
+    race_candidates on the event loop
+    args
+        generate - async function(i) -> query text of candidate i
+        execute - function(query) -> QueryResult, run on a worker thread
+    '''
+    stats = stats if stats is not None else _candidate_stats
+    start = time.perf_counter()
+
+    async def attempt(i):
+        try:
+            query = await generate(i)
+        except Exception as exc:
+            return _outcome(i, start, error=exc)
+        generated = time.perf_counter() - start
+        try:
+            return _outcome(i, start, query, generated, execution=await asyncio.to_thread(execute, query))
+        except sqlite3.Error as exc:
+            return _outcome(i, start, query, generated, error=exc)
+
+    tasks = [asyncio.ensure_future(attempt(i)) for i in range(n)]
+    winner, fallback, pending = None, None, set(tasks)
+    while pending and winner is None:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for outcome in sorted((task.result() for task in done), key=lambda outcome: outcome['done']):
+            winner, fallback = _pick(outcome, fallback)
+            if winner is not None:
+                break
+    winner = winner if winner is not None else fallback
+
+    all_done = asyncio.gather(*tasks)
+    all_done.add_done_callback(lambda gathered: gathered.cancelled() or stats.observe(gathered.result(), winner))
+    if winner is None:
+        raise CandidatesFailed([(task.result()['query'], task.result()['error']) for task in tasks])
+    return winner['execution'], winner['index'], winner['query']
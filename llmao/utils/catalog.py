@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from utils.timing import stage
+
+# default location of the AOP database, relative to the llmao/ directory; LLMAO_DB points
+# every component at another copy, e.g. a synthetic database for offline benchmarks
+DB_NAME = os.environ.get('LLMAO_DB', './aopdb_08-25-2020.db')
+
+# bump when the layout of the snapshot changes so old sidecar files are rebuilt
+CATALOG_FORMAT = 1
+
+# size of each block sampled from the db file when fingerprinting it
+_SAMPLE_BYTES = 1 << 20
+
+
+def db_fingerprint(db_name: str) -> dict:
+    '''
+    fingerprint the database file by its size, mtime and a sampled content hash
+    args
+        db_name - path to the sqlite database file
+    returns
+        {'size': int, 'mtime': float, 'hash': str}
+    '''
+    stat = os.stat(db_name)
+    digest = hashlib.sha256(str(stat.st_size).encode())
+    # hashing all 16GB of AOP-DB on every start would defeat the purpose, so hash the
+    # header plus a block from the middle and the end of the file instead
+    offsets = sorted({0, max(0, stat.st_size // 2 - _SAMPLE_BYTES // 2), max(0, stat.st_size - _SAMPLE_BYTES)})
+    with open(db_name, 'rb') as db_file:
+        for offset in offsets:
+            db_file.seek(offset)
+            digest.update(db_file.read(_SAMPLE_BYTES))
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': digest.hexdigest()}
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def build_snapshot(db_name: str, count_rows: bool = True) -> dict:
+    '''
+    scan sqlite_master + pragmas and return the schema snapshot as a json-serializable dict
+    args
+        db_name - path to the sqlite database file
+        count_rows - run SELECT COUNT(*) for each table, slow on a cold 16GB database
+    returns
+        {'tables': {table: {'type', 'columns': [{'name', 'type', 'pk'}], 'foreign_keys': [...], 'row_count'}}}
+    '''
+    connection = sqlite3.connect('file:' + db_name + '?mode=ro', uri=True)
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT name, type FROM sqlite_master
+            WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'
+            ORDER BY name;
+            """)
+        objects = cursor.fetchall()
+
+        tables = {}
+        for name, kind in objects:
+            cursor.execute('SELECT name, type, pk FROM pragma_table_info(?) ORDER BY name;', (name,))
+            columns = [{'name': column, 'type': col_type, 'pk': bool(pk)} for column, col_type, pk in cursor.fetchall()]
+
+            cursor.execute('SELECT "from", "table", "to" FROM pragma_foreign_key_list(?);', (name,))
+            foreign_keys = [{'column': column, 'ref_table': ref_table, 'ref_column': ref_column}
+                            for column, ref_table, ref_column in cursor.fetchall()]
+
+            row_count = None
+            if count_rows and kind == 'table':
+                cursor.execute('SELECT COUNT(*) FROM ' + _quote(name) + ';')
+                row_count = cursor.fetchone()[0]
+
+            tables[name] = {
+                'type': kind,
+                'columns': columns,
+                'foreign_keys': foreign_keys,
+                'row_count': row_count,
+            }
+    finally:
+        cursor.close()
+        connection.close()
+
+    return {'tables': tables}
+
+
+class SchemaCatalog():
+    '''
+    Versioned snapshot of the AOP database schema (tables, columns, types, foreign keys and row counts).
+    The snapshot is loaded lazily on first access and persisted to a json sidecar file next to the
+    database, keyed by the database fingerprint, so warm starts skip the sqlite_master scan entirely.
+
+    init params
+        db_name - path to the sqlite database file
+        sidecar - path to the json snapshot, defaults to <db_name>.catalog.json
+        count_rows - whether to record row counts when (re)building the snapshot
+    '''
+    def __init__(self, db_name: str = DB_NAME, sidecar: str = None, count_rows: bool = True):
+        self.db_name = db_name
+        self.sidecar = sidecar if sidecar is not None else db_name + '.catalog.json'
+        self.count_rows = count_rows
+        self._snapshot = None
+        self._aop_info = None
+        self._summary_tables = None
+        self._lock = threading.Lock()
+
+    def _read_sidecar(self):
+        try:
+            with open(self.sidecar) as sidecar_file:
+                return json.load(sidecar_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_sidecar(self, snapshot):
+        # write to a temporary file first so concurrent readers never see a partial snapshot
+        tmp_name = self.sidecar + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp_name, 'w') as sidecar_file:
+                json.dump(snapshot, sidecar_file)
+            os.replace(tmp_name, self.sidecar)
+        except OSError:
+            # a read-only deployment can still use the in-memory snapshot
+            pass
+
+    def _is_current(self, snapshot) -> bool:
+        if snapshot is None or snapshot.get('format') != CATALOG_FORMAT:
+            return False
+        stored = snapshot.get('fingerprint', {})
+        stat = os.stat(self.db_name)
+        # cheap check first, only rehash the sampled blocks when size or mtime moved
+        if stored.get('size') == stat.st_size and stored.get('mtime') == stat.st_mtime:
+            return True
+        return stored.get('hash') == db_fingerprint(self.db_name)['hash']
+
+    def load(self, force: bool = False) -> dict:
+        '''
+        return the snapshot, reusing the in-memory copy or the sidecar file when the database is unchanged
+        args
+            force - rebuild from the database even if a current snapshot exists
+        '''
+        if self._snapshot is not None and not force:
+            return self._snapshot
+
+        with self._lock, stage('schema_load'):
+            if self._snapshot is not None and not force:
+                return self._snapshot
+
+            snapshot = None if force else self._read_sidecar()
+            if not self._is_current(snapshot):
+                fingerprint = db_fingerprint(self.db_name)
+                snapshot = build_snapshot(self.db_name, count_rows=self.count_rows)
+                snapshot['format'] = CATALOG_FORMAT
+                snapshot['fingerprint'] = fingerprint
+                self._write_sidecar(snapshot)
+
+            self._aop_info = None
+            self._snapshot = snapshot
+        return snapshot
+
+    def refresh(self) -> bool:
+        '''
+        reload the snapshot if the database file changed since it was taken
+        returns
+            True if the catalog was rebuilt
+        '''
+        if self._snapshot is not None and self._is_current(self._snapshot):
+            return False
+        self._snapshot = None
+        self.load()
+        return True
+
+    @property
+    def version(self) -> str:
+        '''
+        short identifier of the database contents, changes whenever the snapshot is rebuilt
+        '''
+        return self.load()['fingerprint']['hash'][:16]
+
+    @property
+    def tables(self) -> dict:
+        return self.load()['tables']
+
+    @property
+    def aop_info(self) -> dict:
+        '''
+        schema dictionary {'table': [column1, column2, ...]} used in the LLM prompts
+        '''
+        if self._aop_info is None:
+            self._aop_info = {table: [column['name'] for column in info['columns']]
+                              for table, info in self.tables.items()}
+        return self._aop_info
+
+    @property
+    def summary_tables(self) -> dict:
+        '''
+        {'summary table': [column1, column2, ...]} of the materialized summary sidecar built from this
+        version of the database (see utils/summaries.py), empty when there is none
+        '''
+        # utils.summaries builds on the catalog
+        from utils.summaries import read_manifest, summaries_path
+        version = self.version
+        if self._summary_tables is None or self._summary_tables[0] != version:
+            manifest = read_manifest(summaries_path(self.db_name), version)
+            self._summary_tables = (version, {name: entry['columns'] for name, entry in manifest.items()})
+        return self._summary_tables[1]
+
+    def columns(self, table: str) -> list:
+        return [column['name'] for column in self.tables[table]['columns']]
+
+    def column_types(self, table: str) -> dict:
+        return {column['name']: column['type'] for column in self.tables[table]['columns']}
+
+    def foreign_keys(self, table: str) -> list:
+        return self.tables[table]['foreign_keys']
+
+    def row_count(self, table: str):
+        return self.tables[table]['row_count']
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog(db_name: str = DB_NAME) -> SchemaCatalog:
+    '''
+    shared SchemaCatalog for the process, every component reads the same in-memory object
+    '''
+    global _catalog
+    if _catalog is None or _catalog.db_name != db_name:
+        with _catalog_lock:
+            if _catalog is None or _catalog.db_name != db_name:
+                _catalog = SchemaCatalog(db_name)
+    return _catalog
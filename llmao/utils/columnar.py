@@ -0,0 +1,198 @@
+'''
+Parquet export of the large AOP-DB tables for the columnar engine
+
+Counts, group-bys and top-N lists over the interaction tables make SQLite read every row of a
+multi-gigabyte table, one row at a time on one thread. The export writes those tables once to
+Parquet, in a directory next to AOP-DB (which stays read-only), so that DuckDB can scan only the
+columns a query needs, vectorized and on every core (see ColumnarBackend in utils/backends.py):
+
+    <db>.parquet/<table>/part-00000.parquet, part-00001.parquet, ...
+    <db>.parquet/manifest.json          catalog version, and rows and columns of every exported table
+
+usage (from the llmao/ directory, needs duckdb)
+    python -m utils.columnar                                    # tables of at least EXPORT_MIN_ROWS rows
+    python -m utils.columnar --db ./aopdb_08-25-2020.db --tables chemical_gene gene_pathway
+'''
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from utils.catalog import DB_NAME, SchemaCatalog, get_catalog
+
+# tables with at least this many rows are exported by default, smaller ones are fast enough in SQLite
+EXPORT_MIN_ROWS = 100000
+
+# rows per parquet part file, bounds the memory the export needs
+_EXPORT_BATCH = 500000
+
+
+def parquet_path(db_name: str = DB_NAME) -> str:
+    return db_name + '.parquet'
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def duckdb_type(declared: str) -> str:
+    '''
+    DuckDB type of a column from its declared SQLite type, following SQLite's affinity rules
+    '''
+    declared = (declared or '').upper()
+    if 'INT' in declared:
+        return 'BIGINT'
+    if 'BLOB' in declared:
+        return 'BLOB'
+    if any(affinity in declared for affinity in ('CHAR', 'CLOB', 'TEXT')) or not declared:
+        return 'VARCHAR'
+    # REAL and NUMERIC affinity
+    return 'DOUBLE'
+
+
+def _to_int(value):
+    if isinstance(value, float):
+        value = int(value) if value.is_integer() else None
+    elif isinstance(value, (str, bytes)):
+        try:
+            value = int(value)
+        except ValueError:
+            return None
+    return value if value is not None and -(1 << 63) <= value < (1 << 63) else None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _to_text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return str(value)
+
+
+def _to_blob(value):
+    if isinstance(value, bytes):
+        return value
+    return _to_text(value).encode('utf-8')
+
+
+# sqlite values are not bound to their declared type: each one is converted to its column's DuckDB type
+# in python, keeping integers, floats and bytes as they are, and whatever does not fit becomes NULL
+_CONVERTERS = {'BIGINT': _to_int, 'DOUBLE': _to_float, 'VARCHAR': _to_text, 'BLOB': _to_blob}
+
+
+def export_parquet(db_name: str = DB_NAME, out_dir: str = None, tables: list = None, catalog: SchemaCatalog = None,
+                   min_rows: int = EXPORT_MIN_ROWS, batch: int = _EXPORT_BATCH) -> dict:
+    '''
+    export tables of AOP-DB to Parquet, written to a temporary directory and moved into place once complete
+    args
+        db_name - path to AOP-DB
+        out_dir - export directory, defaults to <db_name>.parquet
+        tables - tables to export, defaults to those with at least min_rows rows
+        catalog - SchemaCatalog of db_name, defaults to the shared one
+        batch - rows per part file
+    returns
+        manifest {table: {'rows', 'columns', 'files', 'seconds'}}
+    '''
+    import duckdb
+    import pandas as pd
+    out_dir = out_dir if out_dir is not None else parquet_path(db_name)
+    catalog = catalog if catalog is not None else get_catalog(db_name)
+    if tables is None:
+        tables = sorted(table for table, info in catalog.tables.items()
+                        if info['type'] == 'table' and (info['row_count'] or 0) >= min_rows)
+
+    tmp_dir = out_dir + '.' + str(os.getpid()) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    source = sqlite3.connect('file:' + db_name + '?mode=ro', uri=True)
+    writer = duckdb.connect()
+    manifest = {}
+    try:
+        for table in tables:
+            start = time.perf_counter()
+            columns = catalog.columns(table)
+            types = catalog.column_types(table)
+            os.makedirs(os.path.join(tmp_dir, table))
+            column_types = [duckdb_type(types[column]) for column in columns]
+            converters = [_CONVERTERS[column_type] for column_type in column_types]
+            select = ', '.join('CAST(%s AS %s) AS %s' % (_quote(column), column_type, _quote(column))
+                               for column, column_type in zip(columns, column_types))
+            cursor = source.execute('SELECT ' + ', '.join(_quote(column) for column in columns) + ' FROM ' + _quote(table) + ';')
+            rows, files = 0, 0
+            while True:
+                fetched = cursor.fetchmany(batch)
+                # an empty table still gets one (empty) part file, which carries its schema
+                if not fetched and files:
+                    break
+                frame = pd.DataFrame([[None if value is None else convert(value) for convert, value in zip(converters, row)]
+                                      for row in fetched], columns=columns, dtype=object)
+                writer.register('batch', frame)
+                part = os.path.join(tmp_dir, table, 'part-%05d.parquet' % files)
+                writer.execute('COPY (SELECT ' + select + " FROM batch) TO '" + part.replace("'", "''") +
+                               "' (FORMAT PARQUET, COMPRESSION ZSTD);")
+                writer.unregister('batch')
+                rows += len(fetched)
+                files += 1
+                if len(fetched) < batch:
+                    break
+            manifest[table] = {'rows': rows, 'columns': columns, 'files': files, 'seconds': time.perf_counter() - start}
+
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as manifest_file:
+            json.dump({'catalog_version': catalog.version,
+                       'tables': {table: {key: entry[key] for key in ('rows', 'columns', 'files')}
+                                  for table, entry in manifest.items()}}, manifest_file)
+    finally:
+        writer.close()
+        source.close()
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return manifest
+
+
+def read_manifest(out_dir: str, catalog_version: str = None) -> dict:
+    '''
+    the exported tables, {table: {'rows', 'columns', 'files'}}; empty when there is no export or it was
+    made from another version of the database
+    '''
+    try:
+        with open(os.path.join(out_dir, 'manifest.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+    if catalog_version is not None and manifest.get('catalog_version') != catalog_version:
+        return {}
+    return manifest.get('tables', {})
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def get_parquet_tables(db_name: str = DB_NAME) -> dict:
+    '''
+    manifest of the current Parquet export of db_name, read once per catalog version
+    '''
+    version = get_catalog(db_name).version
+    key = (db_name, version)
+    if key not in _manifests:
+        with _manifests_lock:
+            if key not in _manifests:
+                _manifests[key] = read_manifest(parquet_path(db_name), version)
+    return _manifests[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_NAME, help='path to the AOP database')
+    parser.add_argument('--out', help='export directory, defaults to <db>.parquet')
+    parser.add_argument('--tables', nargs='*', help='tables to export, defaults to those of at least %d rows' % EXPORT_MIN_ROWS)
+    args = parser.parse_args()
+
+    for table, entry in export_parquet(args.db, args.out, args.tables, SchemaCatalog(args.db)).items():
+        print('%s: %d rows in %d files, %.1f s' % (table, entry['rows'], entry['files'], entry['seconds']))
@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class BoundedWorkerPool():
+    '''
+    Fixed set of daemon worker threads fed by a bounded queue. submit() never blocks the caller:
+    when the queue is full the job is dropped and counted instead (backpressure by load shedding).
+
+    init params
+        workers - number of worker threads
+        maxsize - maximum number of queued jobs
+        name - prefix for the worker thread names
+    '''
+    def __init__(self, workers: int = 2, maxsize: int = 100, name: str = 'llmao-worker'):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.name = name
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=self.name + '-' + str(i), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            try:
+                fn(*args, **kwargs)
+                with self._lock:
+                    self.completed += 1
+            except Exception:
+                # a failing job must never take the worker down with it
+                with self._lock:
+                    self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn, *args, **kwargs) -> bool:
+        '''
+        queue fn(*args, **kwargs) for a worker
+        returns
+            False if the queue was full and the job was dropped
+        '''
+        self._start()
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def join(self, timeout: float = None) -> bool:
+        '''
+        block until every queued job has been processed, or at most timeout seconds
+        returns
+            False if jobs were still outstanding when the timeout ran out
+        '''
+        if timeout is None:
+            self._queue.join()
+            return True
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'queued': self._queue.qsize(),
+            }
+
+
+class RateLimiter():
+    '''
+    Spaces out calls shared between threads so that no more than `rate` start per second
+
+    init params
+        rate - maximum calls per second, None or 0 for no limit
+    '''
+    def __init__(self, rate: float = None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        '''
+        block until the caller may start its next call
+        '''
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ProgressReport():
+    '''
+    Progress and throughput of a fan-out started with ordered_map
+    '''
+    def __init__(self, total: int):
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    @property
+    def throughput(self) -> float:
+        '''
+        completed calls per second
+        '''
+        return self.completed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'completed': self.completed,
+            'failed': self.failed,
+            'total': self.total,
+            'elapsed_s': round(self.elapsed, 3),
+            'throughput_per_s': round(self.throughput, 3),
+        }
+
+    def __str__(self):
+        return '%d/%d done (%d failed) in %.1fs, %.2f/s' % (self.completed, self.total, self.failed,
+                                                           self.elapsed, self.throughput)
+
+
+def ordered_map(fn, items, max_concurrency: int = 4, requests_per_second: float = None,
+                progress=None, report: ProgressReport = None) -> list:
+    '''
+    call fn on every item concurrently and return the results in input order
+    args
+        fn - function of one item
+        items - iterable of inputs
+        max_concurrency - maximum number of calls in flight
+        requests_per_second - cap on the rate calls are started at, None for no cap
+        progress - optional function called with the ProgressReport after each completed call
+        report - ProgressReport to fill in, one is created if not given
+    returns
+        list of fn(item) in the same order as items, the first exception raised by fn is re-raised
+    '''
+    items = list(items)
+    if report is None:
+        report = ProgressReport(len(items))
+    limiter = RateLimiter(requests_per_second)
+    results = [None] * len(items)
+
+    def call(item):
+        limiter.wait()
+        return fn(item)
+
+    error = None
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = {executor.submit(call, item): i for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            try:
+                results[futures[future]] = future.result()
+                report.completed += 1
+            except Exception as exc:
+                report.failed += 1
+                if error is None:
+                    error = exc
+                    # nothing queued behind the failure needs to run any more
+                    for pending in futures:
+                        pending.cancel()
+            if progress is not None:
+                progress(report)
+    report.finished = time.monotonic()
+    if error is not None:
+        raise error
+    return results
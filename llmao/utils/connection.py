@@ -0,0 +1,168 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from utils.catalog import DB_NAME
+from utils.fulltext import SCHEMA as FULLTEXT_SCHEMA, fulltext_path, get_fulltext_tables
+from utils.summaries import SCHEMA as SUMMARY_SCHEMA, get_summary_tables, summaries_path
+
+# pragmas applied to every pooled connection; AOP-DB is a read-only snapshot so the
+# connections only ever read, map as much of the file as possible and keep a large page cache
+DEFAULT_PRAGMAS = {
+    'query_only': 'ON',
+    'mmap_size': 1 << 30,       # 1 GiB of the db file memory mapped per connection
+    'cache_size': -64 * 1024,   # negative values are KiB, i.e. a 64 MiB page cache
+    'temp_store': 'MEMORY',
+}
+
+# connections open at once per pool, each maps up to mmap_size of the file and keeps its own page cache
+POOL_SIZE = 8
+
+
+def readonly_uri(db_name: str, immutable: bool = True) -> str:
+    '''
+    sqlite URI that opens db_name read-only; immutable=1 also skips file locking and change detection
+    '''
+    uri = 'file:' + db_name + '?mode=ro'
+    if immutable:
+        uri += '&immutable=1'
+    return uri
+
+
+class ConnectionPool():
+    '''
+    Keeps up to size long-lived read-only connections to the AOP database, so the page cache, mmap
+    and prepared statement cache survive between questions. Connections are checked out for the
+    duration of a query and handed back afterwards, so any thread can use any of them and the number
+    open stays bounded however many threads (e.g. Streamlit reruns) come and go; a thread that needs
+    one while all are checked out waits for the next to be returned.
+
+    init params
+        db_name - path to the sqlite database file
+        immutable - open with immutable=1, only safe while nothing writes to the file
+        pragmas - overrides for DEFAULT_PRAGMAS
+        cached_statements - size of the per-connection prepared statement cache
+        attach - {'schema': path} of sidecar databases attached read-only to every connection
+        size - most connections open at once
+    '''
+    def __init__(self, db_name: str = DB_NAME, immutable: bool = True, pragmas: dict = None,
+                 cached_statements: int = 256, attach: dict = None, size: int = POOL_SIZE):
+        if size < 1:
+            raise ValueError('pool size must be at least 1')
+        self.db_name = db_name
+        self.immutable = immutable
+        self.attach = dict(attach or {})
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self.cached_statements = cached_statements
+        self.size = size
+        self._idle = []
+        self._opened = 0
+        self._generation = 0
+        self._local = threading.local()
+        self._available = threading.Condition()
+
+    def _connect(self) -> sqlite3.Connection:
+        # checked out by one thread at a time, but not always the thread that opened it
+        connection = sqlite3.connect(readonly_uri(self.db_name, self.immutable), uri=True,
+                                     cached_statements=self.cached_statements, check_same_thread=False)
+        for schema, path in self.attach.items():
+            connection.execute('ATTACH DATABASE ? AS ' + schema + ';', (readonly_uri(path, self.immutable),))
+        for pragma, value in self.pragmas.items():
+            connection.execute('PRAGMA ' + pragma + ' = ' + str(value) + ';')
+        return connection
+
+    def _checkout(self) -> tuple:
+        with self._available:
+            while True:
+                # the most recently returned connection first, its pages are the warmest
+                if self._idle:
+                    return self._idle.pop()
+                if self._opened < self.size:
+                    self._opened += 1
+                    generation = self._generation
+                    break
+                self._available.wait()
+        try:
+            return self._connect(), generation
+        except BaseException:
+            with self._available:
+                if generation == self._generation:
+                    self._opened -= 1
+                    self._available.notify()
+            raise
+
+    def _checkin(self, connection: sqlite3.Connection, generation: int):
+        with self._available:
+            if generation == self._generation:
+                self._idle.append((connection, generation))
+                self._available.notify()
+                return
+        # the pool was closed while the connection was checked out
+        connection.close()
+
+    @contextmanager
+    def connection(self):
+        '''
+        check out a connection for the calling thread; nested checkouts on the same thread share it
+        '''
+        held = getattr(self._local, 'held', None)
+        if held is not None:
+            yield held[0]
+            return
+        connection, generation = self._checkout()
+        self._local.held = (connection, generation)
+        try:
+            yield connection
+        finally:
+            self._local.held = None
+            self._checkin(connection, generation)
+
+    @contextmanager
+    def cursor(self):
+        '''
+        check out a cursor, the cursor is closed and its connection returned to the pool afterwards
+        '''
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def close_all(self):
+        '''
+        close every idle connection, connections checked out right now are closed when they are returned
+        '''
+        with self._available:
+            self._generation += 1
+            self._opened = 0
+            idle, self._idle = self._idle, []
+            self._available.notify_all()
+        for connection, _ in idle:
+            connection.close()
+
+    def __len__(self):
+        return self._opened
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool(db_name: str = DB_NAME) -> ConnectionPool:
+    '''
+    shared ConnectionPool for the process, every component running SQL against AOP-DB checks out of it
+    '''
+    global _pool
+    if _pool is None or _pool.db_name != db_name:
+        with _pool_lock:
+            if _pool is None or _pool.db_name != db_name:
+                # the full-text and summary sidecars are only attached while they match the database version
+                attach = {}
+                if os.path.exists(fulltext_path(db_name)) and get_fulltext_tables(db_name):
+                    attach[FULLTEXT_SCHEMA] = fulltext_path(db_name)
+                if os.path.exists(summaries_path(db_name)) and get_summary_tables(db_name):
+                    attach[SUMMARY_SCHEMA] = summaries_path(db_name)
+                _pool = ConnectionPool(db_name, attach=attach)
+    return _pool
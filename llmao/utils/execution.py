@@ -0,0 +1,397 @@
+import json
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from utils.catalog import get_catalog
+from utils.connection import get_pool
+from utils.result_cache import canonicalize_sql, get_result_cache, result_size
+from utils.sinks import BufferedWriter
+
+# every statement run by the shared executor is appended here with its timing and plan, see utils/index_advisor.py
+QUERY_LOG = './data/query_log.jsonl'
+
+# tables with at least this many rows are never scanned in full without a LIMIT
+LARGE_TABLE_ROWS = 1000000
+
+# caps on what one query may pull into memory (and from there into a prompt)
+MAX_ROWS = 1000
+MAX_BYTES = 4 * 1024 * 1024
+
+# wall clock seconds a query may run, including fetching
+TIME_BUDGET = 10.0
+
+# virtual machine instructions between two checks of the time budget
+_PROGRESS_STEPS = 10000
+_FETCH_SIZE = 256
+
+_SCAN = re.compile(r'^SCAN (\w+)')
+_TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+("?)(\w+)\1(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|INNER|LEFT|RIGHT|CROSS|'
+                              r'NATURAL|ON|USING|GROUP|ORDER|LIMIT|UNION|EXCEPT|INTERSECT|HAVING|WINDOW)\b)(\w+))?',
+                              re.IGNORECASE)
+_LIMIT = re.compile(r'\bLIMIT\s+\d+(\s*(,|OFFSET)\s*\d+)?$')
+
+
+class QueryRejected(sqlite3.OperationalError):
+    '''
+    the query plan was refused by the guardrails, e.g. a cartesian join of large tables
+    '''
+
+
+class QueryTimeout(sqlite3.OperationalError):
+    '''
+    the query ran past its time budget and was interrupted
+    '''
+
+
+class QueryResult():
+    '''
+    Rows of one guarded query together with how they were obtained.
+
+    init params
+        query - SQL that actually ran, which differs from the generated SQL when a LIMIT was added
+        rows - fetched rows
+        columns - column names of the result
+        truncated - True when the row or byte cap stopped fetching early
+        elapsed - seconds spent planning, executing and fetching
+        plan - EXPLAIN QUERY PLAN details
+        rewritten - True when the guardrails added a LIMIT
+    '''
+    def __init__(self, query: str, rows: list, columns: list, truncated: bool = False, elapsed: float = 0.0,
+                 plan: list = None, rewritten: bool = False):
+        self.query = query
+        self.rows = rows
+        self.columns = columns
+        self.truncated = truncated
+        self.elapsed = elapsed
+        self.plan = plan or []
+        self.rewritten = rewritten
+
+    @property
+    def row_count(self) -> int:
+        return len(self.rows)
+
+    def report(self) -> dict:
+        '''
+        summary logged with every query
+        '''
+        return {'query': self.query, 'rows': self.row_count, 'truncated': self.truncated,
+                'elapsed': round(self.elapsed, 6), 'rewritten': self.rewritten}
+
+
+def query_plan_rows(cursor, query: str) -> list:
+    '''
+    returns
+        (id, parent, detail) rows of EXPLAIN QUERY PLAN, the tree select_cores groups by
+    '''
+    cursor.execute('EXPLAIN QUERY PLAN ' + query)
+    return [(row[0], row[1], row[3]) for row in cursor.fetchall()]
+
+
+def query_plan(cursor, query: str) -> list:
+    '''
+    returns
+        the detail column of EXPLAIN QUERY PLAN, e.g. ['SCAN c', 'SEARCH g USING INTEGER PRIMARY KEY (rowid=?)']
+    '''
+    return [detail for _, _, detail in query_plan_rows(cursor, query)]
+
+
+def select_cores(plan_rows: list) -> list:
+    '''
+    plan details grouped by the SELECT core they run in: the tables of one core are joined in nested
+    loops, the cores of a compound SELECT (UNION, EXCEPT, ...) and uncorrelated subqueries run one after
+    the other; a correlated subquery runs once per row of its enclosing core and is counted with it
+    args
+        plan_rows - output of query_plan_rows
+    returns
+        [[detail, ...], ...]
+    '''
+    parents = {node: parent for node, parent, _ in plan_rows}
+    details = {node: detail for node, _, detail in plan_rows}
+    cores = {}
+    for _, parent, detail in plan_rows:
+        while details.get(parent, '').startswith('CORRELATED'):
+            parent = parents[parent]
+        cores.setdefault(parent, []).append(detail)
+    return list(cores.values())
+
+
+def table_aliases(query: str) -> dict:
+    '''
+    {name used in the query plan: table}, the plan names tables by their alias when one is given
+    '''
+    aliases = {}
+    for _, table, alias in _TABLE_REFERENCE.findall(query):
+        aliases[table.lower()] = table
+        if alias:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+def large_scans(plan: list, query: str, row_counts: dict, large_table_rows: int = LARGE_TABLE_ROWS) -> list:
+    '''
+    tables of at least large_table_rows rows that the plan reads in full
+    args
+        plan - output of query_plan
+        row_counts - {table (lower case): number of rows}
+    returns
+        [(table, rows), ...] in plan order
+    '''
+    aliases = table_aliases(query)
+    scans = []
+    for detail in plan:
+        match = _SCAN.match(detail)
+        if match is None:
+            continue
+        table = aliases.get(match.group(1).lower(), match.group(1))
+        rows = row_counts.get(table.lower())
+        if rows is not None and rows >= large_table_rows:
+            scans.append((table, rows))
+    return scans
+
+
+def has_limit(query: str) -> bool:
+    return _LIMIT.search(canonicalize_sql(query)) is not None
+
+
+def fetch_rows(cursor, max_rows: int = MAX_ROWS, max_bytes: int = MAX_BYTES) -> tuple:
+    '''
+    fetch an executed statement's rows in batches until the row or byte cap is reached
+    returns
+        (rows, truncated)
+    '''
+    rows, size = [], 0
+    while len(rows) < max_rows:
+        batch = cursor.fetchmany(min(_FETCH_SIZE, max_rows - len(rows)))
+        if not batch:
+            return rows, False
+        for row in batch:
+            size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+            if size > max_bytes:
+                return rows, True
+            rows.append(row)
+    # the cap was reached exactly, only truncated if the query had more rows to give
+    return rows, cursor.fetchone() is not None
+
+
+_query_logs = {}
+_query_logs_lock = threading.Lock()
+
+def query_log(log_path: str) -> BufferedWriter:
+    '''
+    the writer of a query log, shared by every backend logging to the same file so their batches never interleave
+    '''
+    with _query_logs_lock:
+        if log_path not in _query_logs:
+            _query_logs[log_path] = BufferedWriter(log_path, flush_every=20)
+        return _query_logs[log_path]
+
+
+@contextmanager
+def logged_query(log, query: str, catalog_version: str, ignore: tuple = (), **fields):
+    '''
+    log one execution of a query: the record is yielded for the caller to fill in and written once the
+    block exits, with the status and error of the exception leaving it
+    args
+        log - writer of the query log, None to disable logging
+        ignore - exceptions that are not logged, the query is run again elsewhere and logged there
+        fields - added to the record, e.g. the backend that ran the query
+    '''
+    start = time.perf_counter()
+    record = dict({'time': time.time(), 'query': query, 'catalog_version': catalog_version, 'status': 'error'}, **fields)
+    try:
+        yield record
+    except ignore:
+        log = None
+        raise
+    except QueryRejected as error:
+        record['status'], record['error'] = 'rejected', str(error)
+        raise
+    except QueryTimeout as error:
+        record['status'], record['error'] = 'timeout', str(error)
+        raise
+    except sqlite3.Error as error:
+        record['error'] = str(error)
+        raise
+    finally:
+        record['elapsed'] = round(time.perf_counter() - start, 6)
+        if log is not None:
+            log.write(json.dumps(record))
+
+
+class QueryExecutor():
+    '''
+    Runs generated SQL against AOP-DB within guardrails. The query plan is inspected first: a full scan
+    of a large table without a LIMIT is rewritten with one (or rejected), and scanning two large tables
+    in the same SELECT core, a cartesian join, is always rejected. The query then runs under a progress handler
+    enforcing the time budget and rows are fetched in batches until the row or byte cap is reached.
+
+    init params
+        pool - ConnectionPool to run on, defaults to the shared one
+        catalog - SchemaCatalog providing row counts, defaults to the shared one
+        max_rows, max_bytes - caps on the fetched result
+        time_budget - seconds before the query is interrupted, None for no budget
+        large_table_rows - row count from which a table counts as large
+        on_full_scan - 'limit' to add a LIMIT to full scans of large tables, 'reject' to refuse them
+        use_cache - serve repeated queries from the shared result cache
+        log_path - query log file, None to disable logging
+    '''
+    name = 'sqlite'
+
+    def __init__(self, pool=None, catalog=None, max_rows: int = MAX_ROWS, max_bytes: int = MAX_BYTES,
+                 time_budget: float = TIME_BUDGET, large_table_rows: int = LARGE_TABLE_ROWS,
+                 on_full_scan: str = 'limit', use_cache: bool = True, log_path: str = None):
+        if on_full_scan not in ('limit', 'reject'):
+            raise ValueError("on_full_scan must be 'limit' or 'reject'")
+        self._pool = pool
+        self._catalog = catalog
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.time_budget = time_budget
+        self.large_table_rows = large_table_rows
+        self.on_full_scan = on_full_scan
+        self.use_cache = use_cache
+        self.counts = {'queries': 0, 'rewritten': 0, 'rejected': 0, 'timeouts': 0, 'truncated': 0}
+        self._log = query_log(log_path) if log_path is not None else None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        return self._pool if self._pool is not None else get_pool()
+
+    @property
+    def catalog(self):
+        return self._catalog if self._catalog is not None else get_catalog()
+
+    def _count(self, event: str):
+        with self._lock:
+            self.counts[event] += 1
+
+    def _row_counts(self) -> dict:
+        catalog = self.catalog
+        return {table.lower(): catalog.row_count(table) for table in catalog.tables}
+
+    def check(self, cursor, query: str) -> tuple:
+        '''
+        apply the plan guardrails to a query
+        returns
+            (query to run, plan, rewritten)
+        raises
+            QueryRejected when the plan is refused
+        '''
+        plan_rows = query_plan_rows(cursor, query)
+        plan = [detail for _, _, detail in plan_rows]
+        row_counts = self._row_counts()
+        scans = large_scans(plan, query, row_counts, self.large_table_rows)
+        if not scans:
+            return query, plan, False
+        for core in select_cores(plan_rows):
+            joined = large_scans(core, query, row_counts, self.large_table_rows)
+            if len(joined) > 1:
+                raise QueryRejected('query scans several large tables in full, a cartesian join: ' +
+                                    ', '.join('%s (%d rows)' % scan for scan in joined))
+        described = ', '.join('%s (%d rows)' % scan for scan in scans)
+        if has_limit(query):
+            return query, plan, False
+        if self.on_full_scan == 'reject':
+            raise QueryRejected('query scans a large table in full without a LIMIT: ' + described)
+        limited = 'SELECT * FROM (' + query.strip().rstrip(';') + ') LIMIT ' + str(self.max_rows)
+        return limited, query_plan(cursor, limited), True
+
+    def run(self, query: str, use_cache: bool = None) -> QueryResult:
+        '''
+        execute a query on a connection checked out of the pool
+        returns
+            QueryResult, sqlite3 errors propagate to the caller
+        raises
+            QueryRejected, QueryTimeout (both sqlite3.OperationalError)
+        '''
+        use_cache = self.use_cache if use_cache is None else use_cache
+        # the caps are part of the key, a result truncated under one cap is not the result under another
+        fingerprint = '%s:%d:%d' % (self.catalog.version, self.max_rows, self.max_bytes)
+        result_cache = get_result_cache()
+        if use_cache:
+            result = result_cache.get(query, fingerprint)
+            if result is not None:
+                return result
+
+        self._count('queries')
+        start = time.perf_counter()
+        with logged_query(self._log, query, self.catalog.version) as record:
+            result = self._execute(query, start, record)
+            record.update(result.report(), status='ok', executed=result.query, query=query)
+
+        if use_cache:
+            result_cache.put(query, fingerprint, result, size=result_size(result.rows))
+        return result
+
+    def _execute(self, query: str, start: float, record: dict) -> QueryResult:
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                try:
+                    executed, plan, rewritten = self.check(cursor, query)
+                except QueryRejected:
+                    self._count('rejected')
+                    # rejected plans are the ones most in need of an index, keep them in the log
+                    record['plan'] = query_plan(cursor, query)
+                    raise
+                record['plan'] = plan
+                if self.time_budget is not None:
+                    deadline = start + self.time_budget
+                    # a non-zero return value makes sqlite abort the statement with 'interrupted'
+                    connection.set_progress_handler(lambda: time.perf_counter() > deadline, _PROGRESS_STEPS)
+                try:
+                    cursor.execute(executed)
+                    rows, truncated = fetch_rows(cursor, self.max_rows, self.max_bytes)
+                except sqlite3.OperationalError as error:
+                    if self.time_budget is not None and time.perf_counter() > deadline:
+                        self._count('timeouts')
+                        raise QueryTimeout('query interrupted after %.1f s time budget' % self.time_budget) from error
+                    raise
+                finally:
+                    connection.set_progress_handler(None, 0)
+                columns = [column[0] for column in cursor.description or []]
+            finally:
+                cursor.close()
+
+        result = QueryResult(executed, rows, columns, truncated=truncated, elapsed=time.perf_counter() - start,
+                             plan=plan, rewritten=rewritten)
+        if rewritten:
+            self._count('rewritten')
+        if truncated:
+            self._count('truncated')
+        return result
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> QueryExecutor:
+    '''
+    shared QueryExecutor for the process
+    '''
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = QueryExecutor(log_path=QUERY_LOG)
+    return _executor
+
+
+def execute_query(query: str, use_cache: bool = True) -> QueryResult:
+    '''
+    execute a SQLite query against AOP-DB on the shared backend: a connection checked out of the pool,
+    within the shared executor's plan, time and size guardrails, or the columnar engine for aggregates
+    over large tables once they have been exported (see utils/backends.py)
+    args
+        query - SQLite query
+        use_cache - serve repeated queries from the shared result cache
+    returns
+        QueryResult, sqlite3 errors propagate to the caller
+    '''
+    # the backends build on the executor defined here
+    from utils.backends import get_backend
+    return get_backend().run(query, use_cache=use_cache)
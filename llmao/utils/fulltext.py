@@ -0,0 +1,201 @@
+'''
+FTS5 full-text indexes over the text-heavy columns of AOP-DB
+
+The indexes live in a sidecar database next to AOP-DB (which stays read-only), one contentless
+FTS5 table per base table named fts_<table>, whose rowids are the base table's rowids. The
+connection pool attaches the sidecar as schema 'fts', so generated SQL can look names up with
+
+    SELECT c.ChemicalID, c.ChemicalName FROM fts_chemical_info
+    JOIN chemical_info c ON c.rowid = fts_chemical_info.rowid
+    WHERE fts_chemical_info MATCH 'chlorobenzene'
+
+instead of scanning the base table with LIKE '%chlorobenzene%'.
+
+usage (from the llmao/ directory)
+    python -m utils.fulltext                                   # index ./aopdb_08-25-2020.db
+    python -m utils.fulltext --db ./aopdb_08-25-2020.db --columns chemical_info.ChemicalName event_info.event_title
+'''
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from utils.catalog import DB_NAME, SchemaCatalog, get_catalog
+
+# schema name the sidecar is attached under
+SCHEMA = 'fts'
+
+# tokenizer of every fts table: case and diacritics folded, english words stemmed
+TOKENIZER = 'porter unicode61 remove_diacritics 2'
+
+# identifiers, codes and numbers rather than text, never worth a full-text index
+_NOT_TEXT = re.compile(r'(?i:(^|_)(id|ids|rn|code|type|taxid)$|^id_)|[a-z0-9](ID|Id|IDs|Ids|RN)$')
+
+_INSERT_BATCH = 10000
+
+
+def fulltext_path(db_name: str = DB_NAME) -> str:
+    return db_name + '.fts.db'
+
+
+def fts_table(table: str) -> str:
+    return 'fts_' + table
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def text_columns(catalog: SchemaCatalog, min_length: float = 4.0, sample: int = 1000) -> dict:
+    '''
+    find the text-heavy columns of every table in the catalog: declared as text, not named like an
+    identifier or code, and holding words (letters, at least min_length characters on average) in a sample
+    returns
+        {'table': [column, ...]}
+    '''
+    connection = sqlite3.connect('file:' + catalog.db_name + '?mode=ro', uri=True)
+    columns = {}
+    try:
+        for table, info in catalog.tables.items():
+            if info['type'] != 'table':
+                continue
+            candidates = [column['name'] for column in info['columns']
+                          if not column['pk'] and not _NOT_TEXT.search(column['name'])
+                          and any(affinity in (column['type'] or 'TEXT').upper() for affinity in ('CHAR', 'CLOB', 'TEXT'))]
+            for column in candidates:
+                average, wordy = connection.execute(
+                    'SELECT AVG(LENGTH(v)), AVG(v GLOB \'*[A-Za-z][A-Za-z]*\') FROM (SELECT ' + _quote(column) +
+                    ' AS v FROM ' + _quote(table) + ' WHERE v IS NOT NULL LIMIT ?);', (sample,)).fetchone()
+                if average is not None and average >= min_length and wordy >= 0.5:
+                    columns.setdefault(table, []).append(column)
+    finally:
+        connection.close()
+    return columns
+
+
+def build_fulltext_index(db_name: str = DB_NAME, fts_name: str = None, columns: dict = None,
+                         catalog: SchemaCatalog = None) -> dict:
+    '''
+    build the sidecar of FTS5 tables, written to a temporary file and moved into place once complete
+    args
+        db_name - path to AOP-DB
+        fts_name - sidecar path, defaults to <db_name>.fts.db
+        columns - {'table': [column, ...]} to index, defaults to text_columns of the catalog
+        catalog - SchemaCatalog of db_name, defaults to the shared one
+    returns
+        manifest {fts_table: {'table', 'columns', 'rows', 'seconds'}}
+    '''
+    fts_name = fts_name if fts_name is not None else fulltext_path(db_name)
+    catalog = catalog if catalog is not None else get_catalog(db_name)
+    columns = columns if columns is not None else text_columns(catalog)
+
+    tmp_name = fts_name + '.' + str(os.getpid()) + '.tmp'
+    if os.path.exists(tmp_name):
+        os.remove(tmp_name)
+    connection = sqlite3.connect('file:' + tmp_name, uri=True)
+    connection.execute('ATTACH DATABASE ? AS aopdb;', ('file:' + db_name + '?mode=ro',))
+    manifest = {}
+    try:
+        connection.execute('PRAGMA journal_mode = OFF;')
+        connection.execute('PRAGMA synchronous = OFF;')
+        connection.execute('CREATE TABLE fts_manifest (fts_table TEXT PRIMARY KEY, base_table TEXT, columns TEXT, '
+                           'row_count INTEGER, catalog_version TEXT);')
+        for table, table_columns in sorted(columns.items()):
+            start = time.perf_counter()
+            name = fts_table(table)
+            # contentless: the text stays in AOP-DB, the index only maps terms to rowids
+            connection.execute('CREATE VIRTUAL TABLE ' + _quote(name) + ' USING fts5(' +
+                               ', '.join(_quote(column) for column in table_columns) +
+                               ", content='', tokenize='" + TOKENIZER + "');")
+            source = connection.execute('SELECT rowid, ' + ', '.join(_quote(column) for column in table_columns) +
+                                        ' FROM aopdb.' + _quote(table) + ';')
+            insert = ('INSERT INTO ' + _quote(name) + '(rowid, ' + ', '.join(_quote(column) for column in table_columns) +
+                      ') VALUES (' + ', '.join('?' * (len(table_columns) + 1)) + ');')
+            rows = 0
+            while True:
+                batch = source.fetchmany(_INSERT_BATCH)
+                if not batch:
+                    break
+                connection.executemany(insert, batch)
+                rows += len(batch)
+            connection.execute('INSERT INTO ' + _quote(name) + '(' + _quote(name) + ") VALUES ('optimize');")
+            connection.execute('INSERT INTO fts_manifest VALUES (?, ?, ?, ?, ?);',
+                               (name, table, json.dumps(table_columns), rows, catalog.version))
+            connection.commit()
+            manifest[name] = {'table': table, 'columns': table_columns, 'rows': rows,
+                              'seconds': time.perf_counter() - start}
+        connection.execute('DETACH DATABASE aopdb;')
+    finally:
+        connection.close()
+    os.replace(tmp_name, fts_name)
+    return manifest
+
+
+def read_manifest(fts_name: str, catalog_version: str = None) -> dict:
+    '''
+    the fts tables of a sidecar, {fts_table: {'table', 'columns', 'rows'}}; empty when the sidecar is
+    missing or was built for another version of the database (its rowids would not match)
+    '''
+    if not os.path.exists(fts_name):
+        return {}
+    connection = sqlite3.connect('file:' + fts_name + '?mode=ro', uri=True)
+    try:
+        records = connection.execute('SELECT fts_table, base_table, columns, row_count, catalog_version FROM fts_manifest;').fetchall()
+    except sqlite3.Error:
+        return {}
+    finally:
+        connection.close()
+    if catalog_version is not None and any(record[4] != catalog_version for record in records):
+        return {}
+    return {name: {'table': table, 'columns': json.loads(columns), 'rows': rows} for name, table, columns, rows, _ in records}
+
+
+def describe_fulltext(manifest: dict) -> str:
+    '''
+    paragraph telling the SQL generation prompt which full-text tables exist and how to use them
+    '''
+    if not manifest:
+        return ''
+    lines = ['Full-text search tables (FTS5) are available; to find rows by words in these text columns use MATCH '
+             'on the fts table and join back to the base table on rowid instead of LIKE \'%...%\':']
+    for name, entry in sorted(manifest.items()):
+        lines.append('    %s indexes %s(%s)' % (name, entry['table'], ', '.join(entry['columns'])))
+    name, entry = sorted(manifest.items())[0]
+    lines.append('    e.g. SELECT t.* FROM %s JOIN %s t ON t.rowid = %s.rowid WHERE %s MATCH \'"word"\' LIMIT 5;'
+                 % (name, entry['table'], name, name))
+    return '\n'.join(lines)
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def get_fulltext_tables(db_name: str = DB_NAME) -> dict:
+    '''
+    manifest of the current sidecar of db_name, read once per catalog version
+    '''
+    version = get_catalog(db_name).version
+    key = (db_name, version)
+    if key not in _manifests:
+        with _manifests_lock:
+            if key not in _manifests:
+                _manifests[key] = read_manifest(fulltext_path(db_name), version)
+    return _manifests[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_NAME, help='path to the AOP database')
+    parser.add_argument('--out', help='sidecar path, defaults to <db>.fts.db')
+    parser.add_argument('--columns', nargs='*', help='table.column to index, defaults to the detected text columns')
+    args = parser.parse_args()
+
+    selected = None
+    if args.columns:
+        selected = {}
+        for name in args.columns:
+            table, column = name.split('.', 1)
+            selected.setdefault(table, []).append(column)
+    for name, entry in build_fulltext_index(args.db, args.out, selected, SchemaCatalog(args.db)).items():
+        print('%s: %s(%s), %d rows in %.1f s' % (name, entry['table'], ', '.join(entry['columns']), entry['rows'], entry['seconds']))
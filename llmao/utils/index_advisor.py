@@ -0,0 +1,336 @@
+'''
+Offline index advisor for AOP-DB driven by the query log
+
+Every statement run by the shared QueryExecutor is logged with its timing and EXPLAIN QUERY PLAN
+(see QUERY_LOG in utils/execution.py). The advisor reads that log, finds the tables each query scans
+in full (SCAN) or sorts in a temporary b-tree (ORDER BY / GROUP BY / DISTINCT), and proposes a
+secondary index on the equality, range and ordering columns of the query, made covering when the
+query only needs a few columns of the table. Each recommendation comes with a projected speedup
+from a simple cost model (rows visited before and after); with --apply the indexes are built on a
+writable copy of the database and every affected query is timed against both to measure it.
+
+usage (from the llmao/ directory)
+    python -m utils.index_advisor                                        # recommendations only
+    python -m utils.index_advisor --apply ./data/aopdb_indexed.db        # build them on a copy and measure
+'''
+import argparse
+import json
+import math
+import re
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from utils.catalog import DB_NAME, SchemaCatalog
+from utils.execution import QUERY_LOG, table_aliases
+from utils.result_cache import canonicalize_sql
+
+# most columns an index may have to be made covering
+MAX_COVERING_COLUMNS = 6
+
+# fraction of rows a range predicate is assumed to keep
+RANGE_SELECTIVITY = 0.25
+
+_CLAUSE = re.compile(r'\b(SELECT|FROM|WHERE|GROUP BY|HAVING|ORDER BY|LIMIT|JOIN|ON|UNION|EXCEPT|INTERSECT)\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PREDICATE = re.compile(r'(?:(\w+)\.)?(\w+)\s*(==|=|<=|>=|<|>|\bIN\b|\bIS\b(?!\s+NOT)|\bBETWEEN\b)\s*(?:(\w+)\.(\w+))?')
+_REFERENCE = re.compile(r'(?:(\w+)\.)?(\w+|\*)')
+_PLAN_NAME = re.compile(r'^(SCAN|SEARCH) (\w+)')
+_TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)')
+
+_EQUALITY = {'=', '==', 'IN', 'IS'}
+
+
+def read_query_log(log_path: str = QUERY_LOG) -> list:
+    with open(log_path) as log_file:
+        return [json.loads(line) for line in log_file if line.strip()]
+
+
+def _clauses(query: str) -> list:
+    '''
+    [(keyword, text), ...] of a query with string literals blanked, subqueries are not separated
+    '''
+    text = _STRING.sub('?', canonicalize_sql(query))
+    matches = list(_CLAUSE.finditer(text))
+    return [(match.group(1), text[match.end():matches[i + 1].start() if i + 1 < len(matches) else len(text)])
+            for i, match in enumerate(matches)]
+
+
+class QueryShape():
+    '''
+    The columns a query uses per table, by role, resolved against the catalog.
+
+    init params
+        query - SQL text
+        catalog - SchemaCatalog the query runs against
+    '''
+    def __init__(self, query: str, catalog: SchemaCatalog):
+        self.aliases = table_aliases(query)
+        self._columns = {}
+        for table in set(self.aliases.values()):
+            if table in catalog.tables:
+                self._columns[table] = {column.lower(): column for column in catalog.columns(table)}
+        self.equality, self.join, self.range, self.group, self.order, self.selected = {}, {}, {}, {}, {}, {}
+        self.star = False
+
+        for keyword, text in _clauses(query):
+            if keyword in ('WHERE', 'ON', 'HAVING'):
+                for qualifier, name, operator, right_qualifier, right_name in _PREDICATE.findall(text):
+                    if right_name and operator in ('=', '=='):
+                        # a join condition, either side may be the inner table of the loop
+                        self._add(self.join, qualifier, name)
+                        self._add(self.join, right_qualifier, right_name)
+                    else:
+                        self._add(self.equality if operator.upper() in _EQUALITY else self.range, qualifier, name)
+            elif keyword in ('GROUP BY', 'ORDER BY'):
+                role = self.group if keyword == 'GROUP BY' else self.order
+                for item in text.split(','):
+                    match = re.match(r'\s*(?:(\w+)\.)?(\w+)\s*(ASC|DESC)?\s*$', item)
+                    if match:
+                        self._add(role, match.group(1), match.group(2))
+            elif keyword == 'SELECT':
+                for qualifier, name in _REFERENCE.findall(text):
+                    if name == '*':
+                        self.star = True
+                    else:
+                        self._add(self.selected, qualifier, name)
+
+    def _add(self, role: dict, qualifier: str, name: str):
+        if qualifier:
+            tables = [self.aliases.get(qualifier.lower())]
+        else:
+            tables = [table for table, columns in self._columns.items() if name.lower() in columns]
+        for table in tables:
+            column = self._columns.get(table, {}).get(name.lower())
+            if column is not None and column not in role.setdefault(table, []):
+                role[table].append(column)
+
+    def columns(self, table: str) -> list:
+        '''
+        every column of table the query touches
+        '''
+        used = []
+        for role in (self.equality, self.join, self.range, self.group, self.order, self.selected):
+            used += [column for column in role.get(table, []) if column not in used]
+        return used
+
+
+def existing_indexes(connection, table: str) -> list:
+    '''
+    column lists of the indexes on table, the rowid alias counts as an index on its column
+    '''
+    indexes = []
+    for _, name, *_ in connection.execute('SELECT * FROM pragma_index_list(?);', (table,)).fetchall():
+        indexes.append([row[2] for row in connection.execute('SELECT * FROM pragma_index_info(?);', (name,)).fetchall()])
+    indexes += [[row[1]] for row in connection.execute('SELECT * FROM pragma_table_info(?);', (table,)).fetchall()
+                if row[5] == 1 and row[2].upper() == 'INTEGER']
+    return indexes
+
+
+def _distinct(connection, table: str, column: str, rows: int, sample: int = 100000) -> float:
+    quoted = '"' + column.replace('"', '""') + '"'
+    sampled, distinct = connection.execute('SELECT COUNT(*), COUNT(DISTINCT v) FROM (SELECT ' + quoted + ' AS v FROM "' +
+                                           table.replace('"', '""') + '" LIMIT ?);', (sample,)).fetchone()
+    if not sampled:
+        return 1.0
+    # a column that is nearly unique in the sample is assumed unique overall
+    return float(distinct) * rows / sampled if distinct > 0.5 * sampled else float(max(1, distinct))
+
+
+def project_speedup(rows: int, selectivity: float, scanned: bool, sort_removed: bool) -> float:
+    '''
+    rows visited before / after the index: a scan reads every row and a temp b-tree sorts the matches,
+    an index search costs a descent plus the matching rows
+    '''
+    rows = max(2, rows or 2)
+    matched = max(1.0, rows * selectivity)
+    before = (rows if scanned else matched) + (matched * math.log2(matched + 1) if sort_removed else 0.0)
+    after = math.log2(rows) + matched
+    return before / after
+
+
+def index_name(table: str, columns: list) -> str:
+    '''
+    name of the recommended index, the readable part is cut to fit and a hash of the columns keeps it unique
+    '''
+    digest = '%08x' % zlib.crc32(json.dumps([table] + columns).encode('utf-8'))
+    return ('idx_' + table + '_' + '_'.join(columns))[:51] + '_' + digest
+
+
+def recommend(record: dict, catalog: SchemaCatalog, connection) -> list:
+    '''
+    index recommendations for one query log record
+    returns
+        [{'table', 'columns', 'kind', 'statement', 'projected'}, ...]
+    '''
+    plan = record.get('plan') or []
+    # the generated query rather than the executed one, a LIMIT wrapper added by the guardrails selects *
+    shape = QueryShape(record['query'], catalog)
+    sorts = {match.group(1) for match in map(_TEMP_SORT.search, plan) if match}
+    recommendations = []
+    seen = set()
+    for detail in plan:
+        match = _PLAN_NAME.match(detail)
+        if match is None:
+            continue
+        table = shape.aliases.get(match.group(2).lower(), match.group(2))
+        if table not in catalog.tables or catalog.tables[table]['type'] != 'table' or table in seen:
+            continue
+        seen.add(table)
+        scanned = match.group(1) == 'SCAN'
+        equality = shape.equality.get(table, [])
+        # constants first, they are known before the join loop starts
+        joined = [column for column in shape.join.get(table, []) if column not in equality]
+        ranged = shape.range.get(table, [])[:1]
+        ordering = shape.group.get(table, []) if 'GROUP BY' in sorts else shape.order.get(table, []) if 'ORDER BY' in sorts else []
+
+        columns = equality + joined + [column for column in ranged if column not in equality + joined]
+        # sorted retrieval only survives equality constraints, a range column breaks the order
+        sort_removed = bool(ordering) and not ranged
+        if sort_removed:
+            columns += [column for column in ordering if column not in columns]
+        if not columns or (not scanned and not sort_removed):
+            continue
+
+        kind = 'secondary'
+        used = shape.columns(table)
+        if not shape.star and len(columns) < len(used) <= MAX_COVERING_COLUMNS:
+            columns += [column for column in used if column not in columns]
+            kind = 'covering'
+        if any(index[:len(columns)] == columns for index in existing_indexes(connection, table)):
+            continue
+
+        rows = catalog.row_count(table) or 0
+        selectivity = 1.0
+        for column in equality:
+            selectivity /= _distinct(connection, table, column, rows)
+        if ranged:
+            selectivity *= RANGE_SELECTIVITY
+        name = index_name(table, columns)
+        recommendations.append({
+            'table': table,
+            'columns': columns,
+            'kind': kind,
+            'statement': 'CREATE INDEX IF NOT EXISTS "%s" ON "%s" (%s);' % (name, table, ', '.join('"%s"' % c for c in columns)),
+            'projected': project_speedup(rows, selectivity, scanned, sort_removed),
+        })
+    return recommendations
+
+
+def measure(db_name: str, query: str, rounds: int = 3) -> float:
+    '''
+    median seconds to run a query and fetch every row on a fresh read-only connection
+    '''
+    connection = sqlite3.connect('file:' + db_name + '?mode=ro', uri=True)
+    timings = []
+    try:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            connection.execute(query).fetchall()
+            timings.append(time.perf_counter() - start)
+    finally:
+        connection.close()
+    return sorted(timings)[len(timings) // 2]
+
+
+def apply_indexes(db_name: str, statements: list, out_name: str) -> str:
+    '''
+    copy db_name to out_name with the sqlite backup API and build the indexes on the copy
+    returns
+        out_name
+    '''
+    source = sqlite3.connect('file:' + db_name + '?mode=ro', uri=True)
+    target = sqlite3.connect(out_name)
+    try:
+        source.backup(target)
+        for statement in statements:
+            target.execute(statement)
+        target.execute('ANALYZE;')
+        target.commit()
+    finally:
+        source.close()
+        target.close()
+    return out_name
+
+
+def advise(log_path: str = QUERY_LOG, db_name: str = DB_NAME, catalog: SchemaCatalog = None,
+           apply_to: str = None, rounds: int = 3) -> tuple:
+    '''
+    mine the query log for index recommendations
+    args
+        apply_to - path of a writable copy to build the indexes on and measure, None to only project
+        rounds - timing runs per query and database when measuring
+    returns
+        (statements, report), report has one entry per logged query with a recommendation:
+        {'query', 'count', 'logged_elapsed', 'indexes', 'projected', 'before', 'after', 'measured'}
+    '''
+    catalog = catalog if catalog is not None else SchemaCatalog(db_name)
+    records = [record for record in read_query_log(log_path)
+               if record.get('plan') and record.get('catalog_version') in (None, catalog.version)]
+
+    # the same statement logged many times is analysed once and weighted by its count
+    queries = OrderedDict()
+    for record in records:
+        key = canonicalize_sql(record.get('executed') or record['query'])
+        entry = queries.setdefault(key, {'record': record, 'count': 0, 'elapsed': []})
+        entry['count'] += 1
+        entry['elapsed'].append(record.get('elapsed', 0.0))
+
+    connection = sqlite3.connect('file:' + db_name + '?mode=ro', uri=True)
+    recommended, report = {}, []
+    try:
+        for query, entry in queries.items():
+            recommendations = recommend(entry['record'], catalog, connection)
+            if not recommendations:
+                continue
+            for recommendation in recommendations:
+                recommended[recommendation['statement']] = recommendation
+            report.append({
+                'query': query,
+                'count': entry['count'],
+                'logged_elapsed': sorted(entry['elapsed'])[len(entry['elapsed']) // 2],
+                'indexes': recommendations,
+                # indexes on different tables of a join compound
+                'projected': math.prod(recommendation['projected'] for recommendation in recommendations),
+            })
+    finally:
+        connection.close()
+
+    # an index whose columns lead another recommended index on the same table is redundant, the longest
+    # index it leads is built in its place
+    built = {}
+    for statement, recommendation in recommended.items():
+        leading = [other for other in recommended.values() if other['table'] == recommendation['table']
+                   and other['columns'][:len(recommendation['columns'])] == recommendation['columns']]
+        built[statement] = max(leading, key=lambda other: len(other['columns']))['statement']
+    statements = [statement for statement in recommended if built[statement] == statement]
+    for entry in report:
+        entry['indexes'] = list(OrderedDict.fromkeys(built[recommendation['statement']] for recommendation in entry['indexes']))
+    if apply_to is not None and statements:
+        apply_indexes(db_name, statements, apply_to)
+        for entry in report:
+            try:
+                entry['before'] = measure(db_name, entry['query'], rounds)
+                entry['after'] = measure(apply_to, entry['query'], rounds)
+            except sqlite3.Error:
+                # e.g. a query joining the full-text sidecar, which is not attached here
+                continue
+            entry['measured'] = entry['before'] / max(entry['after'], 1e-9)
+    return statements, report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_NAME, help='path to the AOP database')
+    parser.add_argument('--log', default=QUERY_LOG, help='query log written by the executor')
+    parser.add_argument('--apply', help='writable copy to build the indexes on and measure')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    statements, report = advise(args.log, args.db, apply_to=args.apply, rounds=args.rounds)
+    for entry in sorted(report, key=lambda entry: -entry['count'] * entry['logged_elapsed']):
+        measured = ', measured %.1fx (%.2f -> %.2f ms)' % (entry['measured'], 1000 * entry['before'], 1000 * entry['after']) \
+            if 'measured' in entry else ''
+        print('%dx %.2f ms  projected %.1fx%s\n    %s' % (entry['count'], 1000 * entry['logged_elapsed'],
+                                                         entry['projected'], measured, entry['query']))
+    print('\n'.join(['', 'recommended indexes:'] + statements if statements else ['no index recommendations']))
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+
+# answers, SQL generation, routing and the LLM-as-judge tools
+CHAT_MODEL = 'anthropic.claude-3-sonnet-20240229-v1:0'
+
+# table selection in AOP_route
+TABLE_MODEL = 'mistral.mistral-7b-instruct-v0:2'
+
+# metric scoring in Evaluator
+EVAL_MODEL = 'anthropic.claude-3-haiku-20240307-v1:0'
+
+# AWS profile the Bedrock client signs requests with
+AWS_PROFILE = 'default'
+
+# concurrent HTTP connections kept open to bedrock-runtime, shared by every model;
+# evaluation threads and concurrent sessions each hold one while a call is in flight
+MAX_POOL_CONNECTIONS = 32
+
+# seconds to open a connection / to wait for a (streamed) response
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 120
+
+# reply of every model on the in-process 'fake' backend (LLMAO_MODELS=fake), which needs no AWS
+# credentials or network access, e.g. to click through the app or profile it without Bedrock
+FAKE_RESPONSE = 'none'
+
+
+def fake_chat_model(model_id: str, **kwargs):
+    '''
+    ModelRegistry backend answering every prompt with FAKE_RESPONSE, which routes small talk away
+    from the database; Bedrock-only arguments such as model_kwargs are ignored
+    '''
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    return FakeListChatModel(responses=[FAKE_RESPONSE], name=model_id, callbacks=kwargs.get('callbacks'))
+
+# model backends selectable by name
+BACKENDS = {
+    'fake': fake_chat_model,
+}
+
+
+class ModelRegistry():
+    '''
+    Owns the chat models of the process: one long-lived model object per model id (and
+    construction arguments), all sharing a single bedrock-runtime client whose connection pool
+    keeps its HTTPS connections alive between calls. Constructing a BedrockChat per call instead
+    builds a new boto3 session, client and pool, and pays a new TLS handshake on its first request.
+
+    init params
+        backend - 'bedrock', a name in BACKENDS, or a function(model_id=..., **kwargs) returning a
+                  langchain chat model, e.g. benchmarks.replay.ReplayBackend.chat_model
+        profile - AWS credentials profile
+        region - AWS region, None for the profile's region
+        max_pool_connections - size of the shared HTTP connection pool
+        callbacks - langchain callback handlers attached to every model built
+    '''
+    def __init__(self, backend='bedrock', profile: str = AWS_PROFILE, region: str = None,
+                 max_pool_connections: int = MAX_POOL_CONNECTIONS, callbacks: list = None):
+        if isinstance(backend, str) and backend != 'bedrock':
+            if backend not in BACKENDS:
+                raise ValueError('Invalid model backend given: ' + backend + ' is not bedrock, one of ' +
+                                 str(list(BACKENDS)) + ' or a function')
+            backend = BACKENDS[backend]
+        self.backend = backend
+        self.profile = profile
+        self.region = region
+        self.max_pool_connections = max_pool_connections
+        self.callbacks = callbacks
+        self._client = None
+        self._models = {}
+        self._lock = threading.Lock()
+        self._stats = {'created': 0, 'reused': 0, 'setup_seconds': 0.0}
+
+    def _bedrock_client(self):
+        '''
+        the bedrock-runtime client shared by every model, boto3 clients are thread safe
+        '''
+        if self._client is None:
+            import boto3
+            from botocore.config import Config
+            config = Config(max_pool_connections=self.max_pool_connections, tcp_keepalive=True,
+                            connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                            retries={'max_attempts': 3, 'mode': 'adaptive'})
+            session = boto3.Session(profile_name=self.profile)
+            self._client = session.client('bedrock-runtime', region_name=self.region or session.region_name,
+                                          config=config)
+        return self._client
+
+    def _build(self, model_id: str, kwargs: dict):
+        if self.callbacks is not None:
+            kwargs = dict(kwargs, callbacks=self.callbacks)
+        if self.backend == 'bedrock':
+            from langchain_community.chat_models import BedrockChat
+            return BedrockChat(client=self._bedrock_client(), model_id=model_id, verbose=True, **kwargs)
+        return self.backend(model_id=model_id, **kwargs)
+
+    def get(self, model_id: str = CHAT_MODEL, **kwargs):
+        '''
+        the chat model for model_id, built on first use
+        args
+            model_id - Bedrock model id
+            kwargs - further BedrockChat arguments, e.g. model_kwargs; each distinct set gets its own model
+        '''
+        key = (model_id, repr(sorted(kwargs.items())))
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._stats['reused'] += 1
+                return model
+            start = time.perf_counter()
+            model = self._models[key] = self._build(model_id, kwargs)
+            self._stats['created'] += 1
+            self._stats['setup_seconds'] += time.perf_counter() - start
+        return model
+
+    def clear(self):
+        '''
+        drop the models and the client, e.g. after the AWS credentials changed
+        '''
+        with self._lock:
+            self._models = {}
+            self._client = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, models=len(self._models))
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def set_model_registry(registry):
+    '''
+    choose the registry every call site takes its chat models from
+    args
+        registry - a ModelRegistry, or a backend accepted by ModelRegistry
+    '''
+    global _registry
+    if not isinstance(registry, ModelRegistry):
+        registry = ModelRegistry(backend=registry)
+    with _registry_lock:
+        _registry = registry
+    return registry
+
+def get_model_registry() -> ModelRegistry:
+    '''
+    shared ModelRegistry, on the backend named by the LLMAO_MODELS environment variable: bedrock (the
+    default) or fake
+    '''
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry(backend=os.environ.get('LLMAO_MODELS', 'bedrock'))
+        return _registry
+
+def get_chat_model(model_id: str = CHAT_MODEL, **kwargs):
+    '''
+    shorthand for get_model_registry().get(model_id, **kwargs)
+    '''
+    return get_model_registry().get(model_id, **kwargs)
@@ -0,0 +1,147 @@
+import asyncio
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from utils.models import CHAT_MODEL, get_chat_model
+from utils.router import get_route_classifier, route_question, route_question_async
+from utils.scheduler import StageGraph
+
+# questions an AsyncPipeline answers at once, later ones wait for a free slot; each in-flight question
+# holds its prompts, query result and answer buffer, so this bounds the memory of the process
+MAX_IN_FLIGHT = 256
+
+# answers to chat messages that do not need the AOP database
+GENERIC_PROMPT = ChatPromptTemplate.from_template(""" <instructions>
+        You are a friendly, cheerful, and helpful assistant. 
+        Answer the following questions considering the chat history and user question.
+        If the chat history is empty, do not mention the chat history </instructions>
+
+        Chat history: {chat_history}
+        question: {user_question}
+        """)
+
+
+def answer_question(question, chat_history, llm=None, classifier=None, stream=True) -> tuple:
+    '''
+    one chat turn of pages/app.py. When the local classifier is unsure and the routing LLM has to be
+    asked, table selection (question cache lookup, AOP_route) starts at the same time, speculatively:
+    it is cancelled when the message turns out not to need the database, and otherwise handed to
+    AOP_query_chain, so the first token waits on the slower of the two instead of both in turn.
+    A confident route takes microseconds, then nothing is started before it is known, and small talk
+    never pays for AOP_route's LLM call
+    args
+        llm - chat model for routing and generic answers, the registry's CHAT_MODEL by default
+        classifier - RouteClassifier, defaults to the shared one
+    returns
+        ('database' or 'none', generator of answer chunks if stream, otherwise the answer)
+    '''
+    # imported here, utils.AOP_db_query needs the streamlit runtime through utils.utils
+    from utils.AOP_db_query import AOP_query_chain, select_tables
+
+    llm = llm if llm is not None else get_chat_model(CHAT_MODEL)
+    classifier = classifier if classifier is not None else get_route_classifier()
+    speculate = classifier.needs_llm(question)
+    graph = StageGraph()
+    graph.add('route', lambda: route_question(question, llm, classifier))
+    if speculate:
+        graph.add('selection', lambda: select_tables(question, chat_history))
+    graph.start()
+
+    try:
+        path = graph.result('route')
+    except BaseException:
+        if speculate:
+            graph.cancel('selection')
+        raise
+    if path == 'database':
+        selection = graph.result('selection') if speculate else None
+        return path, AOP_query_chain(question, chat_history, stream=stream, selection=selection)
+    if speculate:
+        graph.cancel('selection')
+
+    chain = GENERIC_PROMPT | llm | StrOutputParser()
+    generic_input = {"user_question": question, "chat_history": chat_history}
+    return path, chain.stream(generic_input) if stream else chain.invoke(generic_input)
+
+
+async def generic_response_async(question, chat_history):
+    '''
+    answer a message that does not need the database
+    returns
+        async iterator of answer chunks
+    '''
+    chain = GENERIC_PROMPT | get_chat_model(CHAT_MODEL) | StrOutputParser()
+    return chain.astream({
+        "user_question": question,
+        "chat_history": chat_history
+    })
+
+
+async def answer_question_async(question, chat_history, classifier=None):
+    '''
+    answer_question on the event loop, the speculative table selection is a task cancelled when the
+    message does not need the database
+    returns
+        async iterator of answer chunks
+    '''
+    from utils.AOP_db_query import AOP_query_chain_async, select_tables_async
+
+    classifier = classifier if classifier is not None else get_route_classifier()
+    selection = None
+    if classifier.needs_llm(question):
+        selection = asyncio.ensure_future(select_tables_async(question, chat_history))
+    try:
+        path = await route_question_async(question, get_chat_model(CHAT_MODEL), classifier)
+    except BaseException:
+        if selection is not None:
+            selection.cancel()
+        raise
+    if path == 'database':
+        return await AOP_query_chain_async(question, chat_history,
+                                           selection=await selection if selection is not None else None)
+    if selection is not None:
+        selection.cancel()
+    return await generic_response_async(question, chat_history)
+
+
+class AsyncPipeline():
+    '''
+    Answers many chat turns concurrently on one event loop. While a question waits on a model the
+    loop serves the others, so hundreds can be in flight without a thread each; at most
+    max_in_flight are answered at any time.
+
+    init params
+        max_in_flight - concurrently answered questions
+        answer - async function(question, chat_history) returning an async iterator of chunks,
+                 answer_question_async by default
+    '''
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, answer=None):
+        self.max_in_flight = max_in_flight
+        self._answer = answer if answer is not None else answer_question_async
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.peak = 0
+
+    async def stream(self, question, chat_history):
+        '''
+        yields
+            the answer chunks as the model produces them
+        '''
+        async with self._slots:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            try:
+                async for chunk in await self._answer(question, chat_history):
+                    yield chunk
+            finally:
+                self.in_flight -= 1
+
+    async def answer(self, question, chat_history) -> str:
+        return ''.join([chunk async for chunk in self.stream(question, chat_history)])
+
+    async def answer_all(self, questions: list, chat_history='') -> list:
+        '''
+        answer independent questions concurrently
+        returns
+            the answers, in the order of questions
+        '''
+        return await asyncio.gather(*(self.answer(question, chat_history) for question in questions))
@@ -0,0 +1,183 @@
+import re
+import sqlite3
+import threading
+import numpy as np
+from utils.catalog import get_catalog
+
+# on-disk layer of the question cache, relative to the llmao/ directory
+CACHE_PATH = './data/question_cache.db'
+
+# minimum cosine similarity for a nearest-neighbor hit; on its own it also matches questions that
+# differ in the one word that matters (increase/decrease, chlorobenzene/dichlorobenzene), so a
+# near match must have the same content words as well, see content_words
+SIMILARITY_THRESHOLD = 0.9
+
+# words that can be added or dropped without changing the SQL a question needs; entities, numbers,
+# operators (and, or, more, most, ...) and negations (not, no, without, ...) are never listed here
+FILLER_WORDS = frozenset([
+    'a', 'an', 'the', 'please', 'kindly', 'me', 'us', 'i', 'you', 'can', 'could', 'would', 'will',
+    'tell', 'show', 'give', 'find', 'get', 'list', 'what', 'which', 'are', 'is', 'there', 'do', 'does',
+    'in', 'of', 'on', 'for',
+])
+
+
+def normalize_question(question: str) -> str:
+    '''
+    lowercase, drop punctuation and collapse whitespace so trivially different questions match exactly
+    '''
+    return ' '.join(re.sub(r'[^\w\s]', ' ', question.lower()).split())
+
+
+def content_words(normalized: str) -> tuple:
+    '''
+    the words of a normalized question that decide its SQL, in order: everything except FILLER_WORDS
+    '''
+    return tuple(word for word in normalized.split() if word not in FILLER_WORDS)
+
+
+class QuestionCache():
+    '''
+    Maps user questions to SQL that was already generated, executed and returned results, so a repeated
+    question can skip AOP_route and SQL generation and go straight to execution. Lookups try the
+    normalized question first, then the nearest cached questions by embedding similarity, of which
+    only one with exactly the same content words is reused. Entries are tied to the schema catalog
+    version and ignored once the database changes.
+
+    init params
+        path - sqlite file for the persistent layer, None to keep the cache in memory only
+        threshold - minimum cosine similarity for a nearest-neighbor hit
+        provider - embedding provider for the nearest-neighbor lookup, defaults to the local
+                   hashing provider so a lookup never costs a network round-trip
+        schema_version - function returning the current schema version
+    '''
+    def __init__(self, path: str = CACHE_PATH, threshold: float = SIMILARITY_THRESHOLD, provider=None,
+                 schema_version=None):
+        self.path = path
+        self.threshold = threshold
+        self._provider = provider
+        self._schema_version = schema_version if schema_version is not None else lambda: get_catalog().version
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        self._version = None
+        self._entries = {}
+        self._keys = []
+        self._vectors = None
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _get_provider(self):
+        if self._provider is None:
+            from eval.embeddings import HashingEmbeddingProvider
+            self._provider = HashingEmbeddingProvider()
+        return self._provider
+
+    def _get_db(self):
+        if self._db is None and self.path is not None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS questions (
+                schema_version TEXT, normalized TEXT, question TEXT, query TEXT, table_dict TEXT,
+                PRIMARY KEY (schema_version, normalized));""")
+            self._db.commit()
+        return self._db
+
+    def _sync_version(self):
+        '''
+        (re)load the entries for the current schema version, dropping everything cached for an older one
+        '''
+        version = self._schema_version()
+        if version == self._version:
+            return version
+        self._version = version
+        self._entries = {}
+        db = self._get_db()
+        if db is not None:
+            rows = db.execute('SELECT normalized, question, query, table_dict FROM questions WHERE schema_version = ?;',
+                              (version,)).fetchall()
+            for normalized, question, query, table_dict in rows:
+                self._entries[normalized] = {'question': question, 'query': query, 'table_dict': table_dict}
+        self._reindex()
+        return version
+
+    def _reindex(self):
+        self._keys = list(self._entries)
+        if self._keys:
+            self._vectors = np.asarray(self._get_provider().embed_documents(self._keys), dtype=np.float32)
+        else:
+            self._vectors = None
+
+    def lookup(self, question: str):
+        '''
+        returns
+            {'question', 'query', 'table_dict', 'similarity'} for the best cached match, or None
+        '''
+        normalized = normalize_question(question)
+        with self._lock:
+            self._sync_version()
+            if normalized in self._entries:
+                self.hits += 1
+                self.exact_hits += 1
+                return dict(self._entries[normalized], similarity=1.0)
+
+            if self._vectors is not None:
+                # vectors are l2 normalized, so the dot product is the cosine similarity
+                vector = np.asarray(self._get_provider().embed_documents([normalized]), dtype=np.float32)[0]
+                similarities = self._vectors @ vector
+                words = content_words(normalized)
+                for best in np.argsort(-similarities):
+                    if similarities[best] < self.threshold:
+                        break
+                    # "look up 2 chemicals" and "look up 20 chemicals", or "... increase CYP1A1" and
+                    # "... decrease CYP1A1", are near-identical strings with different SQL
+                    if content_words(self._keys[best]) == words:
+                        self.hits += 1
+                        return dict(self._entries[self._keys[best]], similarity=float(similarities[best]))
+
+            self.misses += 1
+            return None
+
+    def store(self, question: str, query: str, table_dict):
+        '''
+        remember SQL that was executed successfully for a question
+        '''
+        normalized = normalize_question(question)
+        with self._lock:
+            version = self._sync_version()
+            if normalized not in self._entries:
+                vector = np.asarray(self._get_provider().embed_documents([normalized]), dtype=np.float32)
+                self._keys.append(normalized)
+                self._vectors = vector if self._vectors is None else np.vstack([self._vectors, vector])
+            self._entries[normalized] = {'question': question, 'query': query, 'table_dict': str(table_dict)}
+            db = self._get_db()
+            if db is not None:
+                db.execute('INSERT OR REPLACE INTO questions VALUES (?, ?, ?, ?, ?);',
+                           (version, normalized, question, query, str(table_dict)))
+                db.commit()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'exact_hits': self.exact_hits, 'misses': self.misses,
+                'entries': len(self._entries)}
+
+
+_question_cache = None
+_question_cache_lock = threading.Lock()
+
+def get_question_cache() -> QuestionCache:
+    '''
+    shared QuestionCache for the process
+    '''
+    global _question_cache
+    if _question_cache is None:
+        with _question_cache_lock:
+            if _question_cache is None:
+                _question_cache = QuestionCache()
+    return _question_cache
+
+def set_question_cache(cache: QuestionCache) -> QuestionCache:
+    '''
+    replace the shared QuestionCache, e.g. with one on a scratch file for offline benchmarks
+    '''
+    global _question_cache
+    with _question_cache_lock:
+        _question_cache = cache
+    return cache
@@ -0,0 +1,150 @@
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+# keywords upper-cased by canonicalize_sql; identifiers and literals keep their case
+SQL_KEYWORDS = {
+    'select', 'distinct', 'from', 'where', 'and', 'or', 'not', 'in', 'is', 'null', 'like', 'glob', 'match',
+    'between', 'exists', 'join', 'inner', 'left', 'right', 'outer', 'cross', 'natural', 'on', 'using',
+    'group', 'by', 'having', 'order', 'asc', 'desc', 'limit', 'offset', 'union', 'all', 'intersect',
+    'except', 'as', 'case', 'when', 'then', 'else', 'end', 'with', 'recursive', 'collate', 'escape',
+    'count', 'sum', 'avg', 'min', 'max', 'total', 'group_concat', 'lower', 'upper', 'length', 'substr',
+    'cast', 'coalesce', 'ifnull', 'round', 'abs', 'nulls', 'first', 'last',
+}
+
+_TOKEN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<space>\s+)
+  | (?P<other>.)
+    """, re.VERBOSE | re.DOTALL)
+
+_WORDLIKE = re.compile(r"""[\w'"`\[\]$]""")
+
+
+def canonicalize_sql(sql: str) -> str:
+    '''
+    canonical text of a query: comments dropped, whitespace collapsed, keywords upper-cased and
+    trailing semicolons removed, while string literals and quoted identifiers are kept verbatim
+    '''
+    tokens = []
+    separated = False
+    for match in _TOKEN.finditer(sql):
+        kind = match.lastgroup
+        text = match.group()
+        if kind in ('comment', 'space'):
+            separated = True
+            continue
+        if kind == 'word' and text.lower() in SQL_KEYWORDS:
+            text = text.upper()
+        # whitespace only matters between two word-like tokens, "a , b" and "a,b" are the same query
+        if separated and tokens and _WORDLIKE.match(tokens[-1][-1]) and _WORDLIKE.match(text[0]):
+            tokens.append(' ')
+        tokens.append(text)
+        separated = False
+    return ''.join(tokens).rstrip(';')
+
+
+def result_size(result) -> int:
+    '''
+    approximate memory footprint of a fetchall() result in bytes
+    '''
+    size = sys.getsizeof(result)
+    for row in result:
+        size += sys.getsizeof(row)
+        for value in row:
+            size += sys.getsizeof(value)
+    return size
+
+
+class ResultCache():
+    '''
+    Bounded cache of SQL results keyed on the canonical query text and the database fingerprint.
+    AOP-DB is an immutable snapshot, so a result only goes stale when the fingerprint changes.
+    Least recently used entries are evicted once the cached results exceed max_bytes.
+
+    init params
+        max_bytes - total size of cached results
+        max_entry_bytes - results larger than this are never cached
+    '''
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str, fingerprint: str) -> tuple:
+        return (fingerprint, canonicalize_sql(query))
+
+    def get(self, query: str, fingerprint: str):
+        '''
+        returns
+            the cached result, or None on a miss
+        '''
+        key = self.key(query, fingerprint)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                result = self._entries[key][0]
+                return list(result) if isinstance(result, list) else result
+            self.misses += 1
+            return None
+
+    def put(self, query: str, fingerprint: str, result, size: int = None):
+        '''
+        cache a result, either a list of rows or an object whose size is given
+        '''
+        size = result_size(result) if size is None else size
+        if size > self.max_entry_bytes:
+            return
+        key = self.key(query, fingerprint)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (list(result) if isinstance(result, list) else result, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+            }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache() -> ResultCache:
+    '''
+    shared ResultCache for the process, used by interactive questions and Generator runs alike
+    '''
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache()
+    return _result_cache
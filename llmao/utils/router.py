@@ -0,0 +1,291 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+import numpy as np
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from utils.catalog import get_catalog
+from utils.sinks import BufferedWriter
+from utils.table_index import get_table_index, tokenize
+from utils.timing import stage
+
+# routing decisions are appended here so the confidence threshold can be tuned offline
+ROUTING_LOG = './data/routing_log.jsonl'
+
+# weights of the optional linear model trained on the routing log
+ROUTE_MODEL = './data/route_model.npz'
+
+# the LLM is only skipped when the local classifier is at least this confident
+CONFIDENCE_THRESHOLD = 0.85
+
+# direct mentions of the database itself, which the routing prompt always sends to the database
+_EXPLICIT = re.compile(r'\b(aops?|adverse outcome|databases?|db|tables?|columns?|schema|sql|quer(y|ies))\b', re.IGNORECASE)
+# identifiers that only make sense as AOP-DB lookups: MeSH ids, CAS numbers, AOP/KE/MIE numbers
+_ENTITY = re.compile(r'\b(mesh:\s*[cd]\d+|\d{2,7}-\d{2}-\d|(aop|ke|mie|ao)\s*#?\s*\d+)\b', re.IGNORECASE)
+# small talk that never needs the database
+_CHITCHAT = re.compile(r"^\s*(hi|hello|hey|thanks|thank you|good (morning|afternoon|evening)|who are you|"
+                       r"what can you do|how are you|bye|goodbye|ok|okay|cool|great)\b[\s\S]{0,30}$", re.IGNORECASE)
+
+_N_FEATURES = 1 << 12
+
+# prompt of the routing LLM, only consulted when the local classifier is unsure
+ROUTE_PROMPT = PromptTemplate.from_template("""
+        Given the user question below, classify whether it has anything at all to do with the
+        adverse outcome pathway (AOP) database or any of its tables, listed below. 
+        If the question directly mentions the AOP database, any of its tables, or any of its columns, respond with database. Otherwise, respond with none.
+        Do not respond with more than one word, and do not include punctuation or uppercase letters.
+                        
+            Question: Describe the AOP gene table
+            Your response: database
+            Question: Can you tell me which molecules in the AOP database are the nastiest nasties of the bunch?
+            Your response: database
+
+        AOP database schema dictionary: {aop_dict}
+        User question: {question}
+        Classification: """
+    )
+
+
+def normalize_label(response) -> str:
+    '''
+    map the routing LLM's answer onto 'database' or 'none', the same way route() always has
+    '''
+    return 'database' if str(response).strip()[:1].lower() == 'd' else 'none'
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+class RouteClassifier():
+    '''
+    Local classifier deciding whether a chat message needs the AOP database, answering in microseconds.
+    A rule score combines schema-term matches (BM25 against the table index), explicit mentions of the
+    database and AOP-DB entity identifiers; a linear model trained on the routing log refines it when
+    available. Messages below the confidence threshold fall back to the LLM, and every decision is logged.
+
+    init params
+        table_index - TableIndex of the schema, defaults to the shared one
+        threshold - minimum confidence for skipping the LLM
+        model_path - weights saved by train_route_model, used if the file exists
+        log_path - routing log file, None to disable logging
+        shadow_rate - fraction of confident decisions also sent to the LLM, to measure agreement
+    '''
+    def __init__(self, table_index=None, threshold: float = CONFIDENCE_THRESHOLD, model_path: str = ROUTE_MODEL,
+                 log_path: str = ROUTING_LOG, shadow_rate: float = 0.0):
+        self._table_index = table_index
+        self.threshold = threshold
+        self.shadow_rate = shadow_rate
+        self.weights = None
+        if model_path is not None and os.path.exists(model_path):
+            self.weights = np.load(model_path)['weights']
+        self._log = BufferedWriter(log_path, flush_every=20) if log_path is not None else None
+        self.counts = {'fast': 0, 'llm': 0}
+        self._lock = threading.Lock()
+
+    def _get_table_index(self):
+        return self._table_index if self._table_index is not None else get_table_index()
+
+    def rule_score(self, question: str) -> float:
+        '''
+        log-odds that the question needs the database from hand-set rules
+        '''
+        ranked = self._get_table_index().rank(question, 1)
+        schema_score = ranked[0][1] if ranked else 0.0
+        # with no signal at all the classifier is unsure (p ~ 0.27) and defers to the LLM
+        z = -1.0 + 0.8 * min(schema_score, 6.0)
+        if _EXPLICIT.search(question):
+            z += 3.0
+        if _ENTITY.search(question):
+            z += 4.0
+        if _CHITCHAT.match(question):
+            z -= 4.0
+        return z
+
+    def classify(self, question: str) -> tuple:
+        '''
+        returns
+            (label, confidence) with label 'database' or 'none' and confidence in [0.5, 1]
+        '''
+        z = self.rule_score(question)
+        if self.weights is not None:
+            probability = float(_sigmoid(self.weights @ featurize(question, z)))
+        else:
+            probability = float(_sigmoid(z))
+        label = 'database' if probability >= 0.5 else 'none'
+        return label, max(probability, 1.0 - probability)
+
+    def needs_llm(self, question: str) -> bool:
+        '''
+        whether route() asks the routing LLM about question, shadow samples aside
+        '''
+        return self.classify(question)[1] < self.threshold
+
+    def _decide(self, question: str) -> tuple:
+        '''
+        returns
+            (log record, whether the routing LLM has to be asked)
+        '''
+        start = time.perf_counter()
+        label, confidence = self.classify(question)
+        elapsed = time.perf_counter() - start
+        record = {'time': time.time(), 'question': question, 'local_label': label,
+                  'confidence': round(confidence, 4), 'local_ms': round(1000 * elapsed, 4)}
+        confident = confidence >= self.threshold
+        record['source'] = 'fast' if confident else 'llm'
+        return record, not confident or np.random.random() < self.shadow_rate
+
+    def _finish(self, record: dict, llm_answer: str = None) -> str:
+        if llm_answer is not None:
+            record['llm_label'] = normalize_label(llm_answer)
+        label = record['local_label'] if record['source'] == 'fast' else record['llm_label']
+        record['label'] = label
+
+        with self._lock:
+            self.counts[record['source']] += 1
+        if self._log is not None:
+            self._log.write(json.dumps(record))
+        return label
+
+    def route(self, question: str, fallback) -> str:
+        '''
+        decide the path for a question, only calling fallback() (the routing LLM) when unsure
+        args
+            question - user message
+            fallback - function returning the LLM's routing answer
+        returns
+            'database' or 'none'
+        '''
+        record, ask = self._decide(question)
+        return self._finish(record, fallback() if ask else None)
+
+    async def aroute(self, question: str, fallback) -> str:
+        '''
+        route with fallback an async function, e.g. lambda: chain.ainvoke(...)
+        '''
+        record, ask = self._decide(question)
+        return self._finish(record, await fallback() if ask else None)
+
+
+def featurize(question: str, rule_score: float) -> np.ndarray:
+    '''
+    hashed unigram + bigram features of a question, plus the rule score and a bias term
+    '''
+    terms = tokenize(question)
+    features = np.zeros(_N_FEATURES + 2)
+    for term in terms + [a + ' ' + b for a, b in zip(terms, terms[1:])]:
+        # crc32 rather than hash(), which is salted per process
+        features[zlib.crc32(term.encode('utf-8')) % _N_FEATURES] += 1.0
+    features[:_N_FEATURES] /= max(1.0, math.sqrt(len(terms)))
+    features[_N_FEATURES] = rule_score
+    features[_N_FEATURES + 1] = 1.0
+    return features
+
+
+def read_routing_log(log_path: str = ROUTING_LOG) -> list:
+    with open(log_path) as log_file:
+        return [json.loads(line) for line in log_file if line.strip()]
+
+
+def train_route_model(log_path: str = ROUTING_LOG, model_path: str = ROUTE_MODEL, classifier: RouteClassifier = None,
+                      epochs: int = 200, learning_rate: float = 0.5, l2: float = 1e-3) -> np.ndarray:
+    '''
+    fit a logistic regression on the logged questions that have an LLM label and save its weights
+    returns
+        the weight vector
+    '''
+    classifier = classifier if classifier is not None else RouteClassifier(model_path=None, log_path=None)
+    records = [record for record in read_routing_log(log_path) if 'llm_label' in record]
+    if not records:
+        raise ValueError('No LLM-labelled routing decisions found in ' + log_path)
+    X = np.stack([featurize(record['question'], classifier.rule_score(record['question'])) for record in records])
+    y = np.array([record['llm_label'] == 'database' for record in records], dtype=float)
+
+    weights = np.zeros(X.shape[1])
+    # start from the rule score so a small log refines the rules instead of replacing them
+    weights[_N_FEATURES] = 1.0
+    for _ in range(epochs):
+        gradient = X.T @ (_sigmoid(X @ weights) - y) / len(y) + l2 * weights
+        weights -= learning_rate * gradient
+    np.savez(model_path, weights=weights)
+    return weights
+
+
+def threshold_report(log_path: str = ROUTING_LOG, thresholds=(0.6, 0.7, 0.8, 0.85, 0.9, 0.95)) -> list:
+    '''
+    for each candidate threshold, the share of logged questions that would skip the LLM and how
+    often the local label agrees with the LLM on the questions where both are known
+    '''
+    records = read_routing_log(log_path)
+    report = []
+    for threshold in thresholds:
+        fast = [record for record in records if record['confidence'] >= threshold]
+        labelled = [record for record in fast if 'llm_label' in record]
+        agreement = (sum(record['local_label'] == record['llm_label'] for record in labelled) / len(labelled)
+                     if labelled else None)
+        report.append({'threshold': threshold, 'fast_share': len(fast) / max(1, len(records)),
+                       'agreement': agreement, 'labelled': len(labelled)})
+    return report
+
+
+def route_question(question: str, llm, classifier: RouteClassifier = None) -> str:
+    '''
+    decide whether a chat message needs the AOP database
+    args
+        question - user message
+        llm - chat model asked with ROUTE_PROMPT when the local classifier is unsure
+        classifier - RouteClassifier, defaults to the shared one
+    returns
+        'database' or 'none'
+    '''
+    classifier = classifier if classifier is not None else get_route_classifier()
+    route_chain = ROUTE_PROMPT | llm | StrOutputParser()
+
+    def ask_llm():
+        # only the tables most related to the question are needed to decide whether the database is
+        # involved, and only when the local classifier is unsure
+        candidates, _ = get_table_index().select(question)
+        return route_chain.invoke({
+            'question': question,
+            'aop_dict': candidates if candidates else get_catalog().aop_info
+        })
+
+    with stage('route'):
+        return classifier.route(question, ask_llm)
+
+
+async def route_question_async(question: str, llm, classifier: RouteClassifier = None) -> str:
+    '''
+    route_question for the async pipeline, the routing LLM is awaited instead of blocking
+    '''
+    classifier = classifier if classifier is not None else get_route_classifier()
+    route_chain = ROUTE_PROMPT | llm | StrOutputParser()
+
+    async def ask_llm():
+        # the candidate tables are only needed when the local classifier is unsure
+        candidates, _ = get_table_index().select(question)
+        return await route_chain.ainvoke({
+            'question': question,
+            'aop_dict': candidates if candidates else get_catalog().aop_info
+        })
+
+    with stage('route'):
+        return await classifier.aroute(question, ask_llm)
+
+_route_classifier = None
+_route_classifier_lock = threading.Lock()
+
+def get_route_classifier() -> RouteClassifier:
+    '''
+    shared RouteClassifier for the process
+    '''
+    global _route_classifier
+    if _route_classifier is None:
+        with _route_classifier_lock:
+            if _route_classifier is None:
+                _route_classifier = RouteClassifier()
+    return _route_classifier
@@ -0,0 +1,125 @@
+import contextvars
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+# threads shared by the stage graphs of every session, each in-flight stage holds one
+STAGE_WORKERS = 32
+
+
+class StageGraph():
+    '''
+    Runs the stages of one request as a small dependency graph: a stage starts on the shared thread
+    pool as soon as the stages it depends on have finished, so independent stages run at the same
+    time. Stages may be started speculatively, before it is known whether their result is needed,
+    and cancelled once it is not; a cancelled stage never starts if it was still waiting, its result
+    is dropped otherwise, and the stages depending on it are cancelled too.
+
+    Every stage runs in a copy of the caller's context, so stage timings and the langfuse trace of
+    the request carry over to the worker threads.
+
+    init params
+        executor - concurrent.futures executor, defaults to the shared stage pool
+    '''
+    def __init__(self, executor=None):
+        self._executor = executor if executor is not None else get_stage_executor()
+        self._stages = {}
+        self._futures = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, fn, after: tuple = ()):
+        '''
+        add a stage, fn is called with the results of the after stages in that order
+        '''
+        if name in self._stages:
+            raise ValueError('Stage ' + name + ' was already added')
+        for dependency in after:
+            if dependency not in self._stages:
+                raise ValueError('Stage ' + name + ' depends on ' + dependency + ', which has not been added')
+        self._stages[name] = (fn, tuple(after))
+        return self
+
+    def start(self):
+        '''
+        start every stage whose dependencies are met, the others follow as their dependencies finish
+        '''
+        for name in self._stages:
+            self._futures[name] = Future()
+        for name, (_, after) in self._stages.items():
+            self._when_ready(name, after, contextvars.copy_context())
+        return self
+
+    def _when_ready(self, name, after, context):
+        remaining = [len(after)]
+
+        def dependency_done(_):
+            with self._lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                self._submit(name, context)
+
+        if not after:
+            self._submit(name, context)
+        for dependency in after:
+            self._futures[dependency].add_done_callback(dependency_done)
+
+    def _submit(self, name, context):
+        fn, after = self._stages[name]
+        future = self._futures[name]
+        dependencies = [self._futures[dependency] for dependency in after]
+        if any(dependency.cancelled() or dependency.exception() is not None for dependency in dependencies):
+            # a stage cannot run without the results it depends on
+            future.cancel()
+            return
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = context.run(fn, *[dependency.result() for dependency in dependencies])
+            except BaseException as exc:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+        self._executor.submit(run)
+
+    def cancel(self, name: str) -> bool:
+        '''
+        drop a stage that turned out not to be needed, along with the stages depending on it
+        returns
+            True if the stage had not started yet and will never run
+        '''
+        with self._lock:
+            self._cancelled.add(name)
+        for other, (_, after) in self._stages.items():
+            if name in after:
+                self.cancel(other)
+        return self._futures[name].cancel()
+
+    def result(self, name: str, timeout: float = None):
+        '''
+        wait for a stage and return its result, re-raising its exception
+        '''
+        if name in self._cancelled:
+            raise CancelledError('Stage ' + name + ' was cancelled')
+        return self._futures[name].result(timeout)
+
+    def done(self, name: str) -> bool:
+        return self._futures[name].done()
+
+
+_stage_executor = None
+_stage_executor_lock = threading.Lock()
+
+def get_stage_executor() -> ThreadPoolExecutor:
+    '''
+    thread pool shared by every StageGraph of the process
+    '''
+    global _stage_executor
+    if _stage_executor is None:
+        with _stage_executor_lock:
+            if _stage_executor is None:
+                _stage_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix='llmao-stage')
+    return _stage_executor
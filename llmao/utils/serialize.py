@@ -0,0 +1,117 @@
+from collections import Counter
+
+# approximate number of prompt tokens a serialized result may take
+TOKEN_BUDGET = 1500
+
+# longer cell values are cut, free-text columns such as abstracts would otherwise dominate the budget
+MAX_CELL = 80
+
+# most frequent values listed per column in the summary of rows that did not fit
+TOP_N = 3
+
+
+def approx_tokens(text: str) -> int:
+    # roughly 4 characters per token for English text and identifiers
+    return len(text) // 4
+
+
+def _cell(value, max_cell: int = MAX_CELL) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, float):
+        value = '%.6g' % value
+    text = ' '.join(str(value).split()).replace('|', '/')
+    return text if len(text) <= max_cell else text[:max_cell - 1] + '…'
+
+
+def _column_summary(name: str, values: list, top_n: int = TOP_N) -> str:
+    present = [value for value in values if value is not None]
+    if not present:
+        return name + ': all NULL'
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return '%s: %d distinct, range %s to %s' % (name, len(set(present)), _cell(min(present)), _cell(max(present)))
+    counts = Counter(_cell(value, 40) for value in present)
+    if counts.most_common(1)[0][1] == 1:
+        return '%s: %d distinct, e.g. %s' % (name, len(counts), ', '.join(list(counts)[:top_n]))
+    top = ', '.join('%s (%d)' % item for item in counts.most_common(top_n))
+    return '%s: %d distinct, top %s' % (name, len(counts), top)
+
+
+def _render(columns: list, rows: list, style: str) -> list:
+    if style == 'markdown':
+        lines = ['| ' + ' | '.join(columns) + ' |', '|' + '---|' * len(columns)]
+        return lines + ['| ' + ' | '.join(row) + ' |' for row in rows]
+    # one line per column, rows in the same order in every line
+    return [column + ': ' + ' | '.join(row[i] for row in rows) for i, column in enumerate(columns)]
+
+
+def serialize_result(result, columns: list = None, token_budget: int = TOKEN_BUDGET, style: str = 'markdown',
+                     max_cell: int = MAX_CELL) -> str:
+    '''
+    write a query result compactly for a prompt: column headers are kept, columns holding a single
+    value are stated once, repeated rows are merged with a count and the rows that do not fit the
+    token budget are summarized per column (distinct values, top values or numeric range)
+    args
+        result - QueryResult, list of row tuples, or a message string which is returned unchanged
+        columns - column names when result is a plain list
+        token_budget - approximate token limit of the returned text
+        style - 'markdown' for a table, 'columnar' for one line per column
+        max_cell - longest cell text before it is cut
+    returns
+        text for the prompt
+    '''
+    if isinstance(result, str):
+        return result
+    if style not in ('markdown', 'columnar'):
+        raise ValueError("style must be 'markdown' or 'columnar'")
+    truncated = getattr(result, 'truncated', False)
+    if hasattr(result, 'rows'):
+        columns = columns or result.columns
+        result = result.rows
+    rows = [tuple(row) for row in result]
+    if not rows:
+        return '(no rows)'
+    width = len(rows[0])
+    columns = list(columns) if columns else ['col%d' % (i + 1) for i in range(width)]
+
+    lines = []
+    # a column with the same value in every row is stated once instead of on every line
+    constant = [i for i in range(width) if len(rows) > 1 and len({row[i] for row in rows}) == 1]
+    for i in constant:
+        lines.append('%s = %s (every row)' % (columns[i], _cell(rows[0][i], max_cell)))
+    kept = [i for i in range(width) if i not in constant] or list(range(width))
+    header = [columns[i] for i in kept]
+
+    # identical rows are merged, first occurrence order is preserved
+    counts = Counter(rows)
+    distinct = list(dict.fromkeys(rows))
+    merged = len(distinct) < len(rows)
+    if merged:
+        header = header + ['n']
+    cells = [[_cell(row[i], max_cell) for i in kept] + ([str(counts[row])] if merged else []) for row in distinct]
+
+    def summary(start):
+        rest = [row for row in distinct[start:] for _ in range(counts[row])]
+        return (['... %d more rows not shown, summary:' % len(rest)]
+                + ['  ' + _column_summary(columns[i], [row[i] for row in rest]) for i in kept])
+
+    # add rows while they fit, leaving room for a summary of the rest (as long as one of all rows)
+    used = approx_tokens('\n'.join(lines + _render(header, [], style))) + 8
+    reserve = approx_tokens('\n'.join(summary(0))) if approx_tokens(str(cells)) > token_budget else 0
+    shown = 0
+    for row in cells:
+        cost = approx_tokens(' | '.join(row)) + len(row) // 2 + 1
+        if shown and used + cost > token_budget - reserve:
+            break
+        used += cost
+        shown += 1
+    lines += _render(header, cells[:shown], style)
+    if shown < len(distinct):
+        lines += summary(shown)
+    lines.append('(%d rows%s)' % (len(rows), ', the query returned more rows than were fetched' if truncated else ''))
+
+    text = '\n'.join(lines)
+    if approx_tokens(text) > token_budget:
+        # a single row wider than the budget, only the summary lines can be cut further
+        text = text[:4 * token_budget - 1] + '…'
+    return text
@@ -0,0 +1,53 @@
+import atexit
+import threading
+import time
+
+
+class BufferedWriter():
+    '''
+    Thread-safe append-only text sink: lines are buffered in memory and written with one file open
+    per batch instead of one per record. Buffered lines are flushed on interpreter exit.
+
+    init params
+        path - file to append to
+        flush_every - number of buffered lines that triggers a write
+        flush_interval - seconds after which buffered lines are written on the next append
+    '''
+    def __init__(self, path: str, flush_every: int = 50, flush_interval: float = 10.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._lines = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def write(self, line: str):
+        '''
+        buffer one line, the newline is added here
+        '''
+        with self._lock:
+            self._lines.append(line + '\n')
+            due = (len(self._lines) >= self.flush_every
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+            self._last_flush = time.monotonic()
+            if not lines:
+                return
+            # written under the lock so batches from different threads never interleave
+            try:
+                with open(self.path, 'a') as sink_file:
+                    sink_file.writelines(lines)
+                self.written += len(lines)
+            except OSError:
+                # keep the lines for the next attempt rather than losing them
+                self._lines = lines + self._lines
+
+    def __len__(self):
+        return len(self._lines)
@@ -0,0 +1,35 @@
+def tee_stream(chunks, on_complete=()):
+    '''
+    pass a token stream straight through to the caller while buffering the full text
+    args
+        chunks - iterable of str chunks, e.g. chain.stream(...)
+        on_complete - functions called with the full text once the stream is exhausted
+    yields
+        the chunks, unchanged
+    '''
+    buffer = []
+    for chunk in chunks:
+        buffer.append(chunk)
+        yield chunk
+    # only post-process complete answers, a stream abandoned halfway never reaches this point
+    text = ''.join(buffer)
+    for callback in on_complete:
+        callback(text)
+
+
+async def atee_stream(chunks, on_complete=()):
+    '''
+    tee_stream for async token streams, e.g. chain.astream(...)
+    args
+        chunks - async iterable of str chunks
+        on_complete - functions called with the full text once the stream is exhausted
+    yields
+        the chunks, unchanged
+    '''
+    buffer = []
+    async for chunk in chunks:
+        buffer.append(chunk)
+        yield chunk
+    text = ''.join(buffer)
+    for callback in on_complete:
+        callback(text)
@@ -0,0 +1,414 @@
+'''
+Materialized summary tables over the most common join paths of AOP-DB
+
+Questions about chemicals, genes, pathways, diseases and AOPs mostly walk the same few chains of
+tables, e.g. chemical_info -> chemical_gene -> gene_info -> gene_pathway, and the generated SQL
+repeats those joins over the large interaction tables for every question. The build step runs each
+join once, offline, and stores it in a sidecar database next to AOP-DB (which stays read-only):
+
+    mv_<name>           the join denormalized, one row per joined row, with its key and name columns indexed
+    mv_<name>_counts    one row per row of the first table of the path with the number of distinct keys
+                        of every other table it reaches, for "how many ..." questions
+
+The join paths come from a json config or from the joins found most often in the query log. The
+connection pool attaches the sidecar as schema 'mv', the schema catalog lists its tables and the SQL
+generation prompt describes the ones covering the selected tables, so that
+
+    SELECT DISTINCT PathwayName FROM mv_chemical_gene_pathway WHERE ChemicalName = 'chlorobenzene'
+
+replaces a four-way join.
+
+usage (from the llmao/ directory)
+    python -m utils.summaries                                   # paths joined most often in ./data/query_log.jsonl
+    python -m utils.summaries --config summaries.json           # [{"tables": ["chemical_info", ...]}, ...]
+    python -m utils.summaries --paths chemical_info,chemical_gene,gene_info,gene_pathway aop_info,event_info
+'''
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from utils.catalog import DB_NAME, SchemaCatalog, get_catalog
+
+# schema name the sidecar is attached under
+SCHEMA = 'mv'
+
+# joins seen fewer times than this in the query log are not worth materializing
+MIN_JOIN_COUNT = 2
+
+# most summaries built from the query log
+MAX_SUMMARIES = 5
+
+# text columns longer than this on average (abstracts, definitions) are left out of the joins by
+# default, they would be copied once per joined row
+MAX_AVERAGE_LENGTH = 100
+
+# identifier columns: the keys counted per summary and indexed
+_KEY = re.compile(r'(?i:(^|_)id$)|[a-z0-9](ID|Id)$')
+
+# columns questions look rows up by, indexed besides the keys
+_LOOKUP = re.compile(r'(?i)(name|symbol|title)$')
+
+
+def summaries_path(db_name: str = DB_NAME) -> str:
+    return db_name + '.mv.db'
+
+
+def summary_table(name: str) -> str:
+    return 'mv_' + name
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def summary_name(tables: list) -> str:
+    '''
+    short name of a join path from the leading words of its tables, e.g.
+    [chemical_info, chemical_gene, gene_info, gene_pathway] -> chemical_gene_pathway
+    '''
+    words = []
+    for table in tables:
+        for word in table.lower().split('_')[:2]:
+            if word not in words and word not in ('info', 'data'):
+                words.append(word)
+    return '_'.join(words)
+
+
+def find_join(catalog: SchemaCatalog, table: str, previous: list) -> tuple:
+    '''
+    how table joins one of the tables already in a path: a foreign key in either direction,
+    otherwise an identifier column of the same name
+    returns
+        (previous table, its column, column of table), None if it joins none of them
+    '''
+    for key in catalog.foreign_keys(table):
+        if key['ref_table'] in previous:
+            return key['ref_table'], key['ref_column'] or key['column'], key['column']
+    for other in previous:
+        for key in catalog.foreign_keys(other):
+            if key['ref_table'] == table:
+                return other, key['column'], key['ref_column'] or key['column']
+    for other in previous:
+        shared = [column for column in catalog.columns(table) if _KEY.search(column) and column in catalog.columns(other)]
+        if shared:
+            return other, shared[0], shared[0]
+    return None
+
+
+def order_path(tables: list, catalog: SchemaCatalog) -> list:
+    '''
+    order tables so that every table joins one before it, starting from the given first table
+    returns
+        the ordered tables, None when they are not connected
+    '''
+    path, remaining = [tables[0]], list(tables[1:])
+    while remaining:
+        table = next((table for table in remaining if find_join(catalog, table, path) is not None), None)
+        if table is None:
+            return None
+        path.append(table)
+        remaining.remove(table)
+    return path
+
+
+def _first_table(tables: set, catalog: SchemaCatalog) -> str:
+    # the path starts at an end of the join graph, preferring a table with a primary key (chemical_info
+    # rather than gene_pathway), so its counts table has one row per entity
+    def ends(table):
+        return sum(find_join(catalog, table, [other]) is not None for other in tables if other != table) <= 1
+
+    return sorted(tables, key=lambda table: (not ends(table), not primary_key(catalog, table), table))[0]
+
+
+def specs_from_log(log_path: str = None, catalog: SchemaCatalog = None, min_count: int = MIN_JOIN_COUNT,
+                   limit: int = MAX_SUMMARIES) -> list:
+    '''
+    the join paths to materialize, the sets of tables joined together most often in the query log
+    returns
+        [{'tables': [...], 'counts': bool}] most frequent first; counts when some of the queries count rows
+    '''
+    # utils.execution imports the connection pool, which attaches the sidecar built here
+    from utils.execution import QUERY_LOG, table_aliases
+    from utils.index_advisor import read_query_log
+    catalog = catalog if catalog is not None else get_catalog()
+    joins, counted, elapsed = Counter(), set(), Counter()
+    for record in read_query_log(log_path if log_path is not None else QUERY_LOG):
+        tables = frozenset(table for table in table_aliases(record['query']).values() if table in catalog.tables)
+        if len(tables) < 2:
+            continue
+        joins[tables] += 1
+        elapsed[tables] += record.get('elapsed', 0.0)
+        if re.search(r'\bCOUNT\s*\(', record['query'], re.IGNORECASE):
+            counted.add(tables)
+
+    specs = []
+    for tables, count in sorted(joins.items(), key=lambda item: (-item[1], -elapsed[item[0]], sorted(item[0]))):
+        if count < min_count or len(specs) == limit:
+            break
+        first = _first_table(tables, catalog)
+        path = order_path([first] + sorted(tables - {first}), catalog)
+        if path is not None:
+            specs.append({'tables': path, 'counts': tables in counted})
+    return specs
+
+
+def read_config(config_path: str) -> list:
+    '''
+    join paths from a json file, [{'tables': [...], 'name', 'columns': ['table.column', ...], 'counts'}, ...]
+    where everything but tables is optional
+    '''
+    with open(config_path) as config_file:
+        return json.load(config_file)
+
+
+def _average_length(connection, table: str, column: str, sample: int = 1000) -> float:
+    average = connection.execute('SELECT AVG(LENGTH(v)) FROM (SELECT ' + _quote(column) + ' AS v FROM aopdb.' +
+                                 _quote(table) + ' WHERE v IS NOT NULL LIMIT ?);', (sample,)).fetchone()[0]
+    return average or 0.0
+
+
+def resolve_spec(spec: dict, catalog: SchemaCatalog, connection) -> dict:
+    '''
+    fill in the joins, columns and keys of a join path
+    args
+        spec - {'tables': [...]} and optionally 'name', 'columns' ['table.column', ...] and 'counts'
+        connection - sqlite connection with AOP-DB attached as aopdb, to sample column lengths
+    returns
+        {'name', 'tables', 'joins': [(table, column, table, column)], 'columns': [(table, column, output name)],
+         'keys': {table: output name of its key column}, 'counts'}
+    '''
+    tables = order_path(list(spec['tables']), catalog)
+    if tables is None:
+        raise ValueError('Tables ' + ', '.join(spec['tables']) + ' do not form a join path')
+    joins, joined = [], {table: set() for table in tables}
+    for i, table in enumerate(tables[1:], 1):
+        other, other_column, column = find_join(catalog, table, tables[:i])
+        joins.append((other, other_column, table, column))
+        joined[other].add(other_column)
+        joined[table].add(column)
+
+    # the right side of a join repeats the left side's column
+    repeated = {(table, column) for _, _, table, column in joins}
+    if spec.get('columns'):
+        selected = [tuple(name.split('.', 1)) for name in spec['columns']]
+    else:
+        selected = []
+        for table in tables:
+            types = catalog.column_types(table)
+            for column in catalog.columns(table):
+                text = any(affinity in (types[column] or 'TEXT').upper() for affinity in ('CHAR', 'CLOB', 'TEXT'))
+                if (table, column) in repeated or (text and not _KEY.search(column)
+                                                   and _average_length(connection, table, column) > MAX_AVERAGE_LENGTH):
+                    continue
+                selected.append((table, column))
+    columns, names = [], set()
+    for table, column in selected:
+        name = column if column.lower() not in names else table + '_' + column
+        names.add(name.lower())
+        columns.append((table, column, name))
+
+    keys = {}
+    for table in tables:
+        primary = primary_key(catalog, table)
+        # link tables like chemical_gene only hold the keys of the tables they join, they have none of their own
+        candidates = primary if len(primary) == 1 else [column for column in catalog.columns(table)
+                                                        if _KEY.search(column) and column not in joined[table]]
+        if candidates:
+            keys[table] = candidates[0]
+    return {'name': spec.get('name') or summary_name(tables), 'tables': tables, 'joins': joins, 'columns': columns,
+            'keys': keys, 'grouped': len(primary_key(catalog, tables[0])) == 1, 'counts': spec.get('counts', True)}
+
+
+def primary_key(catalog: SchemaCatalog, table: str) -> list:
+    return [column['name'] for column in catalog.tables[table]['columns'] if column['pk']]
+
+
+def _from_clause(resolved: dict, join: str = 'JOIN') -> str:
+    tables = resolved['tables']
+    clause = 'FROM aopdb.' + _quote(tables[0]) + ' AS t0'
+    alias = {table: 't' + str(i) for i, table in enumerate(tables)}
+    for other, other_column, table, column in resolved['joins']:
+        clause += (' ' + join + ' aopdb.' + _quote(table) + ' AS ' + alias[table] + ' ON ' + alias[table] + '.' +
+                   _quote(column) + ' = ' + alias[other] + '.' + _quote(other_column))
+    return clause
+
+
+def summary_queries(resolved: dict) -> dict:
+    '''
+    the CREATE TABLE ... AS SELECT statements of a resolved join path
+    returns
+        {summary table: (statement, [columns to index])}
+    '''
+    alias = {table: 't' + str(i) for i, table in enumerate(resolved['tables'])}
+    name = summary_table(resolved['name'])
+    outputs = [output for _, _, output in resolved['columns']]
+    queries = {name: ('CREATE TABLE ' + _quote(name) + ' AS SELECT ' +
+                      ', '.join(alias[table] + '.' + _quote(column) + ' AS ' + _quote(output)
+                                for table, column, output in resolved['columns']) + ' ' + _from_clause(resolved) + ';',
+                      [output for output in outputs if _KEY.search(output) or _LOOKUP.search(output)])}
+
+    first, keys = resolved['tables'][0], resolved['keys']
+    counted = [table for table in resolved['tables'][1:] if table in keys]
+    if not resolved['counts'] or first not in keys or not counted:
+        return queries
+    # with a primary key every column of the first table is determined by it, otherwise only the key is kept
+    group = [(column, output) for table, column, output in resolved['columns']
+             if table == first and (resolved['grouped'] or column == keys[first])]
+    if keys[first] not in [column for column, _ in group]:
+        group.insert(0, (keys[first], keys[first]))
+    names = {output.lower() for _, output in group}
+    counts = []
+    for table in counted:
+        count = keys[table] + '_count'
+        count = count if count.lower() not in names else table + '_' + count
+        names.add(count.lower())
+        counts.append('COUNT(DISTINCT ' + alias[table] + '.' + _quote(keys[table]) + ') AS ' + _quote(count))
+    # every row of the first table, including those reaching nothing (a count of 0)
+    queries[name + '_counts'] = ('CREATE TABLE ' + _quote(name + '_counts') + ' AS SELECT ' +
+                                 ', '.join('t0.' + _quote(column) + ' AS ' + _quote(output) for column, output in group) +
+                                 ', ' + ', '.join(counts) + ' ' + _from_clause(resolved, 'LEFT JOIN') +
+                                 ' GROUP BY t0.' + _quote(keys[first]) + ';',
+                                 [output for _, output in group if _KEY.search(output) or _LOOKUP.search(output)])
+    return queries
+
+
+def build_summaries(db_name: str = DB_NAME, out_name: str = None, specs: list = None, catalog: SchemaCatalog = None,
+                    log_path: str = None) -> dict:
+    '''
+    build the sidecar of summary tables, written to a temporary file and moved into place once complete
+    args
+        db_name - path to AOP-DB
+        out_name - sidecar path, defaults to <db_name>.mv.db
+        specs - join paths [{'tables': [...], ...}], see resolve_spec; defaults to specs_from_log
+        catalog - SchemaCatalog of db_name, defaults to the shared one
+        log_path - query log the default specs are taken from
+    returns
+        manifest {summary table: {'kind', 'tables', 'columns', 'rows', 'seconds'}}
+    '''
+    out_name = out_name if out_name is not None else summaries_path(db_name)
+    catalog = catalog if catalog is not None else get_catalog(db_name)
+    specs = specs if specs is not None else specs_from_log(log_path, catalog)
+
+    tmp_name = out_name + '.' + str(os.getpid()) + '.tmp'
+    if os.path.exists(tmp_name):
+        os.remove(tmp_name)
+    connection = sqlite3.connect('file:' + tmp_name, uri=True)
+    connection.execute('ATTACH DATABASE ? AS aopdb;', ('file:' + db_name + '?mode=ro',))
+    manifest = {}
+    try:
+        connection.execute('PRAGMA journal_mode = OFF;')
+        connection.execute('PRAGMA synchronous = OFF;')
+        connection.execute('CREATE TABLE mv_manifest (summary_table TEXT PRIMARY KEY, kind TEXT, tables TEXT, '
+                           'columns TEXT, row_count INTEGER, catalog_version TEXT);')
+        for spec in specs:
+            resolved = resolve_spec(spec, catalog, connection)
+            for name, (statement, indexed) in summary_queries(resolved).items():
+                start = time.perf_counter()
+                connection.execute(statement)
+                for column in indexed:
+                    connection.execute('CREATE INDEX ' + _quote('idx_' + name + '_' + column) + ' ON ' + _quote(name) +
+                                       ' (' + _quote(column) + ');')
+                rows = connection.execute('SELECT COUNT(*) FROM ' + _quote(name) + ';').fetchone()[0]
+                columns = [row[1] for row in connection.execute('SELECT * FROM pragma_table_info(?);', (name,))]
+                kind = 'counts' if name.endswith('_counts') else 'join'
+                connection.execute('INSERT INTO mv_manifest VALUES (?, ?, ?, ?, ?, ?);',
+                                   (name, kind, json.dumps(resolved['tables']), json.dumps(columns), rows, catalog.version))
+                connection.commit()
+                manifest[name] = {'kind': kind, 'tables': resolved['tables'], 'columns': columns, 'rows': rows,
+                                  'seconds': time.perf_counter() - start}
+        # statistics for the planner, so lookups pick the right index
+        connection.execute('ANALYZE main;')
+        connection.commit()
+        connection.execute('DETACH DATABASE aopdb;')
+    finally:
+        connection.close()
+    os.replace(tmp_name, out_name)
+    return manifest
+
+
+def read_manifest(out_name: str, catalog_version: str = None) -> dict:
+    '''
+    the summary tables of a sidecar, {summary table: {'kind', 'tables', 'columns', 'rows'}}; empty when the
+    sidecar is missing or was built from another version of the database (its rows would be stale)
+    '''
+    if not os.path.exists(out_name):
+        return {}
+    connection = sqlite3.connect('file:' + out_name + '?mode=ro', uri=True)
+    try:
+        records = connection.execute('SELECT summary_table, kind, tables, columns, row_count, catalog_version '
+                                     'FROM mv_manifest;').fetchall()
+    except sqlite3.Error:
+        return {}
+    finally:
+        connection.close()
+    if catalog_version is not None and any(record[5] != catalog_version for record in records):
+        return {}
+    return {name: {'kind': kind, 'tables': json.loads(tables), 'columns': json.loads(columns), 'rows': rows}
+            for name, kind, tables, columns, rows, _ in records}
+
+
+def describe_summaries(manifest: dict, table_dict: str = None) -> str:
+    '''
+    paragraph telling the SQL generation prompt which summary tables cover the selected tables
+    args
+        table_dict - text naming the tables selected for the question, as returned by AOP_route; a
+                     summary is described when it joins at least two of them, every summary when None
+    '''
+    def selected(table):
+        # whole names only, gene_info is not selected by chemical_gene_info
+        return re.search(r'(?<!\w)' + re.escape(table) + r'(?!\w)', table_dict) is not None
+
+    covering = {name: entry for name, entry in manifest.items()
+                if table_dict is None or sum(selected(table) for table in entry['tables']) >= 2}
+    if not covering:
+        return ''
+    lines = ['Precomputed summary tables are available, use them instead of joining the tables they were built '
+             'from whenever they have the columns needed:']
+    for name, entry in sorted(covering.items()):
+        if entry['kind'] == 'counts':
+            counts = [column for column in entry['columns'] if column.endswith('_count')]
+            lines.append('    %s(%s) has one row per %s row with the number of distinct %s it reaches, for "how many" '
+                         'questions' % (name, ', '.join(entry['columns']), entry['tables'][0],
+                                        ', '.join(column[:-len('_count')] for column in counts)))
+        else:
+            lines.append('    %s(%s) is %s joined' % (name, ', '.join(entry['columns']), ' + '.join(entry['tables'])))
+    return '\n'.join(lines)
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def get_summary_tables(db_name: str = DB_NAME) -> dict:
+    '''
+    manifest of the current summary sidecar of db_name, read once per catalog version
+    '''
+    version = get_catalog(db_name).version
+    key = (db_name, version)
+    if key not in _manifests:
+        with _manifests_lock:
+            if key not in _manifests:
+                _manifests[key] = read_manifest(summaries_path(db_name), version)
+    return _manifests[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_NAME, help='path to the AOP database')
+    parser.add_argument('--out', help='sidecar path, defaults to <db>.mv.db')
+    parser.add_argument('--config', help='json file of join paths')
+    parser.add_argument('--paths', nargs='*', help='join paths as comma separated tables')
+    parser.add_argument('--log', help='query log to take the most frequent joins from, defaults to ./data/query_log.jsonl')
+    args = parser.parse_args()
+
+    specs = None
+    if args.config:
+        specs = read_config(args.config)
+    elif args.paths:
+        specs = [{'tables': path.split(',')} for path in args.paths]
+    catalog = SchemaCatalog(args.db)
+    for name, entry in build_summaries(args.db, args.out, specs, catalog, args.log).items():
+        print('%s: %s, %d rows in %.1f s' % (name, ' + '.join(entry['tables']), entry['rows'], entry['seconds']))
@@ -0,0 +1,130 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from utils.catalog import get_catalog
+
+# words that carry no information about which table a question needs
+STOPWORDS = {
+    'a', 'an', 'the', 'of', 'in', 'on', 'for', 'to', 'and', 'or', 'is', 'are', 'was', 'be', 'by', 'with',
+    'what', 'which', 'who', 'how', 'many', 'much', 'does', 'do', 'did', 'can', 'could', 'you', 'me', 'my',
+    'i', 'it', 'its', 'that', 'this', 'these', 'those', 'there', 'from', 'about', 'tell', 'show', 'list',
+    'give', 'find', 'look', 'up', 'all', 'any', 'some', 'database', 'aop', 'db', 'table', 'tables', 'please',
+}
+
+
+def tokenize(text: str) -> list:
+    '''
+    split identifiers and questions into comparable terms: camelCase and snake_case are split,
+    everything is lower-cased and a plural 's' is dropped
+    '''
+    text = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', str(text))
+    text = re.sub(r'([A-Z]+)([A-Z][a-z])', r'\1 \2', text)
+    terms = []
+    for word in re.findall(r'[a-z0-9]+', text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+class TableIndex():
+    '''
+    BM25 inverted index over AOP-DB tables, each table being a document made of its name,
+    column names and optional column descriptions and sample values. Ranks the candidate
+    tables for a question in well under a millisecond, so only the best few need to be shown
+    to the LLM (or none, when one table clearly wins).
+
+    init params
+        aop_info - schema dictionary {'table': [column1, column2, ...]}
+        descriptions - optional {'table': {'column': 'description'}}
+        samples - optional {'table': {'column': [value, ...]}}
+        k1, b - BM25 parameters
+        table_weight - how many times the table name terms are counted
+    '''
+    def __init__(self, aop_info: dict, descriptions: dict = None, samples: dict = None,
+                 k1: float = 1.2, b: float = 0.75, table_weight: int = 3):
+        self.aop_info = aop_info
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)
+        self._lengths = {}
+        descriptions = descriptions or {}
+        samples = samples or {}
+
+        for table, columns in aop_info.items():
+            terms = tokenize(table) * table_weight
+            for column in columns:
+                if column is None:
+                    continue
+                terms += tokenize(column)
+                terms += tokenize(descriptions.get(table, {}).get(column, ''))
+                for value in samples.get(table, {}).get(column, []):
+                    terms += tokenize(value)
+            self._lengths[table] = len(terms)
+            for term, count in Counter(terms).items():
+                self._postings[term][table] = count
+
+        self._average_length = sum(self._lengths.values()) / max(1, len(self._lengths))
+        n_tables = len(self._lengths)
+        self._idf = {term: math.log(1 + (n_tables - len(postings) + 0.5) / (len(postings) + 0.5))
+                     for term, postings in self._postings.items()}
+
+    def rank(self, question: str, k: int = None) -> list:
+        '''
+        returns
+            [(table, score), ...] for the tables sharing at least one term with the question, best first
+        '''
+        scores = defaultdict(float)
+        for term in set(tokenize(question)):
+            for table, count in self._postings.get(term, {}).items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[table] / self._average_length)
+                scores[table] += self._idf[term] * count * (self.k1 + 1) / (count + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:k] if k is not None else ranked
+
+    def select(self, question: str, top_k: int = 5, margin: float = 2.0) -> tuple:
+        '''
+        choose the tables to show the LLM for a question
+        args
+            top_k - number of candidate tables to keep
+            margin - the best table is decisive when it scores at least margin times the runner-up
+        returns
+            (table_dict of the candidates, decisive), table_dict is empty when nothing matched; when
+            decisive it holds the best table, and the runner-up too when the two share a join key
+        '''
+        ranked = self.rank(question, top_k)
+        decisive = len(ranked) == 1 or (len(ranked) > 1 and ranked[0][1] >= margin * ranked[1][1])
+        if ranked and decisive:
+            # "genes of chemical X" scores chemical_gene far above gene_info, but needs both for the gene names
+            best = ranked[0][0]
+            ranked = [(table, score) for table, score in ranked[:2] if table == best or self.join_keys(best, table)]
+        table_dict = {table: self.aop_info[table] for table, _ in ranked}
+        return table_dict, bool(ranked) and decisive
+
+    def join_keys(self, table: str, other: str) -> list:
+        '''
+        columns two tables have in common, the ones they are joined on
+        '''
+        columns = {column.lower() for column in self.aop_info[other] if column is not None}
+        return [column for column in self.aop_info[table] if column is not None and column.lower() in columns]
+
+
+_table_index = None
+_table_index_version = None
+_table_index_lock = threading.Lock()
+
+def get_table_index() -> TableIndex:
+    '''
+    TableIndex over the shared schema catalog, rebuilt when the catalog version changes
+    '''
+    global _table_index, _table_index_version
+    catalog = get_catalog()
+    if _table_index is None or _table_index_version != catalog.version:
+        with _table_index_lock:
+            if _table_index is None or _table_index_version != catalog.version:
+                _table_index = TableIndex(catalog.aop_info)
+                _table_index_version = catalog.version
+    return _table_index
@@ -0,0 +1,321 @@
+import atexit
+import contextvars
+import functools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# prometheus text file written by start_metrics_dump, e.g. for node_exporter's textfile collector
+METRICS_PATH = './data/stage_metrics.prom'
+
+# quantiles exported per stage
+QUANTILES = (0.5, 0.95, 0.99)
+
+# innermost stage running in the current context, e.g. 'sql_generation'
+_current_stage = contextvars.ContextVar('llmao_stage', default=None)
+
+# {stage: [seconds, ...]} of the innermost collect() block, None outside of one
+_collector = contextvars.ContextVar('llmao_stage_timings', default=None)
+
+
+class LatencyHistogram():
+    '''
+    HDR-style log-linear histogram of durations: each power of two above min_value is split into
+    sub_buckets linear buckets, so percentiles are known to within 1/sub_buckets relative error in
+    constant memory however many values are recorded.
+
+    init params
+        sub_buckets - linear buckets per power of two
+        min_value - smallest distinguishable duration in seconds
+    '''
+    def __init__(self, sub_buckets: int = 32, min_value: float = 1e-6):
+        self.sub_buckets = sub_buckets
+        self.min_value = min_value
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self._counts = {}
+
+    def record(self, seconds: float):
+        units = max(seconds / self.min_value, 1.0)
+        exponent = int(math.log2(units))
+        sub = min(self.sub_buckets - 1, int((units / 2 ** exponent - 1.0) * self.sub_buckets))
+        index = exponent * self.sub_buckets + sub
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def _value(self, index: int) -> float:
+        exponent, sub = divmod(index, self.sub_buckets)
+        # middle of the bucket
+        return self.min_value * 2 ** exponent * (1.0 + (sub + 0.5) / self.sub_buckets)
+
+    def percentile(self, q: float) -> float:
+        '''
+        q-th percentile (0-100) of the recorded durations, nan when empty
+        '''
+        if not self.count:
+            return float('nan')
+        target = max(1, math.ceil(q / 100.0 * self.count))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= target:
+                return min(self.max, max(self.min, self._value(index)))
+        return self.max
+
+
+class StageMetrics():
+    '''
+    Per-stage latency histograms plus retry and failure counters for the whole process, exported
+    as a dict or in the Prometheus text format.
+    '''
+    def __init__(self, sub_buckets: int = 32):
+        self.sub_buckets = sub_buckets
+        self._histograms = {}
+        self._failures = {}
+        self._retries = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = LatencyHistogram(self.sub_buckets)
+            self._histograms[name].record(seconds)
+
+    def failure(self, name: str):
+        with self._lock:
+            self._failures[name] = self._failures.get(name, 0) + 1
+
+    def retry(self, name: str):
+        with self._lock:
+            self._retries[name] = self._retries.get(name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._histograms, self._failures, self._retries = {}, {}, {}
+
+    def snapshot(self) -> dict:
+        '''
+        {stage: {'count', 'sum', 'p50', 'p95', 'p99', 'max', 'failures', 'retries'}}
+        '''
+        with self._lock:
+            names = sorted(set(self._histograms) | set(self._failures) | set(self._retries))
+            snapshot = {}
+            for name in names:
+                histogram = self._histograms.get(name, LatencyHistogram(self.sub_buckets))
+                entry = {'count': histogram.count, 'sum': histogram.sum, 'max': histogram.max,
+                         'failures': self._failures.get(name, 0), 'retries': self._retries.get(name, 0)}
+                for quantile in QUANTILES:
+                    entry['p%d' % round(100 * quantile)] = histogram.percentile(100 * quantile)
+                snapshot[name] = entry
+            return snapshot
+
+    def prometheus_text(self) -> str:
+        '''
+        the metrics in the Prometheus text exposition format
+        '''
+        snapshot = self.snapshot()
+        lines = ['# HELP llmao_stage_seconds Wall time of each LLMao pipeline stage.',
+                 '# TYPE llmao_stage_seconds summary']
+        for name, entry in snapshot.items():
+            if not entry['count']:
+                continue
+            for quantile in QUANTILES:
+                lines.append('llmao_stage_seconds{stage="%s",quantile="%s"} %.6g'
+                             % (name, quantile, entry['p%d' % round(100 * quantile)]))
+            lines.append('llmao_stage_seconds_sum{stage="%s"} %.6g' % (name, entry['sum']))
+            lines.append('llmao_stage_seconds_count{stage="%s"} %d' % (name, entry['count']))
+        for counter, help_text in (('failures', 'Stage runs that raised an exception.'),
+                                   ('retries', 'Stage runs repeated after a failure.')):
+            lines += ['# HELP llmao_stage_%s_total %s' % (counter, help_text),
+                      '# TYPE llmao_stage_%s_total counter' % counter]
+            lines += ['llmao_stage_%s_total{stage="%s"} %d' % (counter, name, entry[counter])
+                      for name, entry in snapshot.items()]
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str = METRICS_PATH):
+        '''
+        write prometheus_text() to path, replacing the file atomically so scrapers never read half of it
+        '''
+        tmp_name = path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp_name, 'w') as metrics_file:
+                metrics_file.write(self.prometheus_text())
+            os.replace(tmp_name, path)
+        except OSError:
+            pass
+
+
+_stage_metrics = StageMetrics()
+
+def get_stage_metrics() -> StageMetrics:
+    '''
+    shared StageMetrics every stage() block reports to
+    '''
+    return _stage_metrics
+
+
+def current_stage() -> str:
+    '''
+    name of the innermost stage block running in this context, None outside of any
+    '''
+    return _current_stage.get()
+
+
+def record(name: str, seconds: float):
+    '''
+    add a duration measured by hand (e.g. time to first token) to the metrics and the active collector
+    '''
+    _stage_metrics.observe(name, seconds)
+    timings = _collector.get()
+    if timings is not None:
+        timings.setdefault(name, []).append(seconds)
+
+
+def count_retry(name: str):
+    '''
+    count one retry of a stage, e.g. executing repaired SQL after the first query failed
+    '''
+    _stage_metrics.retry(name)
+
+
+@contextmanager
+def stage(name: str):
+    '''
+    time a block of the pipeline under a stage name, stages may nest; a block that raises is
+    counted as a failure of the stage
+    '''
+    token = _current_stage.set(name)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        _stage_metrics.failure(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_stage.reset(token)
+        record(name, elapsed)
+
+
+def timed(name: str):
+    '''
+    decorator running every call of a function as a stage
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def time_stream(chunks, name: str, first_name: str = None):
+    '''
+    pass a token stream through, recording the time to its first chunk as first_name and the time
+    until it is exhausted as name, both measured from the call
+    '''
+    start = time.perf_counter()
+    first = True
+    try:
+        for chunk in chunks:
+            if first and first_name is not None:
+                record(first_name, time.perf_counter() - start)
+            first = False
+            yield chunk
+    except Exception:
+        _stage_metrics.failure(name)
+        raise
+    record(name, time.perf_counter() - start)
+
+
+async def atime_stream(chunks, name: str, first_name: str = None):
+    '''
+    time_stream for async token streams
+    '''
+    start = time.perf_counter()
+    first = True
+    try:
+        async for chunk in chunks:
+            if first and first_name is not None:
+                record(first_name, time.perf_counter() - start)
+            first = False
+            yield chunk
+    except Exception:
+        _stage_metrics.failure(name)
+        raise
+    record(name, time.perf_counter() - start)
+
+
+@contextmanager
+def collect():
+    '''
+    gather the durations of every stage run in this context inside the block
+    returns
+        {stage: [seconds, ...]}, filled in as the stages finish
+    '''
+    timings = {}
+    token = _collector.set(timings)
+    try:
+        yield timings
+    finally:
+        _collector.reset(token)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = _stage_metrics.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes every few seconds would flood stderr
+        pass
+
+
+def serve_metrics(port: int = 9464, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    '''
+    serve the stage metrics at http://host:port/metrics from a daemon thread
+    returns
+        the server, call shutdown() to stop it
+    '''
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='llmao-metrics', daemon=True).start()
+    return server
+
+
+_dump_thread = None
+_dump_lock = threading.Lock()
+
+def start_metrics_dump(path: str = METRICS_PATH, interval: float = 15.0):
+    '''
+    write the stage metrics to path every interval seconds and on exit, started once per process
+    '''
+    global _dump_thread
+    with _dump_lock:
+        if _dump_thread is not None:
+            return _dump_thread
+
+        def dump_forever():
+            while True:
+                time.sleep(interval)
+                _stage_metrics.dump(path)
+
+        _dump_thread = threading.Thread(target=dump_forever, name='llmao-metrics-dump', daemon=True)
+        _dump_thread.start()
+        atexit.register(_stage_metrics.dump, path)
+    return _dump_thread
@@ -1,10 +1,10 @@
-import sqlite3
 from langfuse.callback import CallbackHandler
 from streamlit.runtime import get_instance
 from streamlit.runtime.scriptrunner import get_script_run_ctx
 import streamlit as st
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from utils.catalog import get_catalog
 
 # Add examples questions: queries here
 Queries = {
@@ -14,35 +14,13 @@ Queries = {
 # Question bank for random question button
 Questions = list(Queries.keys())
 
-# query to get all tables and columns from the AOP database
-info_query = """
-    SELECT m.name as tableName, 
-    p.name as columnName
-    FROM sqlite_master m
-    left outer join pragma_table_info((m.name)) p
-    on m.name <> p.name
-    order by tableName, columnName
-    ;
-    """
-
-# connect to db, execute query, and close connection
-db_name = './aopdb_08-25-2020.db'
-sqliteConnection = sqlite3.connect(db_name)
-cursor = sqliteConnection.cursor()
-cursor.execute(info_query)
-info_dict = cursor.fetchall()
-cursor.close()
-sqliteConnection.close()
-AOP_Info = {}
-
-for entry in info_dict:
-    table = entry[0]
-    # if the table has already been added to the AOP dictionary
-    if table in AOP_Info:
-        AOP_Info[table].append(entry[1])
-    # else create a dictionary entry for the table
-    else:
-        AOP_Info[table] = [entry[1]]
+def __getattr__(name):
+    '''
+    AOP_Info is served lazily from the shared schema catalog instead of being rebuilt at import time
+    '''
+    if name == 'AOP_Info':
+        return get_catalog().aop_info
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
 
 def get_session():
     '''
@@ -65,11 +43,8 @@ langfuse_handler = CallbackHandler(
     session_id = get_session()
 )
 
-def SQL_context_parser(llm, query, query_results):
-    '''
-    Build a full and complete sentence based off SQLite query, and query_results
-    '''
-    prompt = """ <instructions>
+# prompt turning a SQLite query and its results into context sentences
+CONTEXT_PROMPT = ChatPromptTemplate.from_template(""" <instructions>
     You are an expert in both adverse outcome pathways and SQLite queries. You will be given a SQLite query
     and the results of that SQLite query when executed on the adverse outcome pathway database. Your goal is
     to take the context given in order to construct a full and complete sentence that explains the query and the results.
@@ -78,11 +53,26 @@ def SQL_context_parser(llm, query, query_results):
     <context> 
     SQLite Query: {query}
     SQLite Query Results: {results}
-    """
+    """)
 
-    chain = ChatPromptTemplate.from_template(prompt) | llm | StrOutputParser()
+def SQL_context_parser(llm, query, query_results):
+    '''
+    Build a full and complete sentence based off SQLite query, and query_results
+    '''
+    chain = CONTEXT_PROMPT | llm | StrOutputParser()
 
     return chain.invoke({
         "query": query,
         "results": query_results
+    })
+
+async def SQL_context_parser_async(llm, query, query_results):
+    '''
+    SQL_context_parser for the async pipeline
+    '''
+    chain = CONTEXT_PROMPT | llm | StrOutputParser()
+
+    return await chain.ainvoke({
+        "query": query,
+        "results": query_results
     })
\ No newline at end of file
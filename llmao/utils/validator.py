@@ -0,0 +1,337 @@
+import difflib
+import re
+import sqlite3
+import threading
+from utils.catalog import get_catalog
+from utils.connection import get_pool
+from utils.result_cache import SQL_KEYWORDS
+
+# similarity (difflib ratio) from which an existing name is suggested for a misspelled one
+SUGGESTION_CUTOFF = 0.8
+
+# words that are neither keywords in SQL_KEYWORDS nor identifiers of the schema
+_NOT_IDENTIFIERS = SQL_KEYWORDS | {
+    'true', 'false', 'rowid', 'current_date', 'current_time', 'current_timestamp', 'nocase', 'binary', 'rtrim',
+    'text', 'integer', 'int', 'real', 'blob', 'numeric', 'varchar', 'filter', 'over', 'partition', 'window',
+    'rows', 'range', 'preceding', 'following', 'unbounded', 'current', 'row', 'values', 'regexp', 'isnull',
+    'notnull', 'if', 'indexed',
+}
+
+_FENCE = re.compile(r'```[ \t]*(?:sql|sqlite)?[ \t]*\n?(.*?)(?:```|$)', re.IGNORECASE | re.DOTALL)
+_START = re.compile(r'\b(SELECT|WITH)\b', re.IGNORECASE)
+_PARAGRAPH = re.compile(r'\n[ \t]*\n')
+_TOKEN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+  | (?P<number>\d+(?:\.\d*)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<space>\s+)
+  | (?P<other>.)
+    """, re.VERBOSE | re.DOTALL)
+
+
+class SQLValidationError(sqlite3.OperationalError):
+    '''
+    a generated query failed validation before it was executed
+
+    init params
+        message - what is wrong, the sqlite error message when preparing it failed
+        query - the query as extracted from the model's output
+        hints - [{'kind', 'name', ...}] found by the static identifier check
+    '''
+    def __init__(self, message: str, query: str = None, hints: list = None):
+        super().__init__(message)
+        self.query = query
+        self.hints = hints or []
+
+    def describe(self) -> str:
+        '''
+        the error and its hints as lines for the repair prompt
+        '''
+        return '\n'.join([str(self)] + [describe_hint(hint) for hint in self.hints])
+
+
+def describe_hint(hint: dict) -> str:
+    if hint['kind'] == 'unknown_table':
+        text = 'table ' + hint['name'] + ' does not exist'
+    elif hint['kind'] == 'column_elsewhere':
+        return ('column ' + hint['name'] + ' is not in ' + ', '.join(hint['tables']) + ', it is a column of '
+                + ', '.join(hint['owners']) + ' (join that table or use another column)')
+    else:
+        where = hint['table'] if hint.get('table') else ', '.join(hint.get('tables', [])) or 'the schema'
+        text = 'column ' + hint['name'] + ' does not exist in ' + where
+    if hint.get('suggestions'):
+        text += ', did you mean ' + ' or '.join(hint['suggestions']) + '?'
+    return text
+
+
+def error_hints(error: Exception) -> str:
+    '''
+    what to tell the repair prompt about a failed query
+    '''
+    failures = getattr(error, 'failures', None)
+    if failures:
+        # every SQL candidate failed, the first one is repaired
+        error = failures[0][1]
+    return error.describe() if isinstance(error, SQLValidationError) else str(error)
+
+
+def _tokens(sql: str) -> list:
+    return [(match.lastgroup, match.group()) for match in _TOKEN.finditer(sql)
+            if match.lastgroup not in ('space', 'comment')]
+
+
+_syntax = threading.local()
+
+def _parses(statement: str) -> bool:
+    '''
+    whether sqlite can parse a statement; it is prepared against an empty in-memory database, where
+    only a statement that got past the parser fails with "no such table" (or column, function)
+    '''
+    if not hasattr(_syntax, 'db'):
+        _syntax.db = sqlite3.connect(':memory:')
+    try:
+        _syntax.db.execute('EXPLAIN ' + statement)
+    except sqlite3.Error as error:
+        return str(error).startswith('no such ')
+    return True
+
+
+def _statement(text: str) -> str:
+    '''
+    the statement starting at the beginning of text, up to its first semicolon or trailing prose
+    '''
+    # explanations after a blank line are prose, unless they carry on with a clause
+    paragraphs = _PARAGRAPH.split(text)
+    kept = [paragraphs[0]]
+    for paragraph in paragraphs[1:]:
+        first = re.match(r'\s*(\w+)', paragraph)
+        if first is None or first.group(1).lower() not in SQL_KEYWORDS:
+            break
+        kept.append(paragraph)
+    text = '\n'.join(kept)
+
+    # cut at the first semicolon outside of string literals and quoted identifiers
+    for match in _TOKEN.finditer(text):
+        if match.group() == ';' and match.lastgroup == 'other':
+            text = text[:match.start()]
+            break
+    text = text.strip()
+    # a statement quoted as a whole, like the example in the generation prompt
+    if text[-1:] in ('"', '`') and text.count(text[-1]) % 2 == 1:
+        text = text[:-1].rstrip()
+    return text
+
+
+def extract_sql(text: str) -> str:
+    '''
+    the first SQL statement of a model's output: markdown fences, leading and trailing prose,
+    surrounding quotes and anything after the first semicolon are dropped. "select" and "with" also
+    start sentences ("Here is a query to select two chemicals:"), so the statement is the first one
+    from a SELECT or WITH that sqlite can parse, or from the first of them when none parses
+    returns
+        the statement, '' when the text contains no SELECT or WITH
+    '''
+    fenced = _FENCE.search(text)
+    if fenced is not None and _START.search(fenced.group(1)):
+        text = fenced.group(1)
+    statements = [_statement(text[start.start():]) for start in _START.finditer(text)]
+    if not statements:
+        return ''
+    return next((statement for statement in statements if _parses(statement)), statements[0])
+
+
+def _references(tokens: list) -> tuple:
+    '''
+    returns
+        ({alias or table (lower case): table}, {cte and column alias names (lower case)}, [table names in order])
+    '''
+    aliases, defined, tables = {}, set(), []
+    for i, (kind, text) in enumerate(tokens):
+        upper = text.upper()
+        if kind == 'word' and upper == 'AS' and i + 1 < len(tokens):
+            defined.add(tokens[i + 1][1].strip('"`[]').lower())
+        # WITH name AS (...), name AS (...)
+        next_cte = text == ',' and [token[1].upper() for token in tokens[i + 2:i + 4]] == ['AS', '(']
+        if (kind == 'word' and upper == 'WITH' or next_cte) and i + 1 < len(tokens):
+            defined.add(tokens[i + 1][1].strip('"`[]').lower())
+        if kind != 'word' or upper not in ('FROM', 'JOIN'):
+            continue
+        # FROM a [AS] x, b [AS] y ... and JOIN a [AS] x
+        j = i + 1
+        while j < len(tokens):
+            if tokens[j][1] == '(':
+                break
+            name = tokens[j][1].strip('"`[]')
+            j += 1
+            if j + 1 < len(tokens) and tokens[j][1] == '.':
+                # schema qualified, e.g. the attached full-text tables, left to sqlite
+                name = None
+                j += 2
+            if name is not None:
+                tables.append(name)
+            alias = None
+            if j < len(tokens) and tokens[j][1].upper() == 'AS':
+                j += 1
+            if j < len(tokens) and tokens[j][0] in ('word', 'quoted') and tokens[j][1].lower() not in _NOT_IDENTIFIERS:
+                alias = tokens[j][1].strip('"`[]')
+                j += 1
+            if name is not None:
+                aliases[name.lower()] = name
+                if alias is not None:
+                    aliases[alias.lower()] = name
+            elif alias is not None:
+                defined.add(alias.lower())
+            if upper == 'JOIN' or j >= len(tokens) or tokens[j][1] != ',':
+                break
+            j += 1
+    return aliases, defined, tables
+
+
+class SQLValidator():
+    '''
+    Checks generated SQL before it runs: the statement is extracted from the model's output, its table
+    and column names are checked against the schema catalog, and it is prepared with EXPLAIN, which
+    compiles it without reading any row. The row cap is left to the QueryExecutor, which sees the plan
+    and adds a LIMIT to a full scan of a large table, or rejects it. A query failing any of this
+    raises SQLValidationError in microseconds instead of failing at execution, and the names it got
+    wrong come with the closest ones that exist, for the repair prompt.
+
+    init params
+        catalog - SchemaCatalog, defaults to the shared one
+        pool - ConnectionPool to prepare on, defaults to the shared one
+    '''
+    def __init__(self, catalog=None, pool=None):
+        self._catalog = catalog
+        self._pool = pool
+        self.counts = {'validated': 0, 'rejected': 0, 'extracted': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def catalog(self):
+        return self._catalog if self._catalog is not None else get_catalog()
+
+    @property
+    def pool(self):
+        return self._pool if self._pool is not None else get_pool()
+
+    def _count(self, event: str):
+        with self._lock:
+            self.counts[event] += 1
+
+    def check_identifiers(self, query: str) -> list:
+        '''
+        table and column names of a query that are not in the schema
+        returns
+            [{'kind': 'unknown_table' | 'unknown_column' | 'column_elsewhere', 'name', ...}]
+        '''
+        # the materialized summary tables are queried like any other table
+        aop_info = dict(self.catalog.aop_info, **self.catalog.summary_tables)
+        tables = {table.lower(): table for table in aop_info}
+        columns = {table: {column.lower(): column for column in aop_info[table]} for table in aop_info}
+        tokens = _tokens(query)
+        aliases, defined, referenced = _references(tokens)
+
+        hints = []
+        known = []
+        for name in referenced:
+            table = tables.get(name.lower())
+            if table is not None:
+                known.append(table)
+            elif name.lower() not in defined:
+                hints.append({'kind': 'unknown_table', 'name': name,
+                              'suggestions': difflib.get_close_matches(name, list(aop_info), n=3, cutoff=SUGGESTION_CUTOFF)})
+        # subqueries and CTEs make the column check unreliable, their output columns are unknown here
+        if any(name.lower() in defined for name in referenced) or not known:
+            return hints
+
+        seen = set()
+        for i, (kind, text) in enumerate(tokens):
+            if kind not in ('word', 'quoted') or (i > 0 and tokens[i - 1][1] == '.'):
+                continue
+            if i + 1 < len(tokens) and tokens[i + 1][1] in ('(', '.'):
+                if tokens[i + 1][1] == '.' and i + 2 < len(tokens):
+                    # alias.column
+                    table = aliases.get(text.strip('"`[]').lower())
+                    column = tokens[i + 2][1].strip('"`[]')
+                    if table in columns and column != '*' and column.lower() not in columns[table] \
+                            and column.lower() not in _NOT_IDENTIFIERS and (table, column.lower()) not in seen:
+                        seen.add((table, column.lower()))
+                        suggestions = difflib.get_close_matches(column, aop_info[table], n=3, cutoff=SUGGESTION_CUTOFF)
+                        hints.append({'kind': 'unknown_column', 'name': column, 'table': table,
+                                      'suggestions': suggestions})
+                continue
+            name = text.strip('"`[]')
+            lower = name.lower()
+            if kind == 'word' and lower in _NOT_IDENTIFIERS or lower in aliases or lower in defined \
+                    or lower in seen:
+                continue
+            if any(lower in columns[table] for table in known):
+                continue
+            if kind == 'quoted':
+                # sqlite reads an unknown double-quoted name as a string literal, which may well be intended
+                continue
+            seen.add(lower)
+            owners = [table for table in aop_info if lower in columns[table]]
+            if owners:
+                hints.append({'kind': 'column_elsewhere', 'name': name, 'tables': known, 'owners': owners})
+            else:
+                candidates = [column for table in known for column in aop_info[table]]
+                hints.append({'kind': 'unknown_column', 'name': name, 'tables': known,
+                              'suggestions': difflib.get_close_matches(name, candidates, n=3, cutoff=SUGGESTION_CUTOFF)})
+        return hints
+
+    def prepare(self, query: str):
+        '''
+        compile the query with EXPLAIN, sqlite3 errors propagate
+        '''
+        with self.pool.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + query)
+
+    def validate(self, text: str) -> str:
+        '''
+        returns
+            the query to execute
+        raises
+            SQLValidationError (a sqlite3.OperationalError)
+        '''
+        query = extract_sql(text)
+        if query != text.strip().rstrip(';').strip():
+            self._count('extracted')
+        if not query:
+            self._count('rejected')
+            raise SQLValidationError('no SELECT statement found in the response', query=text)
+
+        try:
+            self.prepare(query)
+        except sqlite3.Error as error:
+            self._count('rejected')
+            # only worked out for a query sqlite refused, on one it accepts they would be false alarms
+            # of the static check (e.g. an alias it missed)
+            raise SQLValidationError(str(error), query=query, hints=self.check_identifiers(query)) from error
+
+        self._count('validated')
+        return query
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+def get_validator() -> SQLValidator:
+    '''
+    shared SQLValidator for the process
+    '''
+    global _validator
+    if _validator is None:
+        with _validator_lock:
+            if _validator is None:
+                _validator = SQLValidator()
+    return _validator
+
+
+def validate_query(text: str) -> str:
+    '''
+    shorthand for get_validator().validate(text)
+    '''
+    return get_validator().validate(text)